@@ -17,8 +17,17 @@ please see
 Note: this file is for support purposes only, and is not part of your
 submission.
 """
+import pickle
+
+import pytest
+
+from concurrent_engine import ConcurrentEngine
+from dawg import DawgAutocompleter
+from persistent import PersistentPrefixTree
 from prefix_tree import SimplePrefixTree, CompressedPrefixTree
-from autocomplete_engines import SentenceAutocompleteEngine
+from sharded import ShardedAutocompleter
+from autocomplete_engines import LetterAutocompleteEngine, \
+    SentenceAutocompleteEngine, MelodyAutocompleteEngine
 
 
 def test_simple_prefix_tree_structure() -> None:
@@ -68,10 +77,10 @@ def test_simple_prefix_tree_autocomplete() -> None:
     # SimplePrefixTree.autocomplete.
     assert t.autocomplete([]) == [('dog', 4.0), ('car', 3.0), ('cat', 2.0)]
 
-    # But keep in mind that the greedy algorithm here does not necessarily
-    # return the highest-weight values!! In this case, the ['c'] subtree
-    # is recursed on first.
-    assert t.autocomplete([], 1) == [('car', 3.0)]
+    # Even though the ['c'] subtree is heavier, the single heaviest value
+    # is in the ['d'] subtree, and that is the one returned.
+    assert t.autocomplete([], 1) == [('dog', 4.0)]
+    assert t.autocomplete([], 2) == [('dog', 4.0), ('car', 3.0)]
 
 
 def test_simple_prefix_tree_remove() -> None:
@@ -138,6 +147,138 @@ def test_sentence_autocompleter() -> None:
     assert results[0][1] == 15.0 + 6.5
 
 
+def test_letter_autocompleter_sanitization(tmp_path) -> None:
+    """Lines are lowercased and stripped of punctuation, and lines without
+    an alphanumeric character are skipped.
+    """
+    path = tmp_path / 'lines.txt'
+    path.write_text('Hello, World!\n--\nhello world\nCaf\u00c9_42\n', 'utf8')
+    engine = LetterAutocompleteEngine({
+        'file': str(path),
+        'autocompleter': 'compressed',
+        'weight_type': 'sum'
+    })
+    assert len(engine.autocompleter) == 2
+    assert engine.autocomplete('HELLO') == [('hello world', 2.0)]
+    assert engine.autocomplete('c') == [('caf\u00e942', 1.0)]
+
+
+def test_letter_autocompleter_ingest(tmp_path) -> None:
+    """Ingesting lines in batches gives the same results as reading them
+    from the engine's file.
+    """
+    lines = ['car\n', 'Cat!\n', 'dog\n', 'car\n', 'cart\n', '??\n', 'cat\n']
+    path = tmp_path / 'lines.txt'
+    path.write_text(''.join(lines))
+    empty = tmp_path / 'empty.txt'
+    empty.write_text('')
+    config = {'autocompleter': 'compressed', 'weight_type': 'sum'}
+    engine = LetterAutocompleteEngine(dict(config, file=str(path)))
+    streamed = LetterAutocompleteEngine(dict(config, file=str(empty)))
+    streamed.ingest((line for line in lines), batch_size=2)
+    assert len(streamed.autocompleter) == 4
+    assert sorted(streamed.autocomplete('ca')) == \
+        sorted(engine.autocomplete('ca'))
+    assert streamed.autocomplete('ca', 1)[0][1] == 2.0
+
+
+def test_letter_autocompleter_cache(tmp_path) -> None:
+    """Cached results answer smaller limits, and are dropped only when an
+    ingest or remove changes them.
+    """
+    path = tmp_path / 'lines.txt'
+    path.write_text('car\ncar\ncat\ndog\n')
+    engine = LetterAutocompleteEngine({'file': str(path),
+                                       'autocompleter': 'compressed',
+                                       'weight_type': 'sum',
+                                       'cache_size': 2})
+    assert engine.autocomplete('ca', 2) == [('car', 2.0), ('cat', 1.0)]
+    assert engine.autocomplete('ca', 1) == [('car', 2.0)]
+    assert engine.autocomplete('d') == [('dog', 1.0)]
+    assert engine.cache_info()[:2] == (1, 2)
+
+    engine.ingest(['cat', 'cat'])
+    assert engine.autocomplete('d') == [('dog', 1.0)]
+    assert engine.autocomplete('ca', 1) == [('cat', 3.0)]
+    engine.remove('c')
+    assert engine.autocomplete('ca') == []
+    assert engine.autocomplete('do') == [('dog', 1.0)]
+    info = engine.cache_info()
+    assert (info.hits, info.misses, info.evictions) == (2, 5, 1)
+
+
+def test_letter_autocompleter_session(tmp_path) -> None:
+    """Typing a prefix one character at a time gives the same results as
+    autocomplete, including after deleting characters.
+    """
+    path = tmp_path / 'lines.txt'
+    path.write_text('car\ncar\ncat\ncart\ndog\n')
+    for autocompleter in ['simple', 'compressed']:
+        engine = LetterAutocompleteEngine({'file': str(path),
+                                           'autocompleter': autocompleter,
+                                           'weight_type': 'sum'})
+        session = engine.session()
+        for char in 'Ca!r':
+            session.push(char)
+            typed = ''.join(session.typed)
+            assert session.results(2) == engine.autocomplete(typed, 2)
+        assert session.results() == [('car', 2.0), ('cart', 1.0)]
+        session.push('x')
+        assert session.results() == []
+        assert session.pop() == 'x'
+        assert session.pop() == 'r'
+        assert session.results(1) == [('car', 2.0)]
+        assert sorted(session.results()) == \
+            sorted(engine.autocomplete('ca'))
+
+
+def test_letter_autocompleter_dawg(tmp_path) -> None:
+    """The DAWG backend gives the same results as a prefix tree, while
+    sharing the common endings of lines.
+    """
+    path = tmp_path / 'lines.txt'
+    path.write_text('taps\ntops\ntops\ntap\ntop\n')
+    config = {'file': str(path), 'weight_type': 'sum'}
+    dawg = LetterAutocompleteEngine(dict(config, autocompleter='dawg'))
+    tree = LetterAutocompleteEngine(dict(config, autocompleter='compressed'))
+    # The states are the start, after 't', after 'tap' or 'top', and after
+    # 'taps' or 'tops'.
+    assert dawg.autocompleter.states == 4
+    assert dawg.autocomplete('t', 1) == [('tops', 2.0)]
+    assert sorted(dawg.autocomplete('t')) == sorted(tree.autocomplete('t'))
+
+    dawg.ingest(['tip', 'taps'])
+    dawg.remove('to')
+    assert dawg.autocomplete('t') == [('taps', 2.0), ('tap', 1.0),
+                                      ('tip', 1.0)]
+
+    dawg.save(str(tmp_path / 'dawg.bin'))
+    loaded = LetterAutocompleteEngine.load(str(tmp_path / 'dawg.bin'))
+    assert sorted(loaded.autocomplete('t')) == sorted(dawg.autocomplete('t'))
+    loaded.close()
+
+
+def test_dawg_single_inserts_and_removes() -> None:
+    """Queries on a DAWG never rebuild its graph, single inserts are only
+    merged into it in bulk, and removals only give values weight 0.
+    """
+    d = DawgAutocompleter.from_items('sum', [('tap', 1.0, list('tap')),
+                                             ('top', 2.0, list('top'))])
+    states = d.states
+    d.insert('tip', 3.0, list('tip'))
+    assert d.autocomplete(['t'], 2) == [('tip', 3.0), ('top', 2.0)]
+    assert list(d.items()) == [('tap', 1.0, list('tap')),
+                               ('tip', 3.0, list('tip')),
+                               ('top', 2.0, list('top'))]
+    d.remove(['t', 'o'])
+    assert d.states == states
+    assert len(d) == 2
+    assert d.autocomplete(['t']) == [('tip', 3.0), ('tap', 1.0)]
+    d.insert('top', 0.5, list('top'))
+    assert d.autocomplete(['t', 'o']) == [('top', 0.5)]
+    assert d.states == states
+
+
 def test_compressed_prefix_tree_structure() -> None:
     """This is a test for the correct structure of a compressed prefix tree.
 
@@ -169,6 +310,308 @@ def test_compressed_prefix_tree_structure() -> None:
     assert right.weight == 4.0
 
 
+def test_compressed_prefix_tree_split_and_remove() -> None:
+    """Inserting a value whose prefix diverges in the middle of an existing
+    prefix splits that prefix, and removing it merges the prefix back.
+    """
+    t = CompressedPrefixTree('sum')
+    t.insert('cart', 2.0, ['c', 'a', 'r', 't'])
+    t.insert('cab', 1.0, ['c', 'a', 'b'])
+    assert t.value == ['c', 'a']
+    assert [s.value for s in t.subtrees] == [['c', 'a', 'r', 't'],
+                                             ['c', 'a', 'b']]
+    assert t.autocomplete(['c', 'a', 'r']) == [('cart', 2.0)]
+    assert t.autocomplete(['c', 'x']) == []
+
+    t.remove(['c', 'a', 'b'])
+    assert len(t) == 1
+    assert t.value == ['c', 'a', 'r', 't']
+    assert t.subtrees[0].value == 'cart'
+
+
+def test_prefix_tree_top_k_cache() -> None:
+    """A tree caching its heaviest values gives the same answers as one that
+    doesn't, including after weights change and values are removed.
+    """
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        cached = cls('sum', 2)
+        plain = cls('sum')
+        for t in (cached, plain):
+            t.insert('cat', 2.0, ['c', 'a', 't'])
+            t.insert('car', 3.0, ['c', 'a', 'r'])
+            t.insert('cab', 1.0, ['c', 'a', 'b'])
+            t.insert('cab', 5.0, ['c', 'a', 'b'])
+        assert cached.autocomplete(['c'], 2) == [('cab', 6.0), ('car', 3.0)]
+        assert cached.autocomplete(['c'], 2) == plain.autocomplete(['c'], 2)
+        assert cached.autocomplete(['c']) == plain.autocomplete(['c'])
+
+        for t in (cached, plain):
+            t.remove(['c', 'a', 'b'])
+        assert cached.autocomplete(['c'], 2) == [('car', 3.0), ('cat', 2.0)]
+        assert cached.autocomplete(['c'], 1) == plain.autocomplete(['c'], 1)
+
+
+def test_prefix_tree_long_prefix() -> None:
+    """Prefix trees handle values far longer than the recursion limit."""
+    value = 'frodo ' * 1000
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        t = cls('sum')
+        t.insert(value, 1.0, list(value))
+        t.insert(value[:-1], 2.0, list(value[:-1]))
+        assert t.autocomplete(list('frodo')) == [(value[:-1], 2.0),
+                                                 (value, 1.0)]
+        t.remove(list(value[:-1]))
+        assert len(t) == 0
+
+
+def test_prefix_tree_repeat_insert() -> None:
+    """Inserting a value again adds to its weight and reorders the trees on
+    its path, also after values were removed or merged in.
+    """
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        t = cls('sum')
+        t.insert('cat', 1.0, ['c', 'a', 't'])
+        t.insert('car', 2.0, ['c', 'a', 'r'])
+        t.insert('dog', 2.5, ['d', 'o', 'g'])
+        t.insert('cat', 3.0, ['c', 'a', 't'])
+        assert t.autocomplete([]) == [('cat', 4.0), ('dog', 2.5),
+                                      ('car', 2.0)]
+        t.remove(['c', 'a', 't'])
+        t.insert('cat', 1.0, ['c', 'a', 't'])
+        t.merge(cls.from_items('sum', [('dog', 1.0, ['d', 'o', 'g'])]))
+        t.insert('dog', 1.0, ['d', 'o', 'g'])
+        assert t.autocomplete([]) == [('dog', 4.5), ('car', 2.0),
+                                      ('cat', 1.0)]
+        assert len(t) == 3
+
+
+def test_prefix_tree_lazy_remove() -> None:
+    """Tombstoned removals give the same answers as removing right away, and
+    compacting gives the same tree.
+    """
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        eager = cls('sum', 2)
+        lazy = cls('sum', 2, compact_after=10)
+        for t in (eager, lazy):
+            t.insert('cat', 2.0, ['c', 'a', 't'])
+            t.insert('car', 3.0, ['c', 'a', 'r'])
+            t.insert('dog', 4.0, ['d', 'o', 'g'])
+            t.remove(['c', 'a', 't'])
+            t.insert('car', 0.5, ['c', 'a', 'r'])
+        assert len(lazy) == 2
+        assert lazy.autocomplete([], 2) == [('dog', 4.0), ('car', 3.5)]
+        assert lazy.autocomplete(['c']) == eager.autocomplete(['c'])
+        lazy.compact()
+        assert str(lazy) == str(eager)
+
+
+def test_prefix_tree_from_items() -> None:
+    """Building a tree in bulk gives the same tree as inserting one item at a
+    time, with repeated values combined.
+    """
+    items = [('dog', 4.0, ['d', 'o', 'g']),
+             ('cat', 2.0, ['c', 'a', 't']),
+             ('car', 3.0, ['c', 'a', 'r']),
+             ('cat', 1.5, ['c', 'a', 't'])]
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        t = cls.from_items('sum', items)
+        expected = cls('sum')
+        for value, weight, prefix in items:
+            expected.insert(value, weight, prefix)
+        assert str(t) == str(expected)
+        assert len(t) == 3
+        assert t.autocomplete(['c']) == [('cat', 3.5), ('car', 3.0)]
+
+
+def test_prefix_tree_autocomplete_many() -> None:
+    """Answering several prefixes at once gives the same answers, in the same
+    order, as answering them one at a time.
+    """
+    prefixes = [['c', 'a', 'r'], [], ['c'], ['x', 'y'], ['c', 'a'], ['c']]
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        t = cls('sum')
+        t.insert('cart', 2.0, ['c', 'a', 'r', 't'])
+        t.insert('cab', 1.0, ['c', 'a', 'b'])
+        t.insert('dog', 4.0, ['d', 'o', 'g'])
+        assert t.autocomplete_many(prefixes, 2) == \
+            [t.autocomplete(prefix, 2) for prefix in prefixes]
+        assert t.autocomplete_many([]) == []
+
+
+def test_prefix_tree_freeze() -> None:
+    """A frozen tree gives the same answers as the tree it was made from."""
+    items = [(word, float(len(word)), list(word))
+             for word in ['cart', 'cab', 'car', 'dog', 'do', 'a']]
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        t = cls.from_items('sum', items)
+        frozen = t.freeze()
+        assert len(frozen) == 6
+        for prefix in [[], ['c'], ['c', 'a', 'r'], ['d', 'o'], ['x']]:
+            assert frozen.autocomplete(prefix) == t.autocomplete(prefix)
+            assert frozen.autocomplete(prefix, 1) == t.autocomplete(prefix, 1)
+    assert CompressedPrefixTree('sum').freeze().autocomplete([]) == []
+
+
+def test_prefix_tree_parallel_build() -> None:
+    """Building a tree in worker processes gives the same tree as building
+    it in this one, and trees survive pickling.
+    """
+    items = [('dog', 4.0, ['d', 'o', 'g']),
+             ('cat', 2.0, ['c', 'a', 't']),
+             ('car', 3.0, ['c', 'a', 'r']),
+             ('dot', 1.0, ['d', 'o', 't']),
+             ('cat', 1.5, ['c', 'a', 't'])]
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        t = cls.from_items('average', items, workers=2)
+        expected = cls.from_items('average', items)
+        assert str(t) == str(expected)
+        assert t.weight == expected.weight == 11.5 / 4
+        assert str(pickle.loads(pickle.dumps(t))) == str(expected)
+
+
+def test_persistent_prefix_tree_batch() -> None:
+    """Snapshots of a persistent prefix tree keep their version, and the
+    writes of a batch are only seen once it ends.
+    """
+    t = PersistentPrefixTree('sum')
+    t.insert('cat', 2.0, ['c', 'a', 't'])
+    t.insert('car', 3.0, ['c', 'a', 'r'])
+    before = t.snapshot()
+    with t.batch() as draft:
+        draft.insert('cat', 2.0, ['c', 'a', 't'])
+        draft.remove(['c', 'a', 'r'])
+        assert t.autocomplete(['c']) == [('car', 3.0), ('cat', 2.0)]
+    assert t.autocomplete(['c']) == [('cat', 4.0)]
+    assert before.autocomplete(['c']) == [('car', 3.0), ('cat', 2.0)]
+    assert len(t) == 1 and len(before) == 2
+
+
+def test_letter_autocompleter_persistent(tmp_path) -> None:
+    """The persistent backend honours the weight type, rejects top_k, and
+    can be saved.
+    """
+    path = tmp_path / 'lines.txt'
+    path.write_text('car\ncar\ncat\n')
+    config = {'file': str(path), 'autocompleter': 'persistent',
+              'weight_type': 'average'}
+    engine = LetterAutocompleteEngine(config)
+    assert engine.autocompleter.weight == 1.5
+    engine.save(str(tmp_path / 'tree.bin'))
+    loaded = LetterAutocompleteEngine.load(str(tmp_path / 'tree.bin'))
+    assert loaded.autocomplete('ca') == [('car', 2.0), ('cat', 1.0)]
+    loaded.close()
+    with pytest.raises(ValueError):
+        LetterAutocompleteEngine(dict(config, top_k=2))
+
+
+def test_concurrent_engine(tmp_path) -> None:
+    """Queries submitted to a ConcurrentEngine give the engine's results,
+    and every query and write is counted by its lock.
+    """
+    path = tmp_path / 'lines.txt'
+    path.write_text('car\ncar\ncat\ndog\n')
+    engine = ConcurrentEngine(LetterAutocompleteEngine({
+        'file': str(path), 'autocompleter': 'compressed',
+        'weight_type': 'sum', 'cache_size': 2}), 2)
+    futures = [engine.submit_autocomplete(prefix, 1)
+               for prefix in ['c', 'd', 'c']]
+    assert [f.result() for f in futures] == \
+        [[('car', 2.0)], [('dog', 1.0)], [('car', 2.0)]]
+    engine.ingest(['cat', 'cat'])
+    engine.remove('d')
+    assert engine.autocomplete_many(['c', 'd'], 1) == [[('cat', 3.0)], []]
+    engine.close()
+    assert engine.submit_autocomplete('ca').result() == \
+        [('cat', 3.0), ('car', 2.0)]
+    info = engine.lock_info()
+    assert (info.reads, info.writes) == (5, 2)
+    assert info.max_read_wait <= info.read_wait
+
+
+def test_concurrent_engine_dawg(tmp_path) -> None:
+    """Lines ingested into a ConcurrentEngine with the DAWG backend are
+    merged into the graph by the write, so concurrent queries only read it.
+    """
+    path = tmp_path / 'lines.txt'
+    path.write_text(''.join(['k%d\n' % i for i in range(2000)]))
+    engine = ConcurrentEngine(LetterAutocompleteEngine({
+        'file': str(path), 'autocompleter': 'dawg', 'weight_type': 'sum'}), 4)
+    engine.ingest(['0a%d' % i for i in range(50)])
+    assert engine.engine.autocompleter._pending == {}
+    futures = [engine.submit_autocomplete(prefix)
+               for prefix in ['0a', 'k'] * 10]
+    assert [len(f.result()) for f in futures] == [50, 2000] * 10
+    engine.close()
+
+
+def test_sharded_autocompleter() -> None:
+    """A sharded autocompleter merges its shards' answers in weight order,
+    and can be closed more than once."""
+    items = [('dog', 4.0, ['d', 'o', 'g']),
+             ('cat', 2.0, ['c', 'a', 't']),
+             ('car', 3.0, ['c', 'a', 'r']),
+             ('cab', 1.0, ['c', 'a', 'b'])]
+    t = ShardedAutocompleter.from_items(CompressedPrefixTree, 'sum', items, 3)
+    t.insert('cat', 2.5, ['c', 'a', 't'])
+    assert len(t) == 4
+    assert t.autocomplete(['c']) == [('cat', 4.5), ('car', 3.0), ('cab', 1.0)]
+    assert t.autocomplete([], 2) == [('cat', 4.5), ('dog', 4.0)]
+    t.remove(['c', 'a', 'r'])
+    assert t.autocomplete(['c'], 2) == [('cat', 4.5), ('cab', 1.0)]
+    t.close()
+    t.close()
+    assert t.autocomplete(['c']) == [('cat', 4.5), ('cab', 1.0)]
+    assert [len(shard) for shard in t._local] == [2, 0, 1]
+
+
+def test_letter_autocompleter_sharded(tmp_path) -> None:
+    """A sharded engine can be saved as one snapshot, and closed."""
+    path = tmp_path / 'lines.txt'
+    path.write_text('car\ncar\ncat\ndog\n')
+    engine = LetterAutocompleteEngine({'file': str(path),
+                                       'autocompleter': 'compressed',
+                                       'weight_type': 'sum', 'shards': 3})
+    engine.save(str(tmp_path / 'tree.bin'))
+    engine.close()
+    loaded = LetterAutocompleteEngine.load(str(tmp_path / 'tree.bin'))
+    assert len(loaded.autocompleter) == 3
+    assert loaded.autocomplete('ca') == [('car', 2.0), ('cat', 1.0)]
+    loaded.close()
+
+
+def test_prefix_tree_snapshot(tmp_path) -> None:
+    """A loaded snapshot answers the same queries as the saved tree."""
+    path = str(tmp_path / 'tree.bin')
+    for cls in (SimplePrefixTree, CompressedPrefixTree):
+        t = cls('sum')
+        t.insert('cat', 2.0, ['c', 'a', 't'])
+        t.insert('car', 3.0, ['c', 'a', 'r'])
+        t.insert('dog', 4.0, ['d', 'o', 'g'])
+        t.save(path)
+        s = cls.load(path)
+        assert len(s) == 3
+        assert s.autocomplete([]) == [('dog', 4.0), ('car', 3.0), ('cat', 2.0)]
+        assert s.autocomplete(['c', 'a'], 1) == [('car', 3.0)]
+        assert s.autocomplete(['c', 'o']) == []
+        s.close()
+
+
+def test_melody_autocompleter_names(tmp_path) -> None:
+    """Melody results carry the name of the first line with their notes."""
+    path = tmp_path / 'melodies.csv'
+    path.write_text('first,60,100,62,100,,\n'
+                    'second,64,100,62,100\n'
+                    'third,60,100,62,100\n')
+    engine = MelodyAutocompleteEngine({
+        'file': str(path),
+        'autocompleter': 'simple',
+        'weight_type': 'sum'
+    })
+    results = engine.autocomplete([2])
+    assert [(m.name, m.notes, w) for m, w in results] == \
+        [('first', [(60, 100), (62, 100)], 2.0)]
+
+
 if __name__ == '__main__':
     import pytest
     pytest.main(['a2_sample_test.py'])
@@ -15,10 +15,165 @@ top-level functions to this file.
 """
 from __future__ import annotations
 import csv
-from typing import Any, Dict, List, Optional, Tuple
+import re
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, \
+    TextIO, Tuple
 
 from melody import Melody
-from prefix_tree import SimplePrefixTree, CompressedPrefixTree
+from prefix_tree import AutocompleteSession, SimplePrefixTree, \
+    CompressedPrefixTree
+from query_cache import CacheInfo, QueryCache
+
+# The number of characters of a text file sanitized at once.
+CHUNK_SIZE = 1 << 20
+
+# The default number of lines read by each batch of ingest.
+BATCH_SIZE = 100000
+
+# Characters removed by sanitization: everything but letters, numbers and
+# spaces (\w also matches '_', which is not alphanumeric).
+_UNSANITARY = re.compile(r'[^\w ]|_')
+
+# The ASCII characters removed by sanitization, except newlines, as bytes.
+# Whole chunks of a file are sanitized by deleting these from their UTF-8
+# encoding, which is much faster than a regex, and only the lines left with
+# non-ASCII characters go through _UNSANITARY.
+_UNSANITARY_ASCII = bytes(i for i in range(128)
+                          if not (chr(i).isalnum() or chr(i) in ' \n'))
+
+# Characters removed from a weight before it is converted to a float.
+_NOT_WEIGHT = re.compile(r'[^\d.]')
+
+
+################################################################################
+# Text sanitization
+################################################################################
+def sanitize(text: str) -> str:
+    """Return <text> in lowercase, with every character that is not
+    alphanumeric or a space removed.
+
+    >>> sanitize('What a Wonderful, World!')
+    'what a wonderful world'
+    """
+    return _UNSANITARY.sub('', text.lower())
+
+
+def sanitize_lines(chunks: Iterable[str],
+                   tokenize: Callable[[str], List[str]]) -> \
+        Iterator[Tuple[str, List[str]]]:
+    """Yield a tuple (cleaned string, tokens) for each line of the text
+    made up of <chunks>, where the cleaned string is the sanitized line and
+    tokens is tokenize applied to it.
+
+    Lines without at least one alphanumeric character are skipped. The
+    chunks may split lines anywhere; each run of complete lines is
+    sanitized at once.
+
+    >>> list(sanitize_lines(['Hi, Bo', 'b!\\n--\\nA b'], str.split))
+    [('hi bob', ['hi', 'bob']), ('a b', ['a', 'b'])]
+    """
+    rest = ''
+    for chunk in chunks:
+        text = rest + chunk
+        end = text.rfind('\n') + 1
+        rest = text[end:]
+        cleaned = text[:end].lower().encode('utf8', 'surrogatepass').translate(
+            None, _UNSANITARY_ASCII).decode('utf8', 'surrogatepass')
+        for clean in cleaned.split('\n'):
+            if not clean.isascii():
+                clean = _UNSANITARY.sub('', clean)
+            if clean.strip():
+                yield clean, tokenize(clean)
+    clean = sanitize(rest)
+    if clean.strip():
+        yield clean, tokenize(clean)
+
+
+################################################################################
+# Keystroke sessions
+################################################################################
+class EngineSession:
+    """A prefix typed into an autocomplete engine one character (or, for
+    melodies, one interval) at a time.
+
+    Each keystroke turns what has been typed into a prefix sequence, and
+    only the elements of that sequence that changed are popped from and
+    pushed onto the session of the engine's Autocompleter, so typing a
+    letter costs one step down the prefix tree, and results continues the
+    search of the previous prefix (see AutocompleteSession).
+
+    A session must not be used after its engine is changed.
+
+    === Attributes ===
+    typed:
+        The characters (or intervals) typed so far.
+
+    === Private Attributes ===
+    _session:
+        The session of the engine's Autocompleter.
+    _to_prefix:
+        Returns the prefix sequence for what has been typed.
+    _convert:
+        Returns the engine's matches for a list of the Autocompleter's
+        matches, or None if they are the same.
+    """
+    typed: List
+    _session: AutocompleteSession
+    _to_prefix: Callable[[List], List]
+    _convert: Optional[Callable[[List[Tuple[Any, float]]], List]]
+
+    def __init__(self, session: AutocompleteSession,
+                 to_prefix: Callable[[List], List],
+                 convert: Optional[Callable[[List[Tuple[Any, float]]],
+                                            List]] = None) -> None:
+        """Initialize a session with nothing typed, on the Autocompleter
+        <session>.
+        """
+        self.typed = []
+        self._session = session
+        self._to_prefix = to_prefix
+        self._convert = convert
+
+    def push(self, item: Any) -> None:
+        """Type <item> at the end of the prefix."""
+        self.typed.append(item)
+        self._sync()
+
+    def pop(self) -> Any:
+        """Remove and return the last character (or interval) typed.
+
+        Precondition: something has been typed.
+        """
+        item = self.typed.pop()
+        self._sync()
+        return item
+
+    def results(self, limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for what has been typed, as the
+        engine's autocomplete would.
+
+        Precondition: limit is None or limit > 0.
+        """
+        results = self._session.results(limit)
+        if self._convert is None:
+            return results
+        return self._convert(results)
+
+    def _sync(self) -> None:
+        """Make the prefix of the Autocompleter's session the prefix sequence
+        for what has been typed.
+        """
+        prefix = self._to_prefix(self.typed)
+        current = self._session.prefix
+        shared = 0
+        while shared < min(len(prefix), len(current)) and \
+                prefix[shared] == current[shared]:
+            shared += 1
+        while len(current) > shared:
+            self._session.pop()
+        for item in prefix[shared:]:
+            self._session.push(item)
 
 
 ################################################################################
@@ -37,19 +192,40 @@ class LetterAutocompleteEngine:
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
     config: A dictionary mapping input values to its values
+
+    === Private Attributes ===
+    _cache: The cache of autocomplete results, or None if there is none
     """
     autocompleter: Autocompleter
     config: Dict[str, Any]
+    _cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
 
         <config> is a dictionary consisting of the following keys:
             - 'file': the path to a text file
-            - 'autocompleter': either the string 'simple' or 'compressed',
-              specifying which subclass of Autocompleter to use.
+            - 'autocompleter': either the string 'simple', 'compressed',
+              'dawg' or 'persistent', specifying which subclass of
+              Autocompleter to use ('dawg' selects DawgAutocompleter, which
+              also shares the common endings of lines, and 'persistent'
+              selects PersistentPrefixTree, which can be searched while it
+              is updated).
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): the number of heaviest values each prefix
+              tree node should cache for fast autocomplete (0 by default).
+            - 'workers' (optional): the number of processes to build the
+              prefix tree in (1 by default); see from_items.
+            - 'compact_after' (optional): if positive, removals only
+              tombstone values, and the prefix tree is compacted once more
+              than this many values were removed (0 by default); see
+              SimplePrefixTree.__init__.
+            - 'shards' (optional): if given, the number of prefix trees to
+              split the values between, each searched in its own worker
+              process; see ShardedAutocompleter.
+            - 'cache_size' (optional): if given, the number of prefixes whose
+              autocomplete results are cached; see QueryCache.
 
         Each line of the specified file counts as one input string.
         Note that the line may or may not contain spaces.
@@ -68,22 +244,20 @@ class LetterAutocompleteEngine:
         # lines of the file and process them according to the description in
         # this method's docstring.
         self.config = config
-
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
+        self._cache = _new_cache(config)
         with open(config['file'], encoding='utf8') as f:
-            for line in f:
-                clean = line.lower()
-                clean_str = ''
-                for char in clean:
-                    if char.isalnum() or char == ' ':
-                        clean_str += char
-                prefix = []
-                for char in clean_str:
-                    prefix.append(char)
-                self.autocompleter.insert(clean_str, 1.0, prefix)
+            self.autocompleter = _new_autocompleter(config,
+                                                    self._letter_items(f))
+
+    @staticmethod
+    def _letter_items(f: TextIO) -> Iterator[Tuple[str, float, List[str]]]:
+        """
+        sanitizes the file a chunk at a time and yields the item to insert for
+        each line
+        """
+        chunks = iter(lambda: f.read(CHUNK_SIZE), '')
+        for clean, prefix in sanitize_lines(chunks, list):
+            yield clean, 1.0, prefix
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -101,15 +275,46 @@ class LetterAutocompleteEngine:
             limit is None or limit > 0
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
-        clean = prefix.lower()
-        cleaned_str = ''
-        for char in clean:
-            if char.isalnum() or char == ' ':
-                cleaned_str += char
-        new = []
-        for char in cleaned_str:
-            new.append(char)
-        return self.autocompleter.autocomplete(new, limit)
+        return _autocomplete(self, list(sanitize(prefix)), limit)
+
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[str, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix
+        string in <prefixes>, in the same order.
+
+        The prefixes are passed to the Autocompleter's autocomplete_many
+        together, which shares the work of searching prefixes that extend
+        each other (such as the successive keystrokes 'f', 'fr' and 'fro').
+
+        Preconditions: as for autocomplete.
+        """
+        return _autocomplete_many(
+            self, [list(sanitize(prefix)) for prefix in prefixes], limit)
+
+    def session(self) -> EngineSession:
+        """Return a new session for typing a prefix string into this engine
+        one character at a time; see EngineSession.
+        """
+        return EngineSession(self.autocompleter.session(),
+                             lambda typed: list(sanitize(''.join(typed))))
+
+    def ingest(self, lines: Iterable[str],
+               batch_size: int = BATCH_SIZE) -> None:
+        """Insert the strings in <lines>, processed as in __init__.
+
+        <lines> is read <batch_size> lines at a time. The values in each batch
+        are combined and inserted into the autocompleter in one pass (see
+        insert_items), so <lines> can be a generator, sys.stdin, or a file too
+        large to hold in memory at once.
+
+        Precondition: batch_size > 0
+        """
+        lines = iter(lines)
+        for batch in iter(lambda: list(islice(lines, batch_size)), []):
+            chunk = '\n'.join(batch)
+            _insert_items(self, [(clean, 1.0, prefix) for clean, prefix
+                                 in sanitize_lines([chunk], list)])
 
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix string.
@@ -120,15 +325,36 @@ class LetterAutocompleteEngine:
         Precondition: <prefix> contains only lowercase alphanumeric characters
                       and spaces.
         """
-        clean = prefix.lower()
-        cleaned_str = ''
-        for char in clean:
-            if char.isalnum() or char == ' ':
-                cleaned_str += char
-        new = []
-        for char in cleaned_str:
-            new.append(char)
-        self.autocompleter.remove(new)
+        _remove(self, list(sanitize(prefix)))
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        """Return the statistics of this engine's cache of autocomplete
+        results, or None if it has none.
+        """
+        return None if self._cache is None else self._cache.info()
+
+    def close(self) -> None:
+        """Release the resources held by this engine's autocompleter: the
+        worker processes of a sharded autocompleter, or the memory-mapped
+        file of a loaded snapshot.
+
+        This engine must not be used afterwards.
+        """
+        _close_engine(self)
+
+    def save(self, path: str) -> None:
+        """Save a binary snapshot of this engine to <path>."""
+        _save_engine(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> LetterAutocompleteEngine:
+        """Return an engine answering queries from the snapshot saved at
+        <path> by save, without reading the original file again.
+
+        The snapshot is memory-mapped rather than rebuilt into a prefix tree,
+        so the loaded engine is read-only: remove raises NotImplementedError.
+        """
+        return _load_engine(cls, path)
 
 
 class SentenceAutocompleteEngine:
@@ -145,19 +371,38 @@ class SentenceAutocompleteEngine:
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
     config: A dictionary mapping input values to its values
+
+    === Private Attributes ===
+    _cache: The cache of autocomplete results, or None if there is none
     """
     autocompleter: Autocompleter
     config: Dict[str, Any]
+    _cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
 
         <config> is a dictionary consisting of the following keys:
             - 'file': the path to a CSV file
-            - 'autocompleter': either the string 'simple' or 'compressed',
-              specifying which subclass of Autocompleter to use.
+            - 'autocompleter': either the string 'simple', 'compressed' or
+              'persistent', specifying which subclass of Autocompleter to use
+              ('persistent' selects PersistentPrefixTree, which can be
+              searched while it is updated).
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): the number of heaviest values each prefix
+              tree node should cache for fast autocomplete (0 by default).
+            - 'workers' (optional): the number of processes to build the
+              prefix tree in (1 by default); see from_items.
+            - 'compact_after' (optional): if positive, removals only
+              tombstone values, and the prefix tree is compacted once more
+              than this many values were removed (0 by default); see
+              SimplePrefixTree.__init__.
+            - 'shards' (optional): if given, the number of prefix trees to
+              split the values between, each searched in its own worker
+              process; see ShardedAutocompleter.
+            - 'cache_size' (optional): if given, the number of prefixes whose
+              autocomplete results are cached; see QueryCache.
 
         Precondition:
         The given file is a *CSV file* where each line has two entries:
@@ -179,28 +424,23 @@ class SentenceAutocompleteEngine:
         # We haven't given you any starter code here! You should review how
         # you processed CSV files on Assignment 1.
         self.config = config
-
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
+        self._cache = _new_cache(config)
         with open(config['file']) as csvfile:
             reader = csv.reader(csvfile)
-            for line in reader:
-                clean = line[0].lower()
-                weight = line[1]
-                cleaned_str = ''
-                for char in clean:
-                    if char.isalnum() or char == ' ':
-                        cleaned_str += char
-                cleaned_num = ''
-                for num in weight:
-                    if num.isnumeric() or num == '.':
-                        cleaned_num += num
-                if cleaned_str != '' and cleaned_num != '':
-                    self.autocompleter.insert(cleaned_str, float(cleaned_num),
-                                              cleaned_str.split())
+            self.autocompleter = _new_autocompleter(
+                config, self._sentence_items(reader))
+
+    @staticmethod
+    def _sentence_items(rows: Iterable[List[str]]) -> \
+            Iterator[Tuple[str, float, List[str]]]:
+        """
+        sanitizes each csv row and yields the item to insert for it
+        """
+        for line in rows:
+            clean = sanitize(line[0])
+            weight = _NOT_WEIGHT.sub('', line[1])
+            if clean.strip() and weight != '':
+                yield clean, float(weight), clean.split()
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -218,12 +458,48 @@ class SentenceAutocompleteEngine:
             limit is None or limit > 0
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
-        clean = prefix.lower()
-        cleaned_str = ''
-        for char in clean:
-            if char.isalnum() or char == ' ':
-                cleaned_str += char
-        return self.autocompleter.autocomplete(cleaned_str.split(), limit)
+        return _autocomplete(self, sanitize(prefix).split(), limit)
+
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[str, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix
+        string in <prefixes>, in the same order.
+
+        The prefixes are passed to the Autocompleter's autocomplete_many
+        together, which shares the work of searching prefixes that extend
+        each other.
+
+        Preconditions: as for autocomplete.
+        """
+        return _autocomplete_many(
+            self, [sanitize(prefix).split() for prefix in prefixes], limit)
+
+    def session(self) -> EngineSession:
+        """Return a new session for typing a prefix string into this engine
+        one character at a time; see EngineSession.
+
+        Typing a letter changes the last word of the prefix sequence, so
+        each keystroke pops and pushes one word.
+        """
+        return EngineSession(self.autocompleter.session(),
+                             lambda typed: sanitize(''.join(typed)).split())
+
+    def ingest(self, lines: Iterable[str],
+               batch_size: int = BATCH_SIZE) -> None:
+        """Insert the sentences and weights of the CSV rows in <lines>,
+        processed as in __init__.
+
+        <lines> is read <batch_size> rows at a time. The values in each batch
+        are combined and inserted into the autocompleter in one pass (see
+        insert_items), so <lines> can be a generator, sys.stdin, or a file too
+        large to hold in memory at once.
+
+        Precondition: batch_size > 0
+        """
+        rows = csv.reader(lines)
+        for batch in iter(lambda: list(islice(rows, batch_size)), []):
+            _insert_items(self, list(self._sentence_items(batch)))
 
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix.
@@ -234,12 +510,36 @@ class SentenceAutocompleteEngine:
         Precondition: <prefix> contains only lowercase alphanumeric characters
                       and spaces.
         """
-        clean = prefix.lower()
-        cleaned_str = ''
-        for char in clean:
-            if char.isalnum() or char == ' ':
-                cleaned_str += char
-        self.autocompleter.remove(cleaned_str.split())
+        _remove(self, sanitize(prefix).split())
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        """Return the statistics of this engine's cache of autocomplete
+        results, or None if it has none.
+        """
+        return None if self._cache is None else self._cache.info()
+
+    def close(self) -> None:
+        """Release the resources held by this engine's autocompleter: the
+        worker processes of a sharded autocompleter, or the memory-mapped
+        file of a loaded snapshot.
+
+        This engine must not be used afterwards.
+        """
+        _close_engine(self)
+
+    def save(self, path: str) -> None:
+        """Save a binary snapshot of this engine to <path>."""
+        _save_engine(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> SentenceAutocompleteEngine:
+        """Return an engine answering queries from the snapshot saved at
+        <path> by save, without reading the original file again.
+
+        The snapshot is memory-mapped rather than rebuilt into a prefix tree,
+        so the loaded engine is read-only: remove raises NotImplementedError.
+        """
+        return _load_engine(cls, path)
 
 
 ################################################################################
@@ -257,22 +557,40 @@ class MelodyAutocompleteEngine:
 
     # === Private Attributes ===
     autocompleter: An Autocompleter used by this engine.
-    _melody_name: A List of tuples with the melody and its name
+    _melodies: Maps the tuple of notes of each stored melody to a Melody
+               with its name; the first line with the same notes wins
     config: a dictionary mapping inut values to its values
+    _cache: The cache of autocomplete results, or None if there is none
     """
     autocompleter: Autocompleter
-    _melody_name: List
+    _melodies: Dict[Tuple[Tuple[int, int], ...], Melody]
     config: Dict[str, Any]
+    _cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
 
         <config> is a dictionary consisting of the following keys:
             - 'file': the path to a CSV file
-            - 'autocompleter': either the string 'simple' or 'compressed',
-              specifying which subclass of Autocompleter to use.
+            - 'autocompleter': either the string 'simple', 'compressed' or
+              'persistent', specifying which subclass of Autocompleter to use
+              ('persistent' selects PersistentPrefixTree, which can be
+              searched while it is updated).
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): the number of heaviest values each prefix
+              tree node should cache for fast autocomplete (0 by default).
+            - 'workers' (optional): the number of processes to build the
+              prefix tree in (1 by default); see from_items.
+            - 'compact_after' (optional): if positive, removals only
+              tombstone values, and the prefix tree is compacted once more
+              than this many values were removed (0 by default); see
+              SimplePrefixTree.__init__.
+            - 'shards' (optional): if given, the number of prefix trees to
+              split the values between, each searched in its own worker
+              process; see ShardedAutocompleter.
+            - 'cache_size' (optional): if given, the number of prefixes whose
+              autocomplete results are cached; see QueryCache.
 
         Precondition:
         The given file is a *CSV file* where each line has the following format:
@@ -290,22 +608,18 @@ class MelodyAutocompleteEngine:
         # We haven't given you any starter code here! You should review how
         # you processed CSV files on Assignment 1.
         self.config = config
-        self._melody_name = []
-
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
+        self._cache = _new_cache(config)
+        self._melodies = {}
         with open(config['file']) as csvfile:
             reader = csv.reader(csvfile)
-            for line in reader:
-                if line != '':
-                    self._melody_help(line)
+            self.autocompleter = _new_autocompleter(
+                config,
+                (self._melody_help(line) for line in reader if line != ''))
 
-    def _melody_help(self, line: Any)-> None:
+    def _melody_help(self, line: Any) -> Tuple[List, float, List[int]]:
         """
-        sanitizes line then inserts it into tree appropriately
+        sanitizes line, records its Melody and returns the item to insert for
+        it
         """
         new = [line[s:s + 2] for s in range(1, len(line), 2)]
         melody = []
@@ -315,8 +629,8 @@ class MelodyAutocompleteEngine:
         interval = []
         for i in range(len(melody) - 1):
             interval.append(melody[i + 1][0] - melody[i][0])
-        self._melody_name.append((melody, line[0],))
-        self.autocompleter.insert(melody, 1.0, interval)
+        self._melodies.setdefault(tuple(melody), Melody(line[0], melody))
+        return melody, 1.0, interval
 
     def autocomplete(self, prefix: List[int],
                      limit: Optional[int] = None) -> List[Tuple[Melody, float]]:
@@ -330,20 +644,206 @@ class MelodyAutocompleteEngine:
         Precondition:
             limit is None or limit > 0
         """
-        a = self.autocompleter.autocomplete(prefix, limit)
-        new = []
-        name = ''
-        for item in a:
-            for mel in self._melody_name:
-                if mel[0] == item[0]:
-                    name = mel[1]
-            new.append((Melody(name, item[0]), item[1],))
-        return new
+        a = _autocomplete(self, prefix, limit)
+        return [(self._melodies[tuple(item[0])], item[1],) for item in a]
+
+    def autocomplete_many(self, prefixes: List[List[int]],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Melody, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each interval
+        sequence in <prefixes>, in the same order.
+
+        Precondition:
+            limit is None or limit > 0
+        """
+        return [[(self._melodies[tuple(item[0])], item[1],) for item in a]
+                for a in _autocomplete_many(self, prefixes, limit)]
+
+    def session(self) -> EngineSession:
+        """Return a new session for entering an interval sequence into this
+        engine one interval at a time; see EngineSession.
+        """
+        return EngineSession(
+            self.autocompleter.session(), list,
+            lambda a: [(self._melodies[tuple(item[0])], item[1],)
+                       for item in a])
+
+    def ingest(self, lines: Iterable[str],
+               batch_size: int = BATCH_SIZE) -> None:
+        """Insert the melodies of the CSV rows in <lines>, processed as
+        in __init__.
+
+        <lines> is read <batch_size> rows at a time. The values in each batch
+        are combined and inserted into the autocompleter in one pass (see
+        insert_items), so <lines> can be a generator, sys.stdin, or a file too
+        large to hold in memory at once.
+
+        Precondition: batch_size > 0
+        """
+        rows = csv.reader(lines)
+        for batch in iter(lambda: list(islice(rows, batch_size)), []):
+            _insert_items(
+                self, [self._melody_help(row) for row in batch if row != []])
 
     def remove(self, prefix: List[int]) -> None:
         """Remove all melodies that match the given interval sequence.
         """
-        self.autocompleter.remove(prefix)
+        _remove(self, prefix)
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        """Return the statistics of this engine's cache of autocomplete
+        results, or None if it has none.
+        """
+        return None if self._cache is None else self._cache.info()
+
+    def close(self) -> None:
+        """Release the resources held by this engine's autocompleter: the
+        worker processes of a sharded autocompleter, or the memory-mapped
+        file of a loaded snapshot.
+
+        This engine must not be used afterwards.
+        """
+        _close_engine(self)
+
+    def save(self, path: str) -> None:
+        """Save a binary snapshot of this engine to <path>."""
+        _save_engine(self, path, {'melodies': self._melodies})
+
+    @classmethod
+    def load(cls, path: str) -> MelodyAutocompleteEngine:
+        """Return an engine answering queries from the snapshot saved at
+        <path> by save, without reading the original file again.
+
+        The snapshot is memory-mapped rather than rebuilt into a prefix tree,
+        so the loaded engine is read-only: remove raises NotImplementedError.
+        """
+        engine = _load_engine(cls, path)
+        engine._melodies = engine.autocompleter.extra['melodies']
+        return engine
+
+
+def _new_autocompleter(config: Dict[str, Any],
+                       items: Iterable[Tuple[Any, float, List]]) -> Any:
+    """Return a new Autocompleter storing <items>, as described by the
+    'autocompleter', 'weight_type', 'top_k', 'workers', 'shards' and
+    'compact_after' keys of an engine's <config>.
+
+    The modules of the other Autocompleters are only imported when they are
+    selected, to keep importing this module fast.
+    """
+    if config['autocompleter'] == 'simple':
+        tree_class = SimplePrefixTree
+    elif config['autocompleter'] == 'dawg':
+        from dawg import DawgAutocompleter
+        tree_class = DawgAutocompleter
+    elif config['autocompleter'] == 'persistent':
+        from persistent import PersistentPrefixTree
+        tree_class = PersistentPrefixTree
+    else:
+        tree_class = CompressedPrefixTree
+    if 'shards' in config:
+        from sharded import ShardedAutocompleter
+        return ShardedAutocompleter.from_items(
+            tree_class, config['weight_type'], items, config['shards'],
+            config.get('top_k', 0), config.get('compact_after', 0))
+    return tree_class.from_items(config['weight_type'], items,
+                                 config.get('top_k', 0),
+                                 config.get('workers', 1),
+                                 config.get('compact_after', 0))
+
+
+def _new_cache(config: Dict[str, Any]) -> Optional[QueryCache]:
+    """Return a new cache of autocomplete results as described by the
+    'cache_size' key of an engine's <config>, or None if it has no such key.
+    """
+    if config.get('cache_size'):
+        return QueryCache(config['cache_size'])
+    return None
+
+
+def _autocomplete(engine: Any, prefix: List,
+                  limit: Optional[int]) -> List[Tuple[Any, float]]:
+    """Return the matches of <engine>'s autocompleter for <prefix>, from
+    <engine>'s cache when possible.
+    """
+    if engine._cache is None:
+        return engine.autocompleter.autocomplete(prefix, limit)
+    results = engine._cache.get(prefix, limit)
+    if results is None:
+        results = engine.autocompleter.autocomplete(prefix, limit)
+        engine._cache.put(prefix, limit, results)
+    return results
+
+
+def _autocomplete_many(engine: Any, prefixes: List[List],
+                       limit: Optional[int]) -> List[List[Tuple[Any, float]]]:
+    """Return the matches of <engine>'s autocompleter for each prefix in
+    <prefixes>, from <engine>'s cache when possible; the rest are searched
+    together with autocomplete_many.
+    """
+    if engine._cache is None:
+        return engine.autocompleter.autocomplete_many(prefixes, limit)
+    results = [engine._cache.get(prefix, limit) for prefix in prefixes]
+    missing = [i for i in range(len(prefixes)) if results[i] is None]
+    found = engine.autocompleter.autocomplete_many(
+        [prefixes[i] for i in missing], limit)
+    for i, answer in zip(missing, found):
+        engine._cache.put(prefixes[i], limit, answer)
+        results[i] = answer
+    return results
+
+
+def _insert_items(engine: Any, items: List[Tuple[Any, float, List]]) -> None:
+    """Insert <items> into <engine>'s autocompleter, dropping the cached
+    results they change.
+    """
+    engine.autocompleter.insert_items(items)
+    if engine._cache is not None:
+        for item in items:
+            engine._cache.inserted(item[2])
+
+
+def _remove(engine: Any, prefix: List) -> None:
+    """Remove the values matching <prefix> from <engine>'s autocompleter,
+    dropping the cached results this changes.
+    """
+    engine.autocompleter.remove(prefix)
+    if engine._cache is not None:
+        engine._cache.removed(prefix)
+
+
+def _save_engine(engine: Any, path: str,
+                 extra: Optional[Dict[str, Any]] = None) -> None:
+    """Save a snapshot of <engine>'s autocompleter to <path>, along with its
+    configuration and the given extra data.
+    """
+    from snapshot import PrefixTreeSnapshot, save_snapshot
+    if isinstance(engine.autocompleter, PrefixTreeSnapshot):
+        engine.autocompleter.save(path)
+    else:
+        save_snapshot(engine.autocompleter, path,
+                      dict(extra or {}, config=engine.config))
+
+
+def _close_engine(engine: Any) -> None:
+    """Release the resources held by <engine>'s autocompleter, if it has a
+    close method.
+    """
+    close = getattr(engine.autocompleter, 'close', None)
+    if close is not None:
+        close()
+
+
+def _load_engine(engine_class: type, path: str) -> Any:
+    """Return an engine of the given class whose autocompleter is the
+    snapshot saved at <path>.
+    """
+    from snapshot import PrefixTreeSnapshot
+    engine = engine_class.__new__(engine_class)
+    engine.autocompleter = PrefixTreeSnapshot(path)
+    engine.config = engine.autocompleter.extra['config']
+    engine._cache = _new_cache(engine.config)
+    return engine
 
 
 ###############################################################################
@@ -386,14 +886,11 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-io': ['__init__'],
-        'extra-imports': ['csv', 'prefix_tree', 'melody']
+        'extra-imports': ['csv', 're', 'itertools', 'prefix_tree', 'melody',
+                          'query_cache', 'dawg', 'persistent', 'sharded',
+                          'snapshot']
     })
 
-    # This is used to increase the recursion limit so that your sample runs
-    # work even for fairly tall simple prefix trees.
-    import sys
-    sys.setrecursionlimit(5000)
-
     # print(sample_letter_autocomplete())
     # print(sample_sentence_autocomplete())
     # sample_melody_autocomplete()
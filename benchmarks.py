@@ -0,0 +1,924 @@
+"""CSC148 Assignment 2: Benchmarks
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains benchmarks for the prefix trees and autocomplete engines,
+run on the data files bundled with this assignment.
+
+Run this file directly to print the results of every benchmark.
+"""
+from __future__ import annotations
+import gc
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from autocomplete_engines import CHUNK_SIZE, LetterAutocompleteEngine, \
+    sanitize_lines
+from concurrent_engine import ConcurrentEngine
+from persistent import PersistentPrefixTree
+from prefix_tree import SimplePrefixTree, CompressedPrefixTree
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _data_file(name: str) -> str:
+    """Return the path of the bundled data file with the given name."""
+    return os.path.join(DATA_DIR, name)
+
+
+def _measure(build: Callable[[], Any]) -> Tuple[Any, float, float]:
+    """Call <build> and return its result, the number of seconds it took,
+    and the number of megabytes it left allocated.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, seconds, size / 1e6
+
+
+def bench_tree_memory() -> List[Dict[str, Any]]:
+    """Measure the memory used by the letter engine's prefix trees on the
+    bundled text files.
+
+    'megabytes' is everything the engine left allocated while it was built.
+    'slots node megabytes' and 'dict node megabytes' are the memory of two
+    copies of its tree: one made of nodes with __slots__ and a shared
+    configuration, as the trees are now, and one made of nodes keeping the
+    same attributes in a __dict__, each with its own weight type, as the
+    trees were before. The copies share the labels and values of the tree,
+    so they differ only in the layout of their nodes.
+    """
+    results = []
+    for file in ['google_no_swears.txt', 'lotr.txt']:
+        for autocompleter in ['simple', 'compressed']:
+            engine, seconds, megabytes = _measure(
+                lambda: LetterAutocompleteEngine({
+                    'file': _data_file(file),
+                    'autocompleter': autocompleter,
+                    'weight_type': 'sum'
+                }))
+            row = {'file': file, 'autocompleter': autocompleter,
+                   'build seconds': round(seconds, 2),
+                   'megabytes': round(megabytes, 1)}
+            for node_class in [_SlotsTree, _DictTree]:
+                copy, _, copy_megabytes = _measure(
+                    lambda: _copy_tree(engine.autocompleter, node_class))
+                row[node_class.layout + ' node megabytes'] = \
+                    round(copy_megabytes, 1)
+                del copy
+            results.append(row)
+            del engine
+            gc.collect()
+    return results
+
+
+class _SlotsTree:
+    """A prefix tree node laid out as the nodes of SimplePrefixTree and
+    CompressedPrefixTree are: with __slots__, and a _TreeConfig shared by
+    the whole tree; kept as a point of comparison for _DictTree.
+    """
+    layout = 'slots'
+    __slots__ = ('weight', 'subtrees', '_label', '_parent', '_children',
+                 '_count', '_total', '_max', '_top', '_config')
+
+
+class _DictTree:
+    """A prefix tree node with the attributes of a SimplePrefixTree or
+    CompressedPrefixTree node, but kept in a __dict__ instead of __slots__,
+    and with its own weight_type and top_k instead of a shared _TreeConfig,
+    as the trees were laid out before; kept as a point of comparison.
+    """
+    layout = 'dict'
+
+
+def _copy_tree(tree: Any, node_class: type) -> Any:
+    """Return a copy of the SimplePrefixTree or CompressedPrefixTree <tree>
+    made of <node_class> nodes, sharing its labels and values.
+    """
+    copies = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        copy = node_class()
+        for name in _SlotsTree.__slots__:
+            if name != '_config':
+                setattr(copy, name, getattr(node, name))
+        if node_class is _SlotsTree:
+            copy._config = node._config
+        else:
+            copy.weight_type = node._config.weight_type
+            copy.top_k = node._config.top_k
+        copies[id(node)] = copy
+        stack.extend(node.subtrees)
+    for copy in copies.values():
+        copy.subtrees = [copies[id(subtree)] for subtree in copy.subtrees]
+        if copy._parent is not None:
+            copy._parent = copies[id(copy._parent)]
+        if copy._children is not None:
+            copy._children = {item: copies[id(subtree)]
+                              for item, subtree in copy._children.items()}
+        if copy._top:
+            copy._top = [copies[id(leaf)] for leaf in copy._top]
+    return copies[id(tree)]
+
+
+def _import_seconds(modules: List[str], repeat: int = 5) -> Optional[float]:
+    """Return the fastest of <repeat> times, in seconds, that a fresh Python
+    process took to import <modules>, not counting interpreter startup.
+
+    Return None if any of the modules cannot be imported.
+    """
+    times = []
+    for code in ['pass', 'import ' + ', '.join(modules)]:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', code], cwd=DATA_DIR,
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+            seconds = time.perf_counter() - start
+            if result.returncode != 0:
+                return None
+            best = seconds if best is None else min(best, seconds)
+        times.append(best)
+    return times[1] - times[0]
+
+
+def bench_import_time() -> List[Dict[str, Any]]:
+    """Measure how long the text engines take to import, compared with
+    also importing the MIDI and audio libraries, as they did when melody
+    imported mido and pygame eagerly.
+    """
+    results = []
+    for modules in [['autocomplete_engines'],
+                    ['autocomplete_engines', 'mido', 'pygame']]:
+        seconds = _import_seconds(modules)
+        results.append({'modules': ', '.join(modules),
+                        'import seconds': None if seconds is None
+                        else round(seconds, 3)})
+    return results
+
+
+def _sanitize_by_char(line: str) -> str:
+    """Sanitize <line> one character at a time, as the text engines did
+    before they shared sanitize_lines; kept as a point of comparison.
+    """
+    clean_str = ''
+    for char in line.lower():
+        if char.isalnum() or char == ' ':
+            clean_str += char
+    return clean_str
+
+
+def bench_sanitize_throughput() -> List[Dict[str, Any]]:
+    """Measure how many megabytes of lotr.txt per second are sanitized into
+    letter prefixes, and ingested into a compressed letter engine.
+    """
+    with open(_data_file('lotr.txt'), encoding='utf8') as f:
+        text = f.read()
+    megabytes = len(text.encode('utf8')) / 1e6
+
+    def by_chunk() -> None:
+        chunks = (text[i:i + CHUNK_SIZE]
+                  for i in range(0, len(text), CHUNK_SIZE))
+        for _ in sanitize_lines(chunks, list):
+            pass
+
+    def by_char() -> None:
+        for line in text.splitlines():
+            list(_sanitize_by_char(line))
+
+    def ingest() -> None:
+        LetterAutocompleteEngine({'file': _data_file('lotr.txt'),
+                                  'autocompleter': 'compressed',
+                                  'weight_type': 'sum'})
+
+    results = []
+    for name, run in [('sanitize_lines', by_chunk),
+                      ('one character at a time', by_char),
+                      ('compressed engine ingest', ingest)]:
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        results.append({'pipeline': name,
+                        'MB/s': round(megabytes / seconds, 1)})
+    return results
+
+
+def bench_parallel_build() -> List[Dict[str, Any]]:
+    """Measure how long the compressed letter engine takes to build on the
+    bundled text files with 1, 2 and 4 worker processes.
+
+    The speedup is bounded by the number of cores of this machine, and by
+    the work left in the parent process: sanitizing the file, partitioning
+    the lines, and unpickling and merging the trees the workers built.
+    """
+    results = []
+    for file in ['google_no_swears.txt', 'lotr.txt']:
+        for workers in [1, 2, 4]:
+            start = time.perf_counter()
+            LetterAutocompleteEngine({'file': _data_file(file),
+                                      'autocompleter': 'compressed',
+                                      'weight_type': 'sum',
+                                      'workers': workers})
+            seconds = time.perf_counter() - start
+            results.append({'file': file, 'workers': workers,
+                            'cores': os.cpu_count(),
+                            'build seconds': round(seconds, 2)})
+    return results
+
+
+def _query_seconds(engine: Any, prefix: Any, limit: Optional[int],
+                   repeat: int = 20) -> float:
+    """Return the average number of seconds engine.autocomplete(prefix, limit)
+    takes over <repeat> calls.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        engine.autocomplete(prefix, limit)
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_sharded_queries() -> List[Dict[str, Any]]:
+    """Measure broad queries on the compressed letter engine for lotr.txt,
+    stored in one prefix tree and split between 4 shards.
+
+    The shards only answer faster than one tree with a core for each of
+    them; on fewer cores they are slower, since every answer is pickled on
+    its way back from its worker process.
+    """
+    results = []
+    for shards in [None, 4]:
+        config = {'file': _data_file('lotr.txt'),
+                  'autocompleter': 'compressed',
+                  'weight_type': 'sum'}
+        if shards is not None:
+            config['shards'] = shards
+        engine = LetterAutocompleteEngine(config)
+        for limit in [None, 10]:
+            seconds = _query_seconds(engine, 't', limit)
+            results.append({'shards': shards, 'prefix': 't', 'limit': limit,
+                            'milliseconds': round(seconds * 1000, 3)})
+        engine.close()
+    return results
+
+
+def bench_query_cache() -> List[Dict[str, Any]]:
+    """Measure repeated queries on the compressed letter engine for lotr.txt,
+    with and without a cache of 128 prefixes.
+
+    Each query asks for a smaller limit than the first one, so after the first
+    call the cached engine answers from the cache.
+    """
+    results = []
+    for cache_size in [None, 128]:
+        config = {'file': _data_file('lotr.txt'),
+                  'autocompleter': 'compressed',
+                  'weight_type': 'sum'}
+        if cache_size is not None:
+            config['cache_size'] = cache_size
+        engine = LetterAutocompleteEngine(config)
+        engine.autocomplete('t', 20)
+        seconds = _query_seconds(engine, 't', 10, 200)
+        results.append({'cache_size': cache_size, 'prefix': 't', 'limit': 10,
+                        'microseconds': round(seconds * 1e6, 1),
+                        'cache_info': engine.cache_info()})
+    return results
+
+
+def bench_autocomplete_many() -> List[Dict[str, Any]]:
+    """Measure answering the keystroke prefixes of 200 lines of lotr.txt
+    (every prefix of each of their first words) with limit 10, one at a time
+    and with autocomplete_many.
+    """
+    results = []
+    with open(_data_file('lotr.txt'), encoding='utf8') as f:
+        words = [line.split()[0] for line in islice(f, 2000) if line.split()]
+    prefixes = [word[:i] for word in words[::10]
+                for i in range(1, len(word) + 1)]
+    for autocompleter in ['simple', 'compressed']:
+        engine = LetterAutocompleteEngine({'file': _data_file('lotr.txt'),
+                                           'autocompleter': autocompleter,
+                                           'weight_type': 'sum'})
+        start = time.perf_counter()
+        single = [engine.autocomplete(prefix, 10) for prefix in prefixes]
+        one_at_a_time = time.perf_counter() - start
+        start = time.perf_counter()
+        many = engine.autocomplete_many(prefixes, 10)
+        together = time.perf_counter() - start
+        assert many == single
+        results.append({'autocompleter': autocompleter,
+                        'prefixes': len(prefixes),
+                        'one_at_a_time_ms': round(one_at_a_time * 1000, 2),
+                        'autocomplete_many_ms': round(together * 1000, 2)})
+    return results
+
+
+def bench_keystroke_session() -> List[Dict[str, Any]]:
+    """Measure typing 'frodo d' into the letter engine for lotr.txt, asking
+    for 10 results after each keystroke, with a new autocomplete for each
+    keystroke and with a session.
+    """
+    results = []
+    for autocompleter in ['simple', 'compressed']:
+        engine = LetterAutocompleteEngine({'file': _data_file('lotr.txt'),
+                                           'autocompleter': autocompleter,
+                                           'weight_type': 'sum'})
+        start = time.perf_counter()
+        for i in range(1, len('frodo d') + 1):
+            engine.autocomplete('frodo d'[:i], 10)
+        fresh = time.perf_counter() - start
+        start = time.perf_counter()
+        session = engine.session()
+        for char in 'frodo d':
+            session.push(char)
+            session.results(10)
+        incremental = time.perf_counter() - start
+        results.append({'autocompleter': autocompleter,
+                        'autocomplete_ms': round(fresh * 1000, 2),
+                        'session_ms': round(incremental * 1000, 2)})
+    return results
+
+
+def _frozen_tree(config: Dict[str, Any]) -> Any:
+    """Return the frozen prefix tree of a letter engine with <config>, after
+    collecting the tree it was made from.
+    """
+    tree = LetterAutocompleteEngine(config).autocompleter
+    frozen = tree.freeze()
+    del tree
+    gc.collect()
+    return frozen
+
+
+def bench_frozen_tree() -> List[Dict[str, Any]]:
+    """Measure the memory and query times of the letter engine's prefix trees
+    for lotr.txt, and of their frozen copies.
+
+    The memory of both includes the stored strings.
+    """
+    results = []
+    for autocompleter in ['simple', 'compressed']:
+        config = {'file': _data_file('lotr.txt'),
+                  'autocompleter': autocompleter,
+                  'weight_type': 'sum'}
+        tree, _, tree_megabytes = _measure(
+            lambda: LetterAutocompleteEngine(config).autocompleter)
+        frozen, _, frozen_megabytes = _measure(lambda: _frozen_tree(config))
+        results.append({'autocompleter': autocompleter,
+                        'tree megabytes': round(tree_megabytes, 1),
+                        'frozen megabytes': round(frozen_megabytes, 1),
+                        'frozen array megabytes':
+                            round(frozen.nbytes() / 1e6, 1)})
+        for prefix, limit in [('t', 10), ('frodo', 10), ('frodo', None)]:
+            results.append({
+                'autocompleter': autocompleter, 'prefix': prefix,
+                'limit': limit,
+                'tree microseconds':
+                    round(_query_seconds(tree, list(prefix), limit) * 1e6),
+                'frozen microseconds':
+                    round(_query_seconds(frozen, list(prefix), limit) * 1e6)})
+        del tree
+        gc.collect()
+    return results
+
+
+def _count_trees(tree: Any) -> int:
+    """Return the number of trees (including leaves) in the prefix tree
+    <tree>.
+    """
+    count = 0
+    stack = [tree]
+    while stack:
+        count += 1
+        stack.extend(stack.pop().subtrees)
+    return count
+
+
+def bench_dawg() -> List[Dict[str, Any]]:
+    """Measure the number of nodes, memory and build time of the letter
+    engine's prefix trees and DAWG on the bundled text files.
+
+    The nodes of a DAWG are its states; its values are stored in a separate
+    table rather than in leaves.
+    """
+    results = []
+    for file in ['google_no_swears.txt', 'lotr.txt']:
+        for autocompleter in ['simple', 'compressed', 'dawg']:
+            engine, seconds, megabytes = _measure(
+                lambda: LetterAutocompleteEngine({
+                    'file': _data_file(file),
+                    'autocompleter': autocompleter,
+                    'weight_type': 'sum'
+                }))
+            if autocompleter == 'dawg':
+                nodes = engine.autocompleter.states
+            else:
+                nodes = _count_trees(engine.autocompleter)
+            results.append({'file': file, 'autocompleter': autocompleter,
+                            'nodes': nodes, 'build seconds': round(seconds, 2),
+                            'megabytes': round(megabytes, 1)})
+            del engine
+            gc.collect()
+    return results
+
+
+class _HelperCompressedTree:
+    """A compressed prefix tree inserting values as CompressedPrefixTree did
+    before its insert was rewritten as a radix tree insert: through thirteen
+    helpers that rebuild the trees they split and re-sort each list of
+    subtrees they change; kept as a point of comparison.
+
+    === Attributes ===
+    weight_type:
+        Type of aggregate weight; either sum or average.
+    weight:
+        The aggregate weight of this tree.
+    subtrees:
+        The subtrees of this tree.
+    value:
+        The common prefix of this tree, or the value of a leaf.
+    """
+    weight_type: str
+    weight: float
+    subtrees: List[_HelperCompressedTree]
+    value: Any
+
+    def __init__(self, weight_type: str) -> None:
+        """Initialize an empty tree with the given weight type."""
+        self.weight_type = weight_type
+        self.weight = 0.0
+        self.subtrees = []
+        self.value = []
+
+    def is_leaf(self) -> bool:
+        """Return whether this tree is a leaf."""
+        return self.weight > 0 and self.subtrees == []
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        if self.weight == 0:
+            return 0
+        elif self.subtrees == [] and self.weight > 0:
+            return 1
+        else:
+            length = 0
+            for subtree in self.subtrees:
+                length += subtree.__len__()
+            return length
+
+    def _comp_helper(self, value: Any, weight: float, prefix: List,
+                     self_check: int) -> None:
+        """
+        helper for compressed insert
+        """
+        new = _HelperCompressedTree(self.weight_type)
+        new.value = prefix
+        new.weight = weight
+        value_tree = _HelperCompressedTree(self.weight_type)
+        value_tree.value = value
+        value_tree.weight = weight
+        new.subtrees.append(value_tree)
+        existing = _HelperCompressedTree(self.weight_type)
+        existing.value = self.value
+        existing.weight = self.weight
+        existing.subtrees = self.subtrees
+        self.value = prefix[:self_check]
+        self.subtrees = []
+        self.subtrees.append(new)
+        self.subtrees.append(existing)
+        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+
+    def _comp_helper2(self, value: Any, weight: float) -> None:
+        """
+        helper for compressed insert
+        """
+        new = _HelperCompressedTree(self.weight_type)
+        new.value = value
+        new.weight = weight
+        value_tree = _HelperCompressedTree(self.weight_type)
+        value_tree.value = self.value
+        value_tree.weight = self.weight
+        value_tree.subtrees = self.subtrees
+        self.value = []
+        self.subtrees = []
+        self.subtrees.append(new)
+        self.subtrees.append(value_tree)
+        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+
+    def _comp_helper3(self, value: Any, weight: float, prefix: List) -> None:
+        """
+        helper for compressed insert
+        """
+        new = _HelperCompressedTree(self.weight_type)
+        new.value = prefix
+        new.weight = weight
+        value_tree = _HelperCompressedTree(self.weight_type)
+        value_tree.value = value
+        value_tree.weight = weight
+        new.subtrees.append(value_tree)
+        existing = _HelperCompressedTree(self.weight_type)
+        existing.value = self.value
+        existing.weight = self.weight
+        existing.subtrees = self.subtrees
+        self.value = []
+        self.subtrees = []
+        self.subtrees.append(new)
+        self.subtrees.append(existing)
+        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+
+    def _comp_helper4(self, value: Any, prefix: List) -> int:
+        """
+        helper for compressed insert
+        """
+        matching = []
+        for subtree in self.subtrees:
+            if subtree.value == value:
+                matching = [len(prefix) + 1]
+                break
+            else:
+                count = 0
+                for i in range(min(len(prefix), len(subtree.value))):
+                    if subtree.value[i] == prefix[i] and not \
+                            subtree.is_leaf():
+                        count += 1
+                    elif subtree.value[i] != prefix[i]:
+                        break
+                matching.append(count)
+        return max(matching)
+
+    def _comp_helper5(self, prefix: List) -> int:
+        """
+        helper for compressed insert
+        """
+        self_check = 0
+        for i in range(min(len(self.value), len(prefix))):
+            if self.value[i] == prefix[i]:
+                self_check += 1
+            else:
+                break
+        return self_check
+
+    def _comp_helper6(self, value: Any, weight: float, prefix: List) -> None:
+        """
+        helper for compressed insert
+        """
+        self.value = prefix
+        self.weight = weight
+        value_tree = _HelperCompressedTree(self.weight_type)
+        value_tree.value = value
+        value_tree.weight = weight
+        self.subtrees.append(value_tree)
+
+    def _comp_helper7(self, value: Any, weight: float, prefix: List) -> None:
+        """
+        helper for compressed insert
+        """
+
+        new = _HelperCompressedTree(self.weight_type)
+        new.weight = weight
+        new.value = prefix
+        value_tree = _HelperCompressedTree(self.weight_type)
+        value_tree.weight = weight
+        value_tree.value = value
+        new.subtrees.append(value_tree)
+        self.subtrees.append(new)
+        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+
+    def _comp_helper8(self, value: Any, weight: float, prefix: List) -> None:
+        """
+        helper for compressed insert
+        """
+        new = _HelperCompressedTree(self.weight_type)
+        new.weight = weight
+        new.value = prefix
+        value_tree = _HelperCompressedTree(
+            self.weight_type)
+        value_tree.weight = weight
+        value_tree.value = value
+        new.subtrees.append(value_tree)
+        self.subtrees.append(new)
+        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+
+    def _comp_helper9(self, value: Any, weight: float, prefix: List,
+                      subtree: _HelperCompressedTree) -> None:
+        """
+        helper for compressed insert
+        """
+        new = _HelperCompressedTree(self.weight_type)
+        new.weight = weight
+        new.value = value
+        merged = _HelperCompressedTree(self.weight_type)
+        merged.value = prefix
+        merged.subtrees.append(new)
+        merged.subtrees.append(subtree)
+        if self.weight_type == 'sum':
+            for tree in merged.subtrees:
+                merged.weight += tree.weight
+        elif self.weight_type == 'average':
+            acc = 0
+            length = 0
+            for tree in merged.subtrees:
+                a = tree.__len__()
+                length += a
+                acc += tree.weight * a
+            merged.weight = acc / length
+
+        merged.subtrees.sort(key=lambda x: x.weight,
+                             reverse=True)
+        self.subtrees.append(merged)
+        self.subtrees.remove(subtree)
+        self.subtrees.sort(key=lambda x: x.weight,
+                           reverse=True)
+
+    def _comp_helper10(self, value: Any, weight: float, prefix: List) -> None:
+        """
+        helper for compressed insert
+        """
+        new = _HelperCompressedTree(self.weight_type)
+        new.weight = weight
+        new.value = prefix
+        value_tree = _HelperCompressedTree(
+            self.weight_type)
+        value_tree.weight = weight
+        value_tree.value = value
+        new.subtrees.append(value_tree)
+        self.subtrees.append(new)
+        self.subtrees.sort(key=lambda x: x.weight,
+                           reverse=True)
+
+    def _comp_helper11(self) -> None:
+        """
+        update weights
+        """
+        if self.weight_type == 'sum':
+            sum_weight = 0
+            for subtree in self.subtrees:
+                sum_weight += subtree.weight
+            self.weight = sum_weight
+        elif self.weight_type == 'average':
+            acc = 0
+            for tree in self.subtrees:
+                acc += tree.weight * tree.__len__()
+            self.weight = acc / self.__len__()
+
+    def _comp_helper12(self, merged: _HelperCompressedTree) -> None:
+        """
+        update weights
+        """
+        if self.weight_type == 'sum':
+            for tree in merged.subtrees:
+                merged.weight += tree.weight
+        elif self.weight_type == 'average':
+            acc = 0
+            length = 0
+            for tree in merged.subtrees:
+                a = tree.__len__()
+                length += a
+                acc += tree.weight * a
+            merged.weight = acc / length
+
+    def _comp_helper13(self, value: Any, weight: float, prefix: List,
+                       acc: int) -> None:
+        """
+        Helper for compressed.insert()
+        """
+        for subtree in self.subtrees:
+            if subtree.value == value:
+                subtree.weight += weight
+                break
+            elif subtree.value[:acc] == prefix[:acc] and \
+                    len(prefix) >= len(subtree.value):
+                self_check = 0
+                for i in range(min(len(self.value), len(prefix))):
+                    if self.value[i] == prefix[i]:
+                        self_check += 1
+                    else:
+                        break
+                if self_check != acc:
+                    subtree.insert(value, weight, prefix)
+                    break
+                elif self_check == acc:
+                    self._comp_helper8(value, weight, prefix)
+                    break
+            elif subtree.value[:acc] == prefix[:acc] and not \
+                    len(prefix) >= len(subtree.value):
+                self_check = 0
+                for i in range(min(len(self.value), len(prefix))):
+                    if self.value[i] == prefix[i]:
+                        self_check += 1
+                    else:
+                        break
+                if len(prefix) == acc:
+                    self._comp_helper9(value, weight, prefix,
+                                       subtree)
+                    break
+                elif self_check == acc:
+                    self._comp_helper10(value, weight, prefix)
+                    break
+                else:
+                    new = _HelperCompressedTree(self.weight_type)
+                    new.weight = weight
+                    new.value = prefix
+                    value_tree = _HelperCompressedTree(self.weight_type)
+                    value_tree.weight = weight
+                    value_tree.value = value
+                    new.subtrees.append(value_tree)
+                    merged = _HelperCompressedTree(self.weight_type)
+                    merged.value = prefix[:acc]
+                    merged.subtrees.append(new)
+                    merged.subtrees.append(subtree)
+
+                    self._comp_helper12(merged)
+
+                    merged.subtrees.sort(key=lambda x: x.weight,
+                                         reverse=True)
+                    self.subtrees.append(merged)
+                    self.subtrees.remove(subtree)
+                    self.subtrees.sort(key=lambda x: x.weight,
+                                       reverse=True)
+                    break
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert <value> with the given weight and prefix sequence, as
+        CompressedPrefixTree.insert did.
+        """
+        if self.weight == 0.0:
+            self._comp_helper6(value, weight, prefix)
+        else:
+            acc = self._comp_helper4(value, prefix)
+            if acc == 0:
+                if prefix == [] and self.value == []:
+                    new = _HelperCompressedTree(self.weight_type)
+                    new.weight = weight
+                    new.value = value
+                    self.subtrees.append(new)
+                    self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+                elif not self.value == []:
+                    self_check = self._comp_helper5(prefix)
+                    if self_check > 0:
+                        self._comp_helper(value, weight, prefix, self_check)
+                    elif not prefix != []:
+                        self._comp_helper2(value, weight)
+                    else:
+                        self._comp_helper3(value, weight, prefix)
+                else:
+                    self._comp_helper7(value, weight, prefix)
+            else:
+                self._comp_helper13(value, weight, prefix, acc)
+            # updates weights
+            self._comp_helper11()
+
+
+def bench_inserts() -> List[Dict[str, Any]]:
+    """Measure how many values per second are inserted into prefix trees one
+    line of google_no_swears.txt at a time: first into an empty tree, then
+    again into the tree already storing them.
+
+    _HelperCompressedTree times the insert of CompressedPrefixTree from
+    before its radix tree rewrite, for comparison.
+    """
+    with open(_data_file('google_no_swears.txt'), encoding='utf8') as f:
+        lines = list(sanitize_lines(f, list))
+    results = []
+    for cls in [_HelperCompressedTree, SimplePrefixTree, CompressedPrefixTree]:
+        tree = cls('sum')
+        row = {'tree': cls.__name__}
+        for name in ['first inserts/s', 'repeat inserts/s']:
+            start = time.perf_counter()
+            for value, prefix in lines:
+                tree.insert(value, 1.0, prefix)
+            seconds = time.perf_counter() - start
+            row[name] = round(len(lines) / seconds)
+        results.append(row)
+    return results
+
+
+def bench_lazy_remove() -> List[Dict[str, Any]]:
+    """Measure how long compressed trees of lotr.txt take to remove 2000
+    prefixes of random lines, right away and with tombstones, and then to
+    compact.
+    """
+    with open(_data_file('lotr.txt'), encoding='utf8') as f:
+        lines = list(sanitize_lines(f, list))
+    rng = random.Random(0)
+    prefixes = [prefix[:rng.randint(3, 8)]
+                for _, prefix in rng.sample(lines, 2000)]
+    results = []
+    for top_k in [0, 10]:
+        for compact_after in [0, 500, len(lines)]:
+            tree = CompressedPrefixTree.from_items(
+                'sum', [(value, 1.0, prefix) for value, prefix in lines],
+                top_k, compact_after=compact_after)
+            gc.collect()
+            start = time.perf_counter()
+            for prefix in prefixes:
+                tree.remove(prefix)
+            removed = time.perf_counter() - start
+            tree.compact()
+            seconds = time.perf_counter() - start
+            results.append({'top_k': top_k, 'compact_after': compact_after,
+                            'remove ms': round(removed * 1e3, 1),
+                            'total ms': round(seconds * 1e3, 1)})
+    return results
+
+
+def bench_persistent_tree() -> List[Dict[str, Any]]:
+    """Measure inserts per second into compressed and persistent prefix
+    trees, one line of lotr.txt at a time and (for the persistent tree) in
+    one batch, and the time a query takes on the result.
+    """
+    with open(_data_file('lotr.txt'), encoding='utf8') as f:
+        lines = list(sanitize_lines(f, list))
+    results = []
+    for cls, batch in [(CompressedPrefixTree, False),
+                       (PersistentPrefixTree, False),
+                       (PersistentPrefixTree, True)]:
+        tree = cls('sum')
+        start = time.perf_counter()
+        if batch:
+            tree.insert_items([(value, 1.0, prefix)
+                               for value, prefix in lines])
+        else:
+            for value, prefix in lines:
+                tree.insert(value, 1.0, prefix)
+        seconds = time.perf_counter() - start
+        query = _query_seconds(tree, ['t'], 10, 200)
+        results.append({'tree': cls.__name__, 'batch': batch,
+                        'inserts/s': round(len(lines) / seconds),
+                        'query microseconds': round(query * 1e6, 1)})
+    return results
+
+
+def bench_concurrent_engine() -> List[Dict[str, Any]]:
+    """Measure how many queries per second 4 threads answer from a
+    ConcurrentEngine wrapping the compressed letter engine for lotr.txt, and
+    how long they wait for the lock, with and without a thread ingesting
+    batches of 500 lines meanwhile.
+    """
+    with open(_data_file('lotr.txt'), encoding='utf8') as f:
+        lines = f.read().splitlines()
+    rng = random.Random(0)
+    prefixes = [line[:rng.randint(1, 3)] for line in rng.sample(lines, 2000)]
+    results = []
+    for writing in [False, True]:
+        engine = ConcurrentEngine(LetterAutocompleteEngine({
+            'file': _data_file('lotr.txt'), 'autocompleter': 'compressed',
+            'weight_type': 'sum'}), 4)
+        done = threading.Event()
+        writes = []
+
+        def writer() -> None:
+            """Ingest batches of lines until the queries are done."""
+            while not done.is_set():
+                engine.ingest(rng.sample(lines, 500))
+                writes.append(1)
+                time.sleep(0.005)
+
+        thread = threading.Thread(target=writer)
+        if writing:
+            thread.start()
+        start = time.perf_counter()
+        futures = [engine.submit_autocomplete(prefix, 10)
+                   for prefix in prefixes]
+        for future in futures:
+            future.result()
+        seconds = time.perf_counter() - start
+        done.set()
+        if writing:
+            thread.join()
+        engine.close()
+        info = engine.lock_info()
+        results.append({'writes': len(writes),
+                        'queries/s': round(len(prefixes) / seconds),
+                        'mean read wait microseconds':
+                            round(info.read_wait / info.reads * 1e6, 1),
+                        'max read wait ms':
+                            round(info.max_read_wait * 1e3, 2)})
+    return results
+
+
+if __name__ == '__main__':
+    for benchmark in [bench_tree_memory, bench_import_time,
+                      bench_sanitize_throughput, bench_parallel_build,
+                      bench_sharded_queries, bench_query_cache,
+                      bench_autocomplete_many, bench_keystroke_session,
+                      bench_frozen_tree, bench_dawg, bench_inserts,
+                      bench_lazy_remove, bench_persistent_tree,
+                      bench_concurrent_engine]:
+        print(benchmark.__name__)
+        for row in benchmark():
+            print('   ', row)
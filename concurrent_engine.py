@@ -0,0 +1,273 @@
+"""CSC148 Assignment 2: Concurrent autocomplete engines
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains a wrapper making any of the autocomplete engines safe to
+share between threads, and the reader/writer lock it uses.
+
+Any number of queries may run at once, since they do not change the engine
+(even the DAWG backend merges new lines into its graph during ingest rather
+than during the next query); ingest and remove wait until the running
+queries finish and then run alone.
+A waiting writer stops new queries from starting, so a steady stream of
+queries cannot delay it forever.
+
+The lock records how long each query and write waited for it (see
+LockInfo), which shows when bursts of writes are holding up queries. An
+engine whose autocompleter is a PersistentPrefixTree can be searched during
+a write without any lock, but the wrapper treats every engine the same way.
+"""
+from __future__ import annotations
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from autocomplete_engines import BATCH_SIZE
+from query_cache import CacheInfo
+
+
+class LockInfo(NamedTuple):
+    """Statistics about a ReadWriteLock, as returned by ReadWriteLock.info.
+
+    Waits are in seconds.
+    """
+    reads: int
+    writes: int
+    read_wait: float
+    write_wait: float
+    max_read_wait: float
+    max_write_wait: float
+
+
+class ReadWriteLock:
+    """A lock held either by any number of readers or by a single writer.
+
+    Readers that arrive while a writer holds or is waiting for the lock wait
+    until it is released. The lock is not reentrant.
+
+    === Attributes ===
+    reads:
+        The number of times the lock was acquired for reading.
+    writes:
+        The number of times the lock was acquired for writing.
+    read_wait:
+        The total number of seconds readers waited for the lock.
+    write_wait:
+        The total number of seconds writers waited for the lock.
+    max_read_wait:
+        The longest number of seconds a reader waited for the lock.
+    max_write_wait:
+        The longest number of seconds a writer waited for the lock.
+
+    === Private Attributes ===
+    _condition:
+        The condition readers and writers wait on, whose lock guards every
+        other attribute.
+    _readers:
+        The number of readers holding the lock.
+    _writing:
+        Whether a writer holds the lock.
+    _waiting:
+        The number of writers waiting for the lock.
+    """
+    reads: int
+    writes: int
+    read_wait: float
+    write_wait: float
+    max_read_wait: float
+    max_write_wait: float
+    _condition: threading.Condition
+    _readers: int
+    _writing: bool
+    _waiting: int
+
+    def __init__(self) -> None:
+        """Initialize an unheld lock."""
+        self.reads = 0
+        self.writes = 0
+        self.read_wait = 0.0
+        self.write_wait = 0.0
+        self.max_read_wait = 0.0
+        self.max_write_wait = 0.0
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting = 0
+
+    def info(self) -> LockInfo:
+        """Return the statistics of this lock."""
+        with self._condition:
+            return LockInfo(self.reads, self.writes, self.read_wait,
+                            self.write_wait, self.max_read_wait,
+                            self.max_write_wait)
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """Return a context manager holding this lock for reading."""
+        start = time.perf_counter()
+        with self._condition:
+            while self._writing or self._waiting:
+                self._condition.wait()
+            self._readers += 1
+            wait = time.perf_counter() - start
+            self.reads += 1
+            self.read_wait += wait
+            self.max_read_wait = max(self.max_read_wait, wait)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """Return a context manager holding this lock for writing."""
+        start = time.perf_counter()
+        with self._condition:
+            self._waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting -= 1
+            self._writing = True
+            wait = time.perf_counter() - start
+            self.writes += 1
+            self.write_wait += wait
+            self.max_write_wait = max(self.max_write_wait, wait)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class ConcurrentEngine:
+    """A wrapper around an autocomplete engine that can be shared between
+    threads.
+
+    === Attributes ===
+    engine:
+        The wrapped LetterAutocompleteEngine, SentenceAutocompleteEngine or
+        MelodyAutocompleteEngine. It should not be used directly while it
+        is wrapped.
+
+    === Private Attributes ===
+    _lock:
+        The lock held for reading by queries on the engine, and for writing
+        by changes to it.
+    _executor:
+        The thread pool submitted queries are run on, or None if it has been
+        shut down.
+    """
+    engine: Any
+    _lock: ReadWriteLock
+    _executor: Optional[ThreadPoolExecutor]
+
+    def __init__(self, engine: Any, workers: int = 4) -> None:
+        """Initialize a wrapper around <engine> running submitted queries on
+        <workers> threads.
+
+        Precondition: workers > 0
+        """
+        self.engine = engine
+        self._lock = ReadWriteLock()
+        self._executor = ThreadPoolExecutor(workers)
+
+    def close(self) -> None:
+        """Shut down the thread pool of this wrapper, after the submitted
+        queries finish.
+
+        The wrapper can still be used afterwards, but submitted queries run
+        on the calling thread.
+        """
+        self._executor.shutdown()
+        self._executor = None
+
+    def autocomplete(self, prefix: Any,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return the engine's autocomplete(prefix, limit).
+
+        Preconditions: as for the engine's autocomplete.
+        """
+        with self._lock.read():
+            return self.engine.autocomplete(prefix, limit)
+
+    def autocomplete_many(self, prefixes: List,
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the engine's autocomplete_many(prefixes, limit), with no
+        change to the engine between the prefixes.
+
+        Preconditions: as for the engine's autocomplete_many.
+        """
+        with self._lock.read():
+            return self.engine.autocomplete_many(prefixes, limit)
+
+    def submit_autocomplete(self, prefix: Any,
+                            limit: Optional[int] = None) -> Future:
+        """Return a future for autocomplete(prefix, limit), run on the
+        thread pool of this wrapper.
+
+        Preconditions: as for the engine's autocomplete.
+        """
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(self.autocomplete(prefix, limit))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        return self._executor.submit(self.autocomplete, prefix, limit)
+
+    def ingest(self, lines: Iterable[str],
+               batch_size: int = BATCH_SIZE) -> None:
+        """Call the engine's ingest(lines, batch_size) while no query runs.
+
+        <lines> is read while the lock is held, so it should not wait on
+        other threads using this wrapper.
+        """
+        with self._lock.write():
+            self.engine.ingest(lines, batch_size)
+
+    def remove(self, prefix: Any) -> None:
+        """Call the engine's remove(prefix) while no query runs."""
+        with self._lock.write():
+            self.engine.remove(prefix)
+
+    def save(self, path: str) -> None:
+        """Call the engine's save(path) while no query runs.
+
+        Saving compacts the engine's prefix tree, so it is a write as well.
+        """
+        with self._lock.write():
+            self.engine.save(path)
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        """Return the statistics of the engine's cache of autocomplete
+        results, or None if it has none.
+        """
+        return self.engine.cache_info()
+
+    def lock_info(self) -> LockInfo:
+        """Return the statistics of the lock of this wrapper, showing how
+        long queries and writes waited for each other.
+        """
+        return self._lock.info()
+
+
+if __name__ == '__main__':
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-nested-blocks': 4,
+        'extra-imports': ['threading', 'time', 'concurrent.futures',
+                          'contextlib', 'autocomplete_engines',
+                          'query_cache']
+    })
@@ -0,0 +1,554 @@
+"""CSC148 Assignment 2: Directed acyclic word graphs
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains an Autocompleter storing its prefix sequences in a
+minimal DAWG (directed acyclic word graph): an automaton in which prefix
+sequences share both their common beginnings, as in a prefix tree, and
+their common endings, so that the many lines ending the same way share one
+path of states. As in a CompressedPrefixTree, each edge is labelled with a
+sequence of prefix elements, so that a path no other sequence branches from
+is a single edge.
+
+Since a state is shared by many prefix sequences, weights cannot be stored
+in the graph itself. Instead the graph numbers its prefix sequences 0, 1,
+2, ... in sorted order (a minimal perfect hash: each edge stores how many
+sequences sort before the ones through it), and the value and weight of
+each sequence are stored in tables under its number. The sequences matching
+a prefix then have consecutive numbers, and their heaviest values are found
+best-first in a tree of the largest weight of each range of numbers.
+
+The graph is built from sorted sequences in one pass, merging each state
+with an equal one (one with the same edges to the same states) as soon as
+no more sequences can pass through it. New prefix sequences inserted one at
+a time are kept in a sorted buffer, searched alongside the graph, and
+merged into it by rebuilding it once they outnumber an eighth of its
+sequences; those of insert_items are merged right away. Adding weight to a
+stored value updates it in place. Removed values get weight 0, which
+searches skip, and the graph is only rebuilt without them once they are
+more than half of its sequences. Queries never change the graph, so any
+number of them may run at once.
+A DAWG is best for a large corpus that changes in batches, such as the lines
+of a text file.
+"""
+from __future__ import annotations
+import heapq
+from array import array
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from prefix_tree import Autocompleter
+
+
+class DawgAutocompleter(Autocompleter):
+    """An Autocompleter storing its prefix sequences in a minimal DAWG.
+
+    Each prefix sequence can have only one value; this holds for the letter
+    engine, where the value is the string its prefix sequence spells.
+
+    === Attributes ===
+    weight_type:
+        Type of aggregate weight; either sum or average. The weight of each
+        value is the sum of the weights it was inserted with, as in a prefix
+        tree.
+    states:
+        The number of states of the graph.
+
+    === Private Attributes ===
+    _tokens:
+        Maps each prefix element in the graph to its id, in sorted order.
+    _first_edge:
+        The index of the first edge of each state, with the number of edges
+        at the end; the edges of each state are sorted by label.
+    _edge_first:
+        The id of the first prefix element of the label of each edge.
+    _label_end:
+        Where the label of each edge ends in _labels; the label of edge i
+        starts where the label of edge i - 1 ends (or at 0).
+    _labels:
+        The ids of the prefix elements of the labels of every edge, in order.
+    _edge_target:
+        The state each edge leads to.
+    _edge_skip:
+        For each edge, how many prefix sequences leaving its state sort
+        before the ones through it.
+    _final:
+        1 for each state ending a prefix sequence, 0 for the others.
+    _size:
+        The number of prefix sequences leaving each state.
+    _values:
+        The value of each prefix sequence, by number.
+    _weights:
+        The weight of each prefix sequence, by number, or 0 if its value has
+        been removed.
+    _removed:
+        The number of prefix sequences in the graph whose values have been
+        removed.
+    _leaf_base:
+        The number of leaves of _max, a power of two.
+    _max:
+        A binary tree of the largest weight of each range of prefix sequence
+        numbers, stored as an array: tree i has subtrees 2i and 2i + 1, and
+        the weight of sequence j is at _leaf_base + j.
+    _pending:
+        Maps each prefix sequence inserted since the graph was last built to
+        a list [value, weight].
+    _pending_keys:
+        The keys of _pending, in sorted order.
+    """
+    weight_type: str
+    states: int
+    _tokens: Dict[Any, int]
+    _first_edge: array
+    _edge_first: array
+    _label_end: array
+    _labels: array
+    _edge_target: array
+    _edge_skip: array
+    _final: bytearray
+    _size: array
+    _values: List[Any]
+    _weights: array
+    _removed: int
+    _leaf_base: int
+    _max: array
+    _pending: Dict[Tuple, List]
+    _pending_keys: List[Tuple]
+
+    def __init__(self, weight_type: str, top_k: int = 0) -> None:
+        """Initialize an empty DAWG with the given weight type.
+
+        <top_k> is accepted for compatibility with the prefix trees and
+        ignored: the tree of largest weights already makes autocomplete
+        with a small limit fast.
+
+        Precondition: weight_type == 'sum' or weight_type == 'average'.
+        """
+        self.weight_type = weight_type
+        self._pending = {}
+        self._pending_keys = []
+        self._build([])
+
+    @classmethod
+    def from_items(cls, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]],
+                   top_k: int = 0, workers: int = 1,
+                   compact_after: int = 0) -> DawgAutocompleter:
+        """Return a new DAWG storing the given items, built in one pass.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+        <top_k>, <workers> and <compact_after> are accepted for
+        compatibility with the prefix trees and ignored.
+
+        Preconditions: as for insert, for each item.
+        """
+        dawg = cls(weight_type)
+        dawg.insert_items(items)
+        return dawg
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return len(self._values) - self._removed + len(self._pending)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Raise ValueError if a different value is stored with the same
+        prefix sequence.
+
+        A new prefix sequence is buffered, and the buffer is merged into the
+        graph once it holds more than 64 sequences and more than an eighth
+        as many as the graph.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        self._insert(value, weight, tuple(prefix))
+        if len(self._pending) > max(64, len(self._values) // 8):
+            self._flush()
+
+    def insert_items(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Insert each of the given items into this Autocompleter, and merge
+        the new prefix sequences into the graph in one rebuild.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+
+        Preconditions: as for insert, for each item.
+        """
+        for value, weight, prefix in items:
+            self._insert(value, weight, tuple(prefix))
+        self._flush()
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Ties are broken in the sorted order of the prefix sequences, with
+        those still in the buffer of new sequences last.
+
+        Precondition: limit is None or limit > 0.
+        """
+        lo, hi = self._pending_range(prefix)
+        pending = sorted([(self._pending[key][0], self._pending[key][1],)
+                          for key in self._pending_keys[lo:hi]],
+                         key=lambda x: -x[1])
+        matches = self._range(prefix)
+        if matches is None:
+            return pending[:limit]
+        merged = heapq.merge(self._search(matches[0], matches[1], limit),
+                             pending, key=lambda x: -x[1])
+        return list(islice(merged, limit))
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+
+        The values in the graph get weight 0, and the graph is rebuilt
+        without them once more than half of its prefix sequences have been
+        removed.
+        """
+        lo, hi = self._pending_range(prefix)
+        for key in self._pending_keys[lo:hi]:
+            del self._pending[key]
+        del self._pending_keys[lo:hi]
+        matches = self._range(prefix)
+        if matches is None:
+            return
+        self._clear(matches[0], matches[1])
+        if self._removed * 2 > len(self._values):
+            self._flush()
+
+    def items(self) -> Iterator[Tuple[Any, float, List]]:
+        """Yield a tuple (value, weight, prefix) for each value stored in
+        this Autocompleter, as it would be passed to insert, in sorted order
+        of prefix sequence.
+        """
+        for prefix, value, weight in self._all_words():
+            yield value, weight, list(prefix)
+
+    def _search(self, lo: int, hi: int, limit: Optional[int]) -> \
+            List[Tuple[Any, float]]:
+        """Return up to <limit> tuples (value, weight) for the prefix
+        sequences numbered from <lo> up to but not including <hi>, in
+        non-increasing order of weight.
+        """
+        lo += self._leaf_base
+        hi += self._leaf_base
+        heap = []
+        while lo < hi:
+            if lo & 1:
+                self._push(heap, lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                self._push(heap, hi)
+            lo >>= 1
+            hi >>= 1
+
+        new = []
+        while heap and len(new) != limit:
+            node = heapq.heappop(heap)[2]
+            if node >= self._leaf_base:
+                i = node - self._leaf_base
+                new.append((self._values[i], self._weights[i],))
+            else:
+                self._push(heap, 2 * node)
+                self._push(heap, 2 * node + 1)
+        return new
+
+    def _insert(self, value: Any, weight: float, key: Tuple) -> None:
+        """Insert the given value as in insert, with the prefix sequence
+        <key>, buffering it if <key> is not in the graph.
+        """
+        i = self._number(key)
+        if i is not None:
+            if self._weights[i] == 0:
+                self._values[i] = value
+                self._removed -= 1
+            elif self._values[i] != value:
+                raise ValueError('a DAWG stores one value per prefix sequence')
+            self._set_weight(i, self._weights[i] + weight)
+        elif key in self._pending:
+            if self._pending[key][0] != value:
+                raise ValueError('a DAWG stores one value per prefix sequence')
+            self._pending[key][1] += weight
+        else:
+            self._pending[key] = [value, weight]
+            insort(self._pending_keys, key)
+
+    def _push(self, heap: List, node: int) -> None:
+        """Push tree <node> of _max onto <heap>, keyed on its largest weight
+        and then on the number of its first prefix sequence.
+        """
+        if self._max[node] > 0:
+            shift = self._leaf_base.bit_length() - node.bit_length()
+            heapq.heappush(heap, (-self._max[node], node << shift, node))
+
+    def _clear(self, lo: int, hi: int) -> None:
+        """Set the weights of the prefix sequences numbered from <lo> up to
+        but not including <hi> to 0.
+        """
+        for i in range(lo, hi):
+            if self._weights[i] > 0:
+                self._weights[i] = 0.0
+                self._removed += 1
+        lo += self._leaf_base
+        hi += self._leaf_base
+        self._max[lo:hi] = array('d', [0.0]) * (hi - lo)
+        while lo > 1:
+            lo >>= 1
+            hi = ((hi - 1) >> 1) + 1
+            for node in range(lo, hi):
+                self._max[node] = max(self._max[2 * node],
+                                      self._max[2 * node + 1])
+
+    def _set_weight(self, i: int, weight: float) -> None:
+        """Set the weight of prefix sequence <i> to <weight>."""
+        self._weights[i] = weight
+        node = self._leaf_base + i
+        self._max[node] = weight
+        while node > 1:
+            node >>= 1
+            self._max[node] = max(self._max[2 * node], self._max[2 * node + 1])
+
+    def _walk(self, prefix: List) -> Optional[Tuple[int, int, bool]]:
+        """Return the state reached by following <prefix> from the first
+        state, how many prefix sequences sort before the ones leaving it, and
+        whether <prefix> ends exactly at the state rather than inside the
+        label of the edge leading to it, or None if there is no such path.
+        """
+        state = 0
+        skipped = 0
+        i = 0
+        while i < len(prefix):
+            label = self._tokens.get(prefix[i])
+            lo = self._first_edge[state]
+            hi = self._first_edge[state + 1]
+            edge = bisect_left(self._edge_first, label, lo, hi) \
+                if label is not None else hi
+            if edge == hi or self._edge_first[edge] != label:
+                return None
+            start = self._label_end[edge - 1] if edge > 0 else 0
+            length = min(self._label_end[edge] - start, len(prefix) - i)
+            for j in range(1, length):
+                if self._tokens.get(prefix[i + j]) != self._labels[start + j]:
+                    return None
+            skipped += self._edge_skip[edge]
+            state = self._edge_target[edge]
+            i += length
+            if length < self._label_end[edge] - start:
+                return state, skipped, False
+        return state, skipped, True
+
+    def _number(self, prefix: Tuple) -> Optional[int]:
+        """Return the number of the prefix sequence <prefix>, or None if it
+        is not in the graph.
+        """
+        walked = self._walk(prefix)
+        if walked is None or not walked[2] or not self._final[walked[0]]:
+            return None
+        return walked[1]
+
+    def _range(self, prefix: List) -> Optional[Tuple[int, int]]:
+        """Return the range [lo, hi) of the numbers of the prefix sequences
+        matching <prefix>, or None if none do.
+        """
+        walked = self._walk(prefix)
+        if walked is None or self._size[walked[0]] == 0:
+            return None
+        state, skipped, _ = walked
+        return skipped, skipped + self._size[state]
+
+    def _pending_range(self, prefix: List) -> Tuple[int, int]:
+        """Return the range [lo, hi) of the indexes in _pending_keys of the
+        buffered prefix sequences matching <prefix>.
+        """
+        key = tuple(prefix)
+        lo = bisect_left(self._pending_keys, key)
+        hi = lo
+        while hi < len(self._pending_keys) and \
+                self._pending_keys[hi][:len(key)] == key:
+            hi += 1
+        return lo, hi
+
+    def _all_words(self) -> Iterator[Tuple[Tuple, Any, float]]:
+        """Yield a tuple (prefix sequence, value, weight) for each value
+        stored in this Autocompleter, in the graph or in the buffer, in
+        sorted order of prefix sequence.
+        """
+        pending = [(key, self._pending[key][0], self._pending[key][1])
+                   for key in self._pending_keys]
+        return heapq.merge([word for word in self._words() if word[2] > 0],
+                           pending, key=lambda word: word[0])
+
+    def _words(self) -> Iterator[Tuple[Tuple, Any, float]]:
+        """Yield a tuple (prefix sequence, value, weight) for each prefix
+        sequence in the graph, in sorted order, including those whose values
+        have been removed.
+        """
+        tokens = [None] * len(self._tokens)
+        for item, label in self._tokens.items():
+            tokens[label] = item
+        i = 0
+        stack = [(0, ())]
+        while stack:
+            state, prefix = stack.pop()
+            if self._final[state]:
+                yield prefix, self._values[i], self._weights[i]
+                i += 1
+            for edge in reversed(range(self._first_edge[state],
+                                       self._first_edge[state + 1])):
+                start = self._label_end[edge - 1] if edge > 0 else 0
+                stack.append((self._edge_target[edge], prefix + tuple(
+                    [tokens[label] for label
+                     in self._labels[start:self._label_end[edge]]])))
+
+    def _flush(self) -> None:
+        """Rebuild the graph with the prefix sequences in _pending, and
+        without those whose values have been removed.
+        """
+        if self._pending or self._removed:
+            words = list(self._all_words())
+            self._pending = {}
+            self._pending_keys = []
+            self._build(words)
+
+    def _build(self, words: List[Tuple[Tuple, Any, float]]) -> None:
+        """Build the graph storing <words>, a list of distinct tuples
+        (prefix sequence, value, weight) in sorted order of prefix sequence.
+        """
+        self._tokens = {item: label for label, item in enumerate(
+            sorted({item for prefix, _, _ in words for item in prefix}))}
+
+        # Each new state is merged with an equal registered state as soon as
+        # no more sequences can pass through it, that is, once the next
+        # sequence leaves its path. A state is registered only after all the
+        # states it leads to, so registered states are in reverse topological
+        # order. Each edge is stored as a tuple (label, state), under the
+        # first element of its label.
+        edges = [{}]
+        final = [False]
+        register = {}
+        path = [(0, 0)]
+        previous = ()
+        for prefix, _, _ in words:
+            labels = tuple([self._tokens[item] for item in prefix])
+            common = 0
+            while common < min(len(labels), len(previous)) and \
+                    labels[common] == previous[common]:
+                common += 1
+            # path holds each state on the path of the previous sequence,
+            # with the length of the prefix leading to it.
+            k = len(path) - 1
+            while path[k][1] > common:
+                k -= 1
+            _minimize(edges, final, register, path, previous, k + 1)
+            state, depth = path[k]
+            if depth < common:
+                label, target = edges[state][previous[depth]]
+                edges.append({label[common - depth]:
+                              (label[common - depth:], target)})
+                final.append(False)
+                edges[state][previous[depth]] = (label[:common - depth],
+                                                 len(edges) - 1)
+                state = len(edges) - 1
+                path.append((state, common))
+            if common < len(labels):
+                edges.append({})
+                final.append(True)
+                edges[state][labels[common]] = (labels[common:],
+                                                len(edges) - 1)
+                path.append((len(edges) - 1, len(labels)))
+            else:
+                final[state] = True
+            previous = labels
+        _minimize(edges, final, register, path, previous, 1)
+
+        # Number the states so that the first state is 0 and every state
+        # comes before the states it leads to.
+        order = [0] + list(reversed(register.values()))
+        number = {state: i for i, state in enumerate(order)}
+        self.states = len(order)
+        self._final = bytearray([final[state] for state in order])
+        self._size = array('I', [0] * len(order))
+        for i in reversed(range(len(order))):
+            self._size[i] = self._final[i] + sum(
+                [self._size[number[target]]
+                 for _, target in edges[order[i]].values()])
+
+        code = 'B' if len(self._tokens) <= 1 << 8 else 'I'
+        self._first_edge = array('I')
+        self._edge_first = array(code)
+        self._label_end = array('I')
+        self._labels = array(code)
+        self._edge_target = array('I')
+        self._edge_skip = array('I')
+        for i, state in enumerate(order):
+            self._first_edge.append(len(self._edge_target))
+            skipped = self._final[i]
+            for label, target in edges[state].values():
+                self._edge_first.append(label[0])
+                self._labels.extend(label)
+                self._label_end.append(len(self._labels))
+                self._edge_target.append(number[target])
+                self._edge_skip.append(skipped)
+                skipped += self._size[number[target]]
+        self._first_edge.append(len(self._edge_target))
+
+        self._values = [value for _, value, _ in words]
+        self._weights = array('d', [weight for _, _, weight in words])
+        self._removed = 0
+        self._leaf_base = 1 << max(len(words) - 1, 0).bit_length()
+        self._max = array('d', [0.0]) * self._leaf_base + self._weights + \
+            array('d', [0.0]) * (self._leaf_base - len(words))
+        for node in reversed(range(1, self._leaf_base)):
+            self._max[node] = max(self._max[2 * node], self._max[2 * node + 1])
+
+
+def _minimize(edges: List[Dict[int, Tuple[Tuple, int]]], final: List[bool],
+              register: Dict[Tuple, int], path: List[Tuple[int, int]],
+              previous: Tuple, length: int) -> None:
+    """Replace each state on <path> after the first <length> with an equal
+    registered state, registering it if there is none, and remove it from
+    <path>.
+
+    <path> holds each state on the path of the sequence <previous>, with
+    the length of the prefix of <previous> leading to it.
+    """
+    while len(path) > length:
+        state = path.pop()[0]
+        parent, depth = path[-1]
+        key = (final[state], tuple(edges[state].values()))
+        if key in register:
+            label = edges[parent][previous[depth]][0]
+            edges[parent][previous[depth]] = (label, register[key])
+        else:
+            register[key] = state
+
+
+if __name__ == '__main__':
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-nested-blocks': 4,
+        'extra-imports': ['heapq', 'array', 'bisect', 'itertools',
+                          'prefix_tree']
+    })
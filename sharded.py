@@ -0,0 +1,296 @@
+"""CSC148 Assignment 2: Sharded autocompleter
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains an Autocompleter that splits its values between several
+prefix trees (shards), each owned by its own worker process, and runs each
+query on all of them at once, merging their sorted answers.
+
+Values are assigned to shards by a CRC-32 digest of their prefix, which is
+the same in every process and every run, so every shard holds about the same
+share of the matches of any prefix, and broad queries (such as a single
+letter with no limit) are split evenly between them.
+
+The shards are searched in parallel, but every answer is pickled on its way
+back from a worker, so sharding only pays off for broad queries on a machine
+with a core to spare for each shard. Narrow queries, or a single core, are
+faster on one prefix tree.
+"""
+from __future__ import annotations
+import heapq
+import multiprocessing
+import threading
+import zlib
+from itertools import islice
+from multiprocessing.connection import Connection
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+from prefix_tree import Autocompleter
+
+
+def _shard_index(prefix: List, shards: int) -> int:
+    """Return the index of the shard, out of <shards>, storing the values
+    with the given prefix.
+    """
+    return zlib.crc32(repr(tuple(prefix)).encode('utf-8')) % shards
+
+
+def _serve(connection: Connection, tree_class: type, weight_type: str,
+           top_k: int, compact_after: int) -> None:
+    """Run the calls received on <connection> on a new empty shard of class
+    <tree_class>, until None is received.
+
+    Each call is a tuple (method name, arguments), and is answered with a
+    tuple (True, result), or (False, error) if it raised an error. Iterators
+    are sent back as lists.
+    """
+    shard = tree_class.from_items(weight_type, [], top_k,
+                                  compact_after=compact_after)
+    request = connection.recv()
+    while request is not None:
+        method, args = request
+        try:
+            result = getattr(shard, method)(*args)
+            if isinstance(result, Iterator):
+                result = list(result)
+        except Exception as error:
+            connection.send((False, error))
+        else:
+            connection.send((True, result))
+        request = connection.recv()
+    connection.close()
+
+
+class ShardedAutocompleter(Autocompleter):
+    """An Autocompleter storing its values in several prefix trees, each in
+    its own worker process.
+
+    === Attributes ===
+    tree_class:
+        The class of the shards.
+    weight_type:
+        The weight type of the shards; either sum or average.
+    shards:
+        The number of shards. Each value is stored in the shard given by
+        _shard_index(prefix, shards), where prefix is its prefix sequence.
+
+    === Private Attributes ===
+    _top_k:
+        The top_k every shard was built with.
+    _compact_after:
+        The compact_after every shard was built with.
+    _connections:
+        The connections to the worker process of each shard, or None if
+        this Autocompleter has been closed.
+    _processes:
+        The worker process of each shard.
+    _local:
+        The shards themselves, once this Autocompleter has been closed, and
+        None before that.
+    _lock:
+        The lock held while calls are sent to the workers and answered, so
+        that threads sharing this Autocompleter do not read each other's
+        answers.
+    """
+    tree_class: type
+    weight_type: str
+    shards: int
+    _top_k: int
+    _compact_after: int
+    _connections: Optional[List[Connection]]
+    _processes: List[multiprocessing.Process]
+    _local: Optional[List[Autocompleter]]
+    _lock: threading.Lock
+
+    def __init__(self, tree_class: type, weight_type: str, shards: int,
+                 top_k: int = 0, compact_after: int = 0) -> None:
+        """Initialize an empty Autocompleter storing its values in <shards>
+        new trees of class <tree_class>, each built with from_items and the
+        given <weight_type>, <top_k> and <compact_after>, and each in a new
+        worker process.
+
+        Precondition: shards > 0
+        """
+        self.tree_class = tree_class
+        self.weight_type = weight_type
+        self.shards = shards
+        self._top_k = top_k
+        self._compact_after = compact_after
+        self._connections = []
+        self._processes = []
+        self._local = None
+        self._lock = threading.Lock()
+        for _ in range(shards):
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_serve, daemon=True,
+                args=(child, tree_class, weight_type, top_k, compact_after))
+            process.start()
+            child.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    @classmethod
+    def from_items(cls, tree_class: type, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]], shards: int,
+                   top_k: int = 0,
+                   compact_after: int = 0) -> ShardedAutocompleter:
+        """Return a new Autocompleter storing the given items in <shards>
+        new trees of class <tree_class>, as in __init__.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+
+        Preconditions:
+            shards > 0
+            As for insert, for each item.
+        """
+        sharded = cls(tree_class, weight_type, shards, top_k, compact_after)
+        sharded.insert_items(items)
+        return sharded
+
+    def close(self) -> None:
+        """Stop the worker processes of this Autocompleter, moving their
+        shards into this process.
+
+        This Autocompleter can still be used afterwards, but searches its
+        shards one at a time. Closing it again does nothing.
+        """
+        if self._connections is None:
+            return
+        parts = self._call_each('items', [()] * self.shards)
+        with self._lock:
+            for connection, process in zip(self._connections,
+                                           self._processes):
+                connection.send(None)
+                process.join()
+                connection.close()
+            self._connections = None
+        self._local = [self.tree_class.from_items(
+            self.weight_type, part, self._top_k,
+            compact_after=self._compact_after) for part in parts]
+
+    def _call_each(self, method: str, args: List[tuple]) -> List[Any]:
+        """Return the result of calling the given method of each shard, with
+        the arguments at the same index of <args>.
+
+        The shards run the calls in parallel while the worker processes are
+        running. If any call raised an error, the first such error is raised
+        once every shard has answered.
+        """
+        if self._connections is None:
+            return [getattr(shard, method)(*shard_args)
+                    for shard, shard_args in zip(self._local, args)]
+        with self._lock:
+            for connection, shard_args in zip(self._connections, args):
+                connection.send((method, shard_args))
+            answers = [connection.recv() for connection in self._connections]
+        for succeeded, result in answers:
+            if not succeeded:
+                raise result
+        return [result for _, result in answers]
+
+    def _call_all(self, method: str, *args: Any) -> List[Any]:
+        """Return the result of calling the given method of every shard with
+        the given arguments, as in _call_each.
+        """
+        return self._call_each(method, [args] * self.shards)
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return sum(self._call_all('__len__'))
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        self.insert_items([(value, weight, prefix)])
+
+    def insert_items(self, items: Iterable[Tuple[Any, float, List]]) -> None:
+        """Insert each of the given items into this Autocompleter, passing
+        each shard its own items at once.
+
+        Each item is a tuple (value, weight, prefix), as passed to insert.
+
+        Preconditions: as for insert, for each item.
+        """
+        parts = [[] for _ in range(self.shards)]
+        for item in items:
+            parts[_shard_index(item[2], self.shards)].append(item)
+        self._call_each('insert_items', [(part,) for part in parts])
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Each shard returns up to <limit> of its own matches, in
+        non-increasing weight, and these lists are merged.
+
+        Precondition: limit is None or limit > 0.
+        """
+        results = self._call_all('autocomplete', prefix, limit)
+        merged = heapq.merge(*results, key=lambda x: x[1], reverse=True)
+        return list(islice(merged, limit))
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) -> \
+            List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete(prefix, limit) for each prefix in
+        <prefixes>, in the same order.
+
+        Each shard answers all the prefixes at once with its own
+        autocomplete_many, and the answers for each prefix are merged.
+
+        Precondition: limit is None or limit > 0.
+        """
+        results = self._call_all('autocomplete_many', prefixes, limit)
+        return [list(islice(heapq.merge(*answers, key=lambda x: x[1],
+                                        reverse=True), limit))
+                for answers in zip(*results)]
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        self._call_all('remove', prefix)
+
+    def compact(self) -> None:
+        """Finish any removals the shards have deferred."""
+        self._call_all('compact')
+
+    def items(self) -> Iterator[Tuple[Any, float, List]]:
+        """Yield a tuple (value, weight, prefix) for each value stored in
+        this Autocompleter, as it would be passed to insert, one shard at a
+        time.
+        """
+        for part in self._call_all('items'):
+            yield from part
+
+
+if __name__ == '__main__':
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-nested-blocks': 4,
+        'extra-imports': ['heapq', 'multiprocessing', 'threading', 'zlib',
+                          'itertools', 'multiprocessing.connection',
+                          'prefix_tree']
+    })
@@ -0,0 +1,303 @@
+"""CSC148 Assignment 2: Prefix tree snapshots
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains a flat binary format for saving a prefix tree, and a
+read-only Autocompleter that answers queries directly from a saved image.
+
+A snapshot file starts with a header listing where each of its sections
+starts and how long it is. The sections are:
+    - one array per node attribute (weight, largest value weight, first
+      child, number of children, first label element of the node, start and
+      length of its label, and the id of its value, or -1 for non-leaves),
+      with the children of each node stored next to each other and sorted
+      by their first label element,
+    - the label pool: the labels of all nodes, as ids of prefix elements,
+    - the value table: the pickled values of all leaves, and where each one
+      starts,
+    - the pickled list of distinct prefix elements, and the pickled metadata
+      of the tree (its weight type, size, and any extra data of the caller).
+
+Loading a snapshot maps the file into memory and reads the arrays in place,
+so no tree objects are created, startup only costs the pages a query
+touches, and several processes loading the same file share its pages.
+
+Only load snapshots you saved yourself: values and prefix elements are
+stored with pickle.
+"""
+from __future__ import annotations
+import heapq
+import mmap
+import pickle
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from prefix_tree import Autocompleter, SimplePrefixTree, \
+    CompressedPrefixTree
+
+MAGIC = b'PTSNAP01'
+
+# The sections of a snapshot, with the array typecode of their items.
+_SECTIONS = [('weight', 'd'), ('max', 'd'), ('first_child', 'I'),
+             ('child_count', 'I'), ('child_key', 'I'), ('label_start', 'I'),
+             ('label_length', 'I'), ('value_id', 'i'), ('labels', 'I'),
+             ('value_start', 'Q'), ('values', 'B'), ('tokens', 'B'),
+             ('meta', 'B')]
+
+# The header: the magic bytes, the byte order of the arrays, and the offset
+# and size in bytes of each section.
+_HEADER = struct.Struct('<8s8s' + 'QQ' * len(_SECTIONS))
+
+# The child_key of a leaf, which sorts after every prefix element id.
+_LEAF_KEY = 0xFFFFFFFF
+
+
+def save_snapshot(tree: Any, path: str, extra: Any = None) -> None:
+    """Save a snapshot of <tree>, a SimplePrefixTree or CompressedPrefixTree,
+    to the file at <path>.
+
+    Any other Autocompleter is saved as a CompressedPrefixTree storing its
+    items (see Autocompleter.items), which answers the same queries.
+
+    <extra> is any picklable data the caller wants stored alongside the tree;
+    it is available as the extra attribute of the loaded snapshot.
+    """
+    if not isinstance(tree, (SimplePrefixTree, CompressedPrefixTree)):
+        tree = CompressedPrefixTree.from_items(tree.weight_type, tree.items())
+    tree.compact()
+    compressed = isinstance(tree, CompressedPrefixTree)
+    arrays = {name: array(code) for name, code in _SECTIONS[:-3]}
+    tokens = {}
+    values = bytearray()
+    arrays['value_start'].append(0)
+
+    # Nodes are numbered breadth-first, so that the children of each node
+    # get consecutive numbers.
+    queue = [(tree, tuple(tree._label) if compressed else ())]
+    for node, label in queue:
+        arrays['weight'].append(node.weight)
+        arrays['max'].append(node._max)
+        arrays['label_start'].append(len(arrays['labels']))
+        arrays['label_length'].append(len(label))
+        for item in label:
+            arrays['labels'].append(tokens.setdefault(item, len(tokens)))
+        if node._children is None:
+            arrays['child_key'].append(_LEAF_KEY)
+            arrays['value_id'].append(len(arrays['value_start']) - 1)
+            values += pickle.dumps(node._label)
+            arrays['value_start'].append(len(values))
+        else:
+            if label:
+                arrays['child_key'].append(tokens[label[0]])
+            else:
+                arrays['child_key'].append(_LEAF_KEY)
+            arrays['value_id'].append(-1)
+        arrays['first_child'].append(len(queue))
+        arrays['child_count'].append(len(node.subtrees))
+        children = []
+        for subtree in node.subtrees:
+            if subtree._children is None:
+                children.append((_LEAF_KEY, subtree, ()))
+            else:
+                sublabel = subtree._label if compressed else (subtree._label,)
+                key = tokens.setdefault(sublabel[0], len(tokens))
+                children.append((key, subtree, tuple(sublabel)))
+        children.sort(key=lambda child: child[0])
+        queue.extend([(subtree, sublabel)
+                      for _, subtree, sublabel in children])
+
+    token_list = [None] * len(tokens)
+    for item, i in tokens.items():
+        token_list[i] = item
+    meta = {'weight_type': tree.weight_type, 'count': len(tree),
+            'extra': extra}
+    sections = [arrays[name].tobytes() for name, _ in _SECTIONS[:-3]]
+    sections.extend([bytes(values), pickle.dumps(token_list),
+                     pickle.dumps(meta)])
+
+    fields = []
+    offset = _HEADER.size
+    for section in sections:
+        offset += -offset % 8
+        fields.extend([offset, len(section)])
+        offset += len(section)
+    byteorder = sys.byteorder.encode().ljust(8, b'\0')
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, byteorder, *fields))
+        for section, start in zip(sections, fields[::2]):
+            f.write(b'\0' * (start - f.tell()))
+            f.write(section)
+
+
+class PrefixTreeSnapshot(Autocompleter):
+    """A read-only Autocompleter answering queries from a saved snapshot.
+
+    The snapshot file is memory-mapped, and autocomplete reads the node
+    arrays in place; only the values it returns are unpickled.
+
+    === Attributes ===
+    weight_type:
+        The weight type of the saved tree; either sum or average.
+    extra:
+        The extra data saved with the tree.
+
+    === Private Attributes ===
+    _mmap:
+        The memory-mapped snapshot file.
+    _arrays:
+        Maps each section name to a view of that section.
+    _tokens:
+        Maps each prefix element to its id in the label pool.
+    _count:
+        The number of values in the saved tree.
+    """
+    weight_type: str
+    extra: Any
+    _mmap: mmap.mmap
+    _arrays: Dict[str, memoryview]
+    _tokens: Dict[Any, int]
+    _count: int
+
+    def __init__(self, path: str) -> None:
+        """Load the snapshot saved at <path> by save_snapshot.
+
+        Raise ValueError if <path> is not a snapshot saved on a machine with
+        the same byte order.
+        """
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = _HEADER.unpack_from(self._mmap)
+        if fields[0] != MAGIC:
+            raise ValueError(f'{path} is not a prefix tree snapshot')
+        if fields[1].rstrip(b'\0') != sys.byteorder.encode():
+            raise ValueError(f'{path} was saved with a different byte order')
+        view = memoryview(self._mmap)
+        self._arrays = {}
+        for i, (name, code) in enumerate(_SECTIONS):
+            start, size = fields[2 + 2 * i], fields[3 + 2 * i]
+            self._arrays[name] = view[start:start + size].cast(code)
+
+        token_list = pickle.loads(self._arrays['tokens'])
+        self._tokens = {item: i for i, item in enumerate(token_list)}
+        meta = pickle.loads(self._arrays['meta'])
+        self.weight_type = meta['weight_type']
+        self.extra = meta['extra']
+        self._count = meta['count']
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return self._count
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Snapshots are read-only; raise NotImplementedError."""
+        raise NotImplementedError('prefix tree snapshots are read-only')
+
+    def remove(self, prefix: List) -> None:
+        """Snapshots are read-only; raise NotImplementedError."""
+        raise NotImplementedError('prefix tree snapshots are read-only')
+
+    def save(self, path: str) -> None:
+        """Save a copy of this snapshot to <path>."""
+        with open(path, 'wb') as f:
+            f.write(self._mmap)
+
+    def close(self) -> None:
+        """Release the memory-mapped snapshot file.
+
+        This snapshot must not be used afterwards.
+        """
+        for section in self._arrays.values():
+            section.release()
+        self._arrays = {}
+        self._mmap.close()
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        node = self._find(prefix)
+        if node is None:
+            return []
+        weights = self._arrays['weight']
+        maxima = self._arrays['max']
+        first_child = self._arrays['first_child']
+        child_count = self._arrays['child_count']
+        value_id = self._arrays['value_id']
+
+        new = []
+        heap = [(-maxima[node], node)]
+        while heap and len(new) != limit:
+            node = heapq.heappop(heap)[1]
+            if value_id[node] >= 0:
+                new.append((self._value(value_id[node]), weights[node],))
+            else:
+                first = first_child[node]
+                for child in range(first, first + child_count[node]):
+                    heapq.heappush(heap, (-maxima[child], child))
+        return new
+
+    def _find(self, prefix: List) -> Optional[int]:
+        """Return the number of the largest subtree whose values all match
+        <prefix>, or None if no value matches <prefix>.
+        """
+        if self._count == 0:
+            return None
+        ids = []
+        for item in prefix:
+            if item not in self._tokens:
+                return None
+            ids.append(self._tokens[item])
+        labels = self._arrays['labels']
+        label_start = self._arrays['label_start']
+        label_length = self._arrays['label_length']
+        first_child = self._arrays['first_child']
+        child_count = self._arrays['child_count']
+        child_key = self._arrays['child_key']
+
+        node = 0
+        depth = 0
+        while True:
+            start = label_start[node]
+            end = start + min(label_length[node], len(ids) - depth)
+            for i in range(start, end):
+                if labels[i] != ids[depth]:
+                    return None
+                depth += 1
+            if depth == len(ids):
+                return node
+            first = first_child[node]
+            keys = child_key[first:first + child_count[node]]
+            i = bisect_left(keys, ids[depth])
+            if i == len(keys) or keys[i] != ids[depth]:
+                return None
+            node = first + i
+
+    def _value(self, i: int) -> Any:
+        """Return the value with id <i>."""
+        value_start = self._arrays['value_start']
+        return pickle.loads(
+            self._arrays['values'][value_start[i]:value_start[i + 1]])
+
+
+if __name__ == '__main__':
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-nested-blocks': 4,
+        'allowed-io': ['save_snapshot', '__init__', 'save'],
+        'extra-imports': ['heapq', 'mmap', 'pickle', 'struct', 'sys', 'array',
+                          'bisect', 'prefix_tree']
+    })
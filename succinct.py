@@ -0,0 +1,378 @@
+"""CSC148 Assignment 2: Succinct prefix trees
+
+=== CSC148 Fall 2018 ===
+Department of Computer Science,
+University of Toronto
+
+=== Module description ===
+This file contains a read-only Autocompleter storing a frozen prefix tree in
+a few flat arrays instead of one object per tree, for serving a corpus that
+no longer changes.
+
+The shape of the tree is stored as a LOUDS (level-order unary degree
+sequence) bit vector: the trees are numbered breadth-first, and each one
+writes a 1 for each of its subtrees followed by a 0. The subtrees of a tree
+then have consecutive numbers, which rank and select queries on the bit
+vector recover, so no pointers are stored at all. Next to it are:
+    - a bit vector marking the leaves,
+    - the labels of all trees, packed into one array of prefix element ids
+      (one byte each when there are at most 256 distinct elements), and
+      where each label ends,
+    - the subtrees of each tree sorted by the first element id of their
+      labels, with those ids, so that finding the subtree to follow for a
+      prefix element is a binary search,
+    - the largest value weight of each tree, and the weight and value of
+      each leaf, in breadth-first order.
+
+A frozen tree answers autocomplete exactly as the tree it was made from,
+but without its top-k caches.
+"""
+from __future__ import annotations
+import heapq
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from prefix_tree import Autocompleter, CompressedPrefixTree
+
+# The number of ones in each byte.
+_POPCOUNT = bytes(bin(i).count('1') for i in range(256))
+
+# The position of the one with index k (counting from 0) in each byte b, at
+# index 8 * b + k, or 0 if b has no such one.
+_SELECT = bytes([([i for i in range(8) if b >> i & 1] + [0] * 8)[k]
+                 for b in range(256) for k in range(8)])
+
+_WORD_MASK = (1 << 64) - 1
+
+
+class _BitVector:
+    """An immutable sequence of bits supporting rank and select queries.
+
+    === Attributes ===
+    length:
+        The number of bits.
+
+    === Private Attributes ===
+    _words:
+        The bits, 64 to a word, from the least significant bit of each word.
+    _ranks:
+        The number of ones in the words before each word, with the total
+        number of ones at the end.
+    _zeros:
+        The number of zeros in the words before each word, with the total
+        number of zeros (counting the padding of the last word) at the end.
+    _samples:
+        The index of the word holding every 64th zero, so that select only
+        searches the words between two samples.
+    """
+    length: int
+    _words: array
+    _ranks: array
+    _zeros: array
+    _samples: array
+
+    def __init__(self, bits: List[int]) -> None:
+        """Initialize a bit vector storing <bits>, a list of 0s and 1s."""
+        self.length = len(bits)
+        self._words = array('Q', [0] * ((len(bits) + 63) // 64))
+        self._ranks = array('I', [0] * (len(self._words) + 1))
+        for w in range(len(self._words)):
+            word = 0
+            for i, bit in enumerate(bits[w * 64:w * 64 + 64]):
+                if bit:
+                    word |= 1 << i
+            self._words[w] = word
+            self._ranks[w + 1] = self._ranks[w] + bin(word).count('1')
+        self._zeros = array('I', [64 * w - self._ranks[w]
+                                  for w in range(len(self._ranks))])
+        self._samples = array('I')
+        for w in range(len(self._words)):
+            while 64 * len(self._samples) < self._zeros[w + 1]:
+                self._samples.append(w)
+
+    def nbytes(self) -> int:
+        """Return the number of bytes used by the arrays of this bit vector.
+        """
+        return sum([len(a) * a.itemsize
+                    for a in (self._words, self._ranks, self._zeros,
+                              self._samples)])
+
+    def get(self, i: int) -> bool:
+        """Return whether bit <i> is set."""
+        return bool(self._words[i >> 6] >> (i & 63) & 1)
+
+    def rank1(self, i: int) -> int:
+        """Return the number of ones before position <i>."""
+        rank = self._ranks[i >> 6]
+        if i & 63:
+            rank += bin(self._words[i >> 6] & ((1 << (i & 63)) - 1)).count('1')
+        return rank
+
+    def select0(self, k: int) -> int:
+        """Return the position of the zero with index <k> (counting from 0).
+
+        Precondition: there are more than k zeros.
+        """
+        # Find the last word with at most k zeros before it, starting from
+        # the word holding the sample before zero k; the words between two
+        # samples hold only 64 zeros, so there are few of them.
+        zeros = self._zeros
+        w = self._samples[k >> 6]
+        while zeros[w + 1] <= k:
+            w += 1
+        k -= zeros[w]
+        # Then find the byte of the word holding zero k, and the zero in it.
+        word = (~self._words[w] & _WORD_MASK).to_bytes(8, 'little')
+        i = 0
+        count = _POPCOUNT[word[0]]
+        while count <= k:
+            k -= count
+            i += 1
+            count = _POPCOUNT[word[i]]
+        return 64 * w + 8 * i + _SELECT[8 * word[i] + k]
+
+    def next0(self, i: int) -> int:
+        """Return the position of the first zero at or after position <i>.
+
+        Precondition: there is a zero at or after position i.
+        """
+        w = i >> 6
+        zeros = (~self._words[w] & _WORD_MASK) >> (i & 63)
+        while zeros == 0:
+            w += 1
+            i = w << 6
+            zeros = ~self._words[w] & _WORD_MASK
+        return i + (zeros & -zeros).bit_length() - 1
+
+
+def _typecode(largest: int) -> str:
+    """Return the typecode of the smallest unsigned array that can store
+    every int from 0 to <largest>.
+    """
+    if largest < 1 << 8:
+        return 'B'
+    elif largest < 1 << 16:
+        return 'H'
+    return 'I'
+
+
+class FrozenPrefixTree(Autocompleter):
+    """A read-only Autocompleter storing a prefix tree in flat arrays.
+
+    === Attributes ===
+    weight_type:
+        The weight type of the frozen tree; either sum or average.
+
+    === Private Attributes ===
+    _louds:
+        The LOUDS bit vector of the shape of the tree.
+    _leaves:
+        Bit i is set if tree i is a leaf.
+    _labels:
+        The ids of the elements of the labels of every tree, in order.
+    _label_end:
+        Where the label of each tree ends in _labels; the label of tree i
+        starts where the label of tree i - 1 ends (or at 0).
+    _by_label:
+        The subtrees of each tree, in the positions of its subtrees but
+        sorted by the first element id of their labels, with leaves last;
+        each is stored as its offset from the first subtree of the tree.
+    _child_labels:
+        The first element id of the label of each tree in _by_label, or the
+        number of ids for a leaf.
+    _max:
+        The largest weight of a value stored in each tree.
+    _weights:
+        The weight of each leaf, in order.
+    _values:
+        The value of each leaf, in order.
+    _tokens:
+        Maps each prefix element to its id in _labels.
+    _count:
+        The number of values in the tree.
+    """
+    weight_type: str
+    _louds: _BitVector
+    _leaves: _BitVector
+    _labels: array
+    _label_end: array
+    _by_label: array
+    _child_labels: array
+    _max: array
+    _weights: array
+    _values: List[Any]
+    _tokens: Dict[Any, int]
+    _count: int
+
+    def __init__(self, tree: Any) -> None:
+        """Initialize a frozen copy of <tree>, a SimplePrefixTree or
+        CompressedPrefixTree.
+        """
+        compressed = isinstance(tree, CompressedPrefixTree)
+        self.weight_type = tree.weight_type
+        self._tokens = {}
+        self._values = []
+        self._count = len(tree)
+        louds = []
+        leaves = []
+        labels = []
+        first_ids = [None]
+        ranges = []
+        self._label_end = array('I')
+        self._max = array('d')
+        self._weights = array('d')
+
+        # Trees are numbered breadth-first, keeping the order of subtrees
+        # so that autocomplete breaks ties as the original tree does.
+        queue = [tree]
+        for node in queue:
+            self._max.append(node._max)
+            if node._children is None:
+                leaves.append(1)
+                self._weights.append(node.weight)
+                self._values.append(node._label)
+            else:
+                leaves.append(0)
+                if compressed:
+                    label = node._label
+                elif node is tree:
+                    label = ()
+                else:
+                    label = (node._label,)
+                for item in label:
+                    labels.append(self._tokens.setdefault(item,
+                                                          len(self._tokens)))
+                ranges.append((len(queue), len(node.subtrees)))
+            self._label_end.append(len(labels))
+            for subtree in node.subtrees:
+                if subtree._children is None:
+                    first_ids.append(None)
+                elif compressed:
+                    first_ids.append(self._tokens.setdefault(
+                        subtree._label[0], len(self._tokens)))
+                else:
+                    first_ids.append(self._tokens.setdefault(
+                        subtree._label, len(self._tokens)))
+            louds.extend([1] * len(node.subtrees))
+            louds.append(0)
+            queue.extend(node.subtrees)
+
+        keys = [len(self._tokens) if key is None else key
+                for key in first_ids]
+        by_label = list(range(len(queue)))
+        for first, count in ranges:
+            by_label[first:first + count] = sorted(
+                range(first, first + count), key=keys.__getitem__)
+        degree = max([count for _, count in ranges], default=0)
+        self._by_label = array(_typecode(degree), [0] * len(queue))
+        for first, count in ranges:
+            for i in range(first, first + count):
+                self._by_label[i] = by_label[i] - first
+
+        code = _typecode(len(self._tokens))
+        self._labels = array(code, labels)
+        self._child_labels = array(code, [keys[i] for i in by_label])
+        self._louds = _BitVector(louds)
+        self._leaves = _BitVector(leaves)
+
+    def nbytes(self) -> int:
+        """Return the number of bytes used by the arrays of this tree, not
+        counting its values.
+        """
+        arrays = [self._labels, self._label_end, self._by_label,
+                  self._child_labels, self._max, self._weights]
+        return (self._louds.nbytes() + self._leaves.nbytes() +
+                sum([len(a) * a.itemsize for a in arrays]))
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return self._count
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Frozen trees are read-only; raise NotImplementedError."""
+        raise NotImplementedError('frozen prefix trees are read-only')
+
+    def remove(self, prefix: List) -> None:
+        """Frozen trees are read-only; raise NotImplementedError."""
+        raise NotImplementedError('frozen prefix trees are read-only')
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        node = self._find(prefix)
+        if node is None:
+            return []
+        new = []
+        heap = [(-self._max[node], 0, node)]
+        counter = 1
+        leaves = self._leaves
+        maxes = self._max
+        while heap and len(new) != limit:
+            node = heapq.heappop(heap)[2]
+            if leaves.get(node):
+                leaf = leaves.rank1(node)
+                new.append((self._values[leaf], self._weights[leaf],))
+            else:
+                first, count = self._subtrees(node)
+                for subtree in range(first, first + count):
+                    heapq.heappush(heap, (-maxes[subtree], counter, subtree))
+                    counter += 1
+        return new
+
+    def _subtrees(self, node: int) -> Tuple[int, int]:
+        """Return the number of the first subtree of tree <node>, and how
+        many subtrees it has.
+        """
+        start = 0 if node == 0 else self._louds.select0(node - 1) + 1
+        count = self._louds.next0(start) - start
+        # The node zeros before <start> end trees 0 to node - 1, so the
+        # ones before it are the subtrees of those trees, numbered from 1.
+        return start - node + 1, count
+
+    def _find(self, prefix: List) -> Optional[int]:
+        """Return the number of the largest subtree whose values all match
+        <prefix>, or None if no value matches <prefix>.
+        """
+        if self._count == 0:
+            return None
+        ids = []
+        for item in prefix:
+            if item not in self._tokens:
+                return None
+            ids.append(self._tokens[item])
+
+        node = 0
+        depth = 0
+        while True:
+            start = self._label_end[node - 1] if node > 0 else 0
+            end = start + min(self._label_end[node] - start, len(ids) - depth)
+            for i in range(start, end):
+                if self._labels[i] != ids[depth]:
+                    return None
+                depth += 1
+            if depth == len(ids):
+                return node
+            first, count = self._subtrees(node)
+            i = bisect_left(self._child_labels, ids[depth], first,
+                            first + count)
+            if i == first + count or self._child_labels[i] != ids[depth]:
+                return None
+            node = first + self._by_label[i]
+
+
+if __name__ == '__main__':
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-nested-blocks': 4,
+        'extra-imports': ['heapq', 'array', 'bisect', 'prefix_tree']
+    })